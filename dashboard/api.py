@@ -0,0 +1,161 @@
+"""
+Read-only JSON API for the numbers behind the dashboard.
+
+Filing counts, mean pay and pay percentiles by employer, SOC and state are
+served from the aggregate tables precomputed in each fiscal-year partition
+(see partitions.write_aggregates), never from the rows:
+
+    GET  api/v1/years/
+    GET  api/v1/aggregates/?year=2019&group_by=employer&states=CA&limit=10
+    POST api/v1/aggregates/batch/
+         {"year": 2019, "cells": [{"employer": "GOOGLE", "state": "CA"}, ...]}
+
+The selection parameters are the same as the export's (companies, jobs and
+states, repeated for several values). Like the dashboard's charts, the
+figures only count filings in the SOC major groups the dashboard shows
+(H1B_SOC_MAJOR_GROUPS), which every response names in soc_major_groups. Rendered responses are cached per
+dataset version and carry an ETag, so unchanged answers cost a dictionary
+lookup and clients revalidating get a 304.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from dashboard import warmup
+from dashboard.cache import LRUCache, normalize_selection
+from dashboard.dataset import CUBE_DIMENSIONS, DIMENSIONS
+from dashboard.export import selection
+from dashboard.http_cache import CachedBody, cached_response
+from dashboard.partitions import AGGREGATE_PERCENTILES
+
+# dimension for each name used in the api - employer, soc and state
+DIMENSION_NAMES = {name: dim for dim, name in CUBE_DIMENSIONS.items()}
+
+CONTENT_TYPE = 'application/json'
+
+responses = LRUCache(
+    sizeof=lambda entry: sum(len(body) for body in entry.bodies.values()),
+    **settings.H1B_API_CACHE
+)
+
+
+class BadRequest(Exception):
+    pass
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def catalog():
+    return warmup.wait().catalog
+
+
+def aggregates_for(year):
+    """the YearAggregates for a year given as a string, or for the default year"""
+    try:
+        return catalog().aggregates(int(year) if year else None)
+    except (TypeError, ValueError):
+        raise BadRequest("year must be a fiscal year like 2019, not %r" % year)
+    except KeyError:
+        raise BadRequest("no H1B data for fiscal year %s" % year)
+
+
+def cached_json(request, key, version, render):
+    """response for the json of render(), rendered once per key and dataset version"""
+    entry = responses.get_or_compute((version, ) + key, lambda: CachedBody(
+        version, json.dumps(render()).encode('utf-8'), CONTENT_TYPE,
+    ))
+    return cached_response(request, entry, settings.H1B_API_CACHE_CONTROL)
+
+
+@require_GET
+def years_view(request):
+    """the fiscal years with data and the dataset version of each"""
+    partitions = catalog()
+    return JsonResponse({
+        'default_year': partitions.default_year,
+        'soc_major_groups': sorted(partitions.soc_major_groups),
+        # versions come from the manifests alone, without loading any year's tables
+        'years': {str(year): partitions.version(year) for year in partitions.years},
+    })
+
+
+@require_GET
+def aggregates_view(request):
+    """counts and pay of each cell of a grouping, largest first"""
+    try:
+        aggregates = aggregates_for(request.GET.get('year'))
+        names = [
+            name for value in request.GET.getlist('group_by') or ['employer']
+            for name in value.split(',') if name
+        ]
+        unknown = set(names) - set(DIMENSION_NAMES)
+        if unknown or not names:
+            raise BadRequest("group_by must be some of %s" % ', '.join(DIMENSION_NAMES))
+        group_by = tuple(dim for dim in DIMENSIONS if CUBE_DIMENSIONS[dim] in names)
+        limit = int(request.GET.get('limit') or settings.H1B_API_MAX_RESULTS)
+        if not 0 < limit <= settings.H1B_API_MAX_RESULTS:
+            raise BadRequest("limit must be between 1 and %d" % settings.H1B_API_MAX_RESULTS)
+    except BadRequest as e:
+        return error(str(e))
+    except ValueError:
+        return error("limit must be a number")
+
+    chosen = {dim: selection(request, dim) for dim in DIMENSIONS}
+    key = ('aggregates', group_by, limit) + tuple(
+        normalize_selection(chosen[dim]) for dim in DIMENSIONS
+    )
+
+    def render():
+        grouping, results = aggregates.query(group_by, chosen, limit)
+        return {
+            'version': aggregates.version,
+            'soc_major_groups': aggregates.soc_major_groups,
+            'group_by': [CUBE_DIMENSIONS[dim] for dim in grouping],
+            'percentiles': AGGREGATE_PERCENTILES,
+            'results': results,
+        }
+
+    try:
+        return cached_json(request, key, aggregates.version, render)
+    except ValueError as e:
+        return error(str(e))
+
+
+@csrf_exempt
+@require_POST
+def batch_view(request):
+    """counts and pay for many cells in one request, in the order they were asked for"""
+    try:
+        body = json.loads(request.body)
+        if not isinstance(body, dict) or not isinstance(body.get('cells'), list):
+            raise BadRequest('the body must be {"year": ..., "cells": [{"employer": ...}, ...]}')
+        aggregates = aggregates_for(body.get('year'))
+        if len(body['cells']) > settings.H1B_API_MAX_BATCH:
+            raise BadRequest("at most %d cells can be requested at once" % settings.H1B_API_MAX_BATCH)
+        cells = []
+        for cell in body['cells']:
+            if (not isinstance(cell, dict) or not cell or set(cell) - set(DIMENSION_NAMES)
+                    or not all(isinstance(value, str) for value in cell.values())):
+                raise BadRequest(
+                    "each cell names a value of some of %s, e.g. "
+                    '{"employer": "GOOGLE", "state": "CA"}' % ', '.join(DIMENSION_NAMES)
+                )
+            cells.append({DIMENSION_NAMES[name]: value for name, value in cell.items()})
+    except ValueError:
+        return error("the body must be json")
+    except BadRequest as e:
+        return error(str(e))
+
+    digest = hashlib.sha256(json.dumps(body['cells'], sort_keys=True).encode('utf-8')).hexdigest()
+    return cached_json(request, ('batch', digest), aggregates.version, lambda: {
+        'version': aggregates.version,
+        'soc_major_groups': aggregates.soc_major_groups,
+        'percentiles': AGGREGATE_PERCENTILES,
+        'results': aggregates.lookup_cells(cells),
+    })
@@ -0,0 +1,131 @@
+"""
+Small in-process caches shared by the dashboard callbacks.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def default_sizeof(value):
+    """bytes held by a cached value - numpy arrays report their buffer size"""
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return nbytes
+    return sys.getsizeof(value)
+
+
+def normalize_selection(values):
+    """hashable, order-independent form of a dropdown value; None stays None"""
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted(set(values)))
+
+
+class LRUCache:
+    """thread-safe least-recently-used cache
+
+    Entries are evicted once there are more than max_entries of them or
+    their combined size exceeds max_bytes, and are treated as missing once
+    they are older than ttl seconds. Hit, miss and eviction counters are kept
+    for the metrics view.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=None, ttl=None, sizeof=default_sizeof,
+                 timer=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.timer = timer
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        """entry for key if present and not expired; caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and self.timer() - entry[2] > self.ttl:
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.nbytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # would evict everything else and still not fit
+                return value
+            self._entries[key] = (value, size, self.timer())
+            self.nbytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        """cached value for key, calling compute() and caching its result on a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.put(key, compute())
+        return value
+
+    def items(self):
+        """list of (key, value) of the entries that haven't expired, least recently used first"""
+        with self._lock:
+            now = self.timer()
+            return [
+                (key, entry[0]) for key, entry in self._entries.items()
+                if self.ttl is None or now - entry[2] <= self.ttl
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
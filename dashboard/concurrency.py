@@ -0,0 +1,135 @@
+"""
+Concurrency limits for serving the dashboard over ASGI.
+
+Under ASGI the event loop reads request bodies and holds idle keep-alive
+connections without using a thread, and Django runs each view on the loop's
+default executor. CallbackLimitMiddleware replaces that executor with a
+bounded thread pool, and only lets a fixed number of Dash callback requests
+run on it at once. A bounded number more may wait for a slot; past that (or
+after waiting too long) callbacks are answered straight away with a 503 and
+a Retry-After header, so a burst of slow callbacks cannot pile up behind the
+page and asset requests.
+
+Django itself draws the content of streaming responses (the /export/
+download) on the event loop, which would stall every other request of the
+process while a large export is written. ThreadedStreamingHandler generates
+each part on the thread pool instead.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+# path suffixes of the Dash callback endpoints served by django_plotly_dash
+CALLBACK_PATHS = ('_dash-update-component', )
+
+
+def asgi2(application):
+    """wrap an ASGI3 application in the double-callable ASGI2 style channels 2 expects"""
+    return lambda scope: partial(application, scope)
+
+
+class ThreadedStreamingHandler(ASGIHandler):
+    """Django's ASGI handler, generating streaming response content on the thread pool"""
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (str(header).encode('ascii'), str(value).encode('latin1'))
+            for header, value in response.items()
+        ] + [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        parts = iter(response)
+        done = object()
+        while True:
+            part = await sync_to_async(next)(parts, done)
+            if part is done:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close)()
+
+
+class CallbackLimitMiddleware:
+    """ASGI3 middleware bounding the threads and concurrency used by Dash callbacks"""
+
+    def __init__(self, application, threads=8, callback_concurrency=4, max_queued=32,
+                 queue_timeout=10, retry_after=1):
+        self.application = application
+        self.threads = threads
+        self.callback_concurrency = callback_concurrency
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.running = 0
+        self.queued = 0
+        self.rejected = 0
+
+        # created on first use so they belong to the server's event loop
+        self._loop = None
+        self._slots = None
+
+    def _bind(self):
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            loop.set_default_executor(ThreadPoolExecutor(
+                max_workers=self.threads, thread_name_prefix='h1b-asgi',
+            ))
+            self._slots = asyncio.Semaphore(self.callback_concurrency)
+            self._loop = loop
+
+    def is_callback(self, scope):
+        return scope['type'] == 'http' and scope['path'].rstrip('/').endswith(CALLBACK_PATHS)
+
+    async def __call__(self, scope, receive, send):
+        self._bind()
+        if not self.is_callback(scope):
+            return await self.application(scope, receive, send)
+
+        if not self._slots.locked():
+            # a free slot is taken straight away, without counting as queued
+            await self._slots.acquire()
+        elif self.queued >= self.max_queued:
+            return await self.reject(send)
+        else:
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return await self.reject(send)
+            finally:
+                self.queued -= 1
+
+        self.running += 1
+        try:
+            return await self.application(scope, receive, send)
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    async def reject(self, send):
+        """answer a callback with 503 Service Unavailable without running it"""
+        self.rejected += 1
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'text/plain'),
+                (b'retry-after', str(self.retry_after).encode('ascii')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'busy - retry shortly'})
+
+    def stats(self):
+        """callbacks running and waiting now, and rejected since the server started"""
+        return {'running': self.running, 'queued': self.queued, 'rejected': self.rejected}
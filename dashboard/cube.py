@@ -0,0 +1,156 @@
+"""
+Precomputed row counts over the (employer, SOC, state) combinations.
+
+Only combinations that actually occur are stored, as parallel code arrays
+sorted by employer, so the count charts can be answered by summing slices of
+the cube without looking at the underlying rows.
+
+When built with pay values, every cell also keeps a sparse histogram of
+annual pay on a shared bin grid, so salary distributions for any selection
+are the sum of the selected cells' histograms.
+"""
+import numpy as np
+
+
+def ranges(starts, ends):
+    """concatenation of np.arange(start, end) for each pair, without a python loop"""
+    lengths = ends - starts
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shifts + np.arange(lengths.sum(), dtype=np.int64)
+
+
+class CountCube:
+    """sparse count cube over employer, SOC and state codes
+
+    sizes is the number of codes in each dimension, including the trailing
+    code used for missing values.
+    """
+
+    DIMENSIONS = ('employer', 'soc', 'state')
+
+    # every array of a cube, as saved by arrays() and restored by from_arrays()
+    ARRAYS = ('employer', 'soc', 'state', 'counts', 'employer_offsets')
+    HISTOGRAM_ARRAYS = ('bin_edges', 'hist_cells', 'hist_bins', 'hist_counts', 'hist_offsets')
+
+    def __init__(self, employer, soc, state, counts, sizes, employer_offsets=None):
+        self.employer = employer
+        self.soc = soc
+        self.state = state
+        self.counts = counts
+        self.sizes = sizes
+
+        # cells for employer e are employer_offsets[e]:employer_offsets[e + 1]
+        if employer_offsets is None:
+            employer_offsets = np.zeros(sizes[0] + 1, dtype=np.int64)
+            np.cumsum(np.bincount(employer, minlength=sizes[0]), out=employer_offsets[1:])
+        self.employer_offsets = employer_offsets
+
+        self.bin_edges = None
+
+    @classmethod
+    def from_codes(cls, employer, soc, state, sizes, pay=None, bin_edges=None):
+        """count every combination of the three code columns
+
+        If pay and bin_edges are given, per-cell pay histograms are built too.
+        """
+        n_employer, n_soc, n_state = sizes
+        key = (employer.astype(np.int64) * n_soc + soc) * n_state + state
+        cells, row_cells, counts = np.unique(key, return_inverse=True, return_counts=True)
+
+        cell_state = cells % n_state
+        cell_soc = (cells // n_state) % n_soc
+        cell_employer = cells // (n_state * n_soc)
+        cube = cls(
+            cell_employer.astype(employer.dtype),
+            cell_soc.astype(soc.dtype),
+            cell_state.astype(state.dtype),
+            counts,
+            sizes,
+        )
+        if pay is not None:
+            cube.add_histograms(row_cells, pay, bin_edges)
+        return cube
+
+    @classmethod
+    def from_arrays(cls, arrays, sizes):
+        """rebuild a cube from the dict returned by arrays(), without copying"""
+        cube = cls(
+            arrays['employer'], arrays['soc'], arrays['state'], arrays['counts'], sizes,
+            employer_offsets=arrays['employer_offsets'],
+        )
+        if 'bin_edges' in arrays:
+            for name in cls.HISTOGRAM_ARRAYS:
+                setattr(cube, name, arrays[name])
+        return cube
+
+    def arrays(self):
+        """dict of every array of the cube, by name"""
+        names = self.ARRAYS
+        if self.bin_edges is not None:
+            names += self.HISTOGRAM_ARRAYS
+        return {name: getattr(self, name) for name in names}
+
+    def add_histograms(self, row_cells, pay, bin_edges):
+        """store a sparse pay histogram per cell, given each row's cell index"""
+        n_bins = len(bin_edges) - 1
+        bins = np.clip(np.searchsorted(bin_edges, pay, side='right') - 1, 0, n_bins - 1)
+        keys, counts = np.unique(row_cells.astype(np.int64) * n_bins + bins, return_counts=True)
+
+        # histogram entries for cell c are hist_offsets[c]:hist_offsets[c + 1]
+        self.bin_edges = np.asarray(bin_edges, dtype=np.float64)
+        self.hist_cells = keys // n_bins
+        self.hist_bins = keys % n_bins
+        self.hist_counts = counts
+        self.hist_offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.hist_cells, minlength=len(self)), out=self.hist_offsets[1:])
+
+    def __len__(self):
+        return len(self.counts)
+
+    def cells(self, employers=None, soc_table=None, state_table=None):
+        """indexes of the cells matching a selection
+
+        employers is an array of employer codes, and soc_table / state_table
+        are boolean lookup tables indexed by code; None means no filter.
+        """
+        if employers is None:
+            cells = np.arange(len(self))
+        else:
+            employers = np.unique(employers)
+            cells = ranges(self.employer_offsets[employers], self.employer_offsets[employers + 1])
+
+        if soc_table is not None:
+            cells = cells[soc_table[self.soc[cells]]]
+        if state_table is not None:
+            cells = cells[state_table[self.state[cells]]]
+        return cells
+
+    def count_by(self, dim, cells):
+        """total count per code of dim (one of DIMENSIONS) over cells"""
+        codes = getattr(self, dim)[cells]
+        size = self.sizes[self.DIMENSIONS.index(dim)]
+        return np.bincount(codes, weights=self.counts[cells], minlength=size).astype(np.int64)
+
+    def histograms(self, dim, cells, codes):
+        """pay histogram over cells for each code of dim in codes
+
+        Returns a (len(codes), number of bins) array of counts; codes must be
+        unique.
+        """
+        n_bins = len(self.bin_edges) - 1
+        groups = np.full(self.sizes[self.DIMENSIONS.index(dim)], -1, dtype=np.int64)
+        groups[codes] = np.arange(len(codes))
+
+        entries = ranges(self.hist_offsets[cells], self.hist_offsets[cells + 1])
+        entry_groups = groups[getattr(self, dim)[self.hist_cells[entries]]]
+        keep = entry_groups >= 0
+        entries = entries[keep]
+
+        flat = np.bincount(
+            entry_groups[keep] * n_bins + self.hist_bins[entries],
+            weights=self.hist_counts[entries],
+            minlength=len(codes) * n_bins,
+        )
+        return flat.reshape(len(codes), n_bins).astype(np.int64)
@@ -1,113 +1,140 @@
-import dash
+import logging
+import os
+from urllib.parse import urlencode
+
 import dash_core_components as dcc
 import dash_html_components as html
-import pandas as pd
 import numpy as np
-import plotly.graph_objs as go
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 from django_plotly_dash import DjangoDash
-import dash_table
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.templatetags.static import static
+from django.urls import reverse
+
+from dashboard import figures, metrics, pipeline, store, warmup
+from dashboard.dataset import (
+    CUBE_DIMENSIONS, DIMENSIONS, EMPLOYER, SALARY_BIN_EDGES, SALARY_BIN_WIDTH, SOC, STATE,
+)
+from dashboard.materialized import Materialized
+from dashboard.metrics import instrument
+from dashboard.partitions import PartitionCatalog, partition_dir
 
 external_stylesheets = ["https://stackpath.bootstrapcdn.com/bootstrap/4.1.3/css/bootstrap-grid.min.css"]
 
 
-# format the starting dataset
-def get_dataset():
-    """"""
-    url = 'https://media.githubusercontent.com/media/Duwevans/h1b-app/master/data/h1b_disclosure_data_short.csv'
-
-    df0 = pd.read_csv(url, low_memory=False)
-    #df0 = pd.read_csv('/Users/duncanevans/downloads/h1b_disclosure_data_short.csv', low_memory=False)
-
-    # shrink to only needed columns
-    df1 = df0[[
-        'EMPLOYER_NAME',
-        'SOC_CODE',
-        'SOC_NAME',
-        'WAGE_UNIT_OF_PAY',
-        'WAGE_RATE_OF_PAY_FROM',
-        'JOB_TITLE',
-        'WORKSITE_STATE',
-    ]]
-
-    # save shortened dataset to csv
-    #  df_tech.to_csv('h1b_disclosure_data_short.csv', index=False)
-
-
-    df = df0.copy()
-    #import os
-    #os.chdir('/Users/duncanevans/downloads')
-    #df0.to_csv('h1b_disclosure_data.csv', index=False)
-
-    # standardize pay field
-    df['base_salary'] = df['WAGE_RATE_OF_PAY_FROM'].str.replace(
-        '$', '',
-    ).str.replace(',', '').astype(float)
-
-    # convert columns to strings
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].astype(str)
-
-    # remove words that clutter employer names - LLC, INC, etc
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.replace('LLC', '')
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.replace('INC', '')
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.replace('LLP', '')
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.replace('CORPORATION', '')
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.replace('.COM', '')
-
-    # remove punctuations from employer names
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.replace('[^\w\s]', '')
-    df['EMPLOYER_NAME'] = df['EMPLOYER_NAME'].str.strip()
-
-    # convert pay field to annual
-    df['annualized_conversion'] = df['WAGE_UNIT_OF_PAY'].map(
-        {
-            'Year': 1,
-            'Hour': 2080,
-            'Month': 12,
-            'Week': 52,
-            'Bi-Weekly': 26,
-        }
-    )
+logger = logging.getLogger(__name__)
 
-    df['annual_pay'] = df['base_salary'] * df['annualized_conversion']
 
-    # remove outliers on base salary
-    df = df.loc[df['annual_pay'] < 400000]
+def get_catalog():
+    """open the fiscal-year partitions written by `manage.py build_h1b_store`
 
-    # isolate to only technology jobs
-    # separate SOC CODE into two groups - first two digits are the major group
-    df[['soc_major_group', 'soc_minor_group']] = df['SOC_CODE'].str.split(
-        pat='-', expand=True
+    Partitions are only loaded when a year is first selected.
+    """
+    store_dir = settings.H1B_STORE_DIR
+    warmup.progress("opening fiscal year partitions in %s" % store_dir)
+    catalog = PartitionCatalog(
+        store_dir,
+        # isolate to only technology jobs
+        # SOC_CODE starts with "15-" - these are "Computer and Mathematical Occupations"
+        soc_major_groups=settings.H1B_SOC_MAJOR_GROUPS,
+        default_year=settings.H1B_DEFAULT_FISCAL_YEAR,
+        max_open=settings.H1B_MAX_OPEN_PARTITIONS,
+        selection_cache=settings.H1B_SELECTION_CACHE,
+        shared=settings.H1B_SHARED_DATASET,
     )
+    if not catalog.years:
+        raise ImproperlyConfigured(
+            "no H1B dataset store at %s - run `python manage.py build_h1b_store`" % store_dir
+        )
 
-    # SOC_CODE starts with "15-" - these are "Computer and Mathematical Occupations"
-    df_tech = df.loc[df['soc_major_group'] == '15']
+    for year in catalog.years:
+        if year not in settings.H1B_SOURCES:
+            continue
+        source_csvs = [path for path, _ in pipeline.source_files(settings.H1B_SOURCES[year])]
+        if all(os.path.exists(path) for path in source_csvs) and not store.is_fresh(
+            partition_dir(store_dir, year), source_csvs,
+        ):
+            logger.warning(
+                "FY%d H1B dataset store in %s is out of date with %s - run "
+                "`python manage.py build_h1b_store --append` to update it",
+                year, store_dir, ', '.join(source_csvs),
+            )
+    return catalog
 
-    return df, df_tech
 
-df_all, df_tech = get_dataset()
+def get_dataset(year=None):
+    """dataset for a fiscal year (the default year if None), loaded on first use"""
+    return catalog.dataset(year)
 
-df = df_tech.copy()
-df['JOB_TITLE'] = df['JOB_TITLE'].astype(str)
 
-# get count of all companies as a list
-x = pd.DataFrame(df['EMPLOYER_NAME'].value_counts())
-x['EMPLOYER_NAME'] = x.index
-sorted_companies = x['EMPLOYER_NAME'].tolist()
+catalog = get_catalog()
+
+
+def selection_cache_stats():
+    """selection cache counters of each loaded year, for the metrics view"""
+    for year, dataset in catalog.loaded().items():
+        for stat, value in dataset.selection_cache.stats().items():
+            yield {'year': year, 'stat': stat}, value
+
+
+metrics.registry.gauge(
+    'h1b_selection_cache', selection_cache_stats,
+    help='selection cache entries, bytes, hits, misses and evictions per loaded year',
+)
+metrics.configure(**settings.H1B_PROFILING)
+
+# the layout's dropdown options load the default year
+warmup.progress("building the dashboard layout")
 
-# get count of all jobs as a list
-x = pd.DataFrame(df['SOC_NAME'].value_counts())
-x['SOC_NAME'] = x.index
-sorted_jobs = x['SOC_NAME'].tolist()
+def layout_version():
+    """identifies the data the layout was built from, for caching the layout response
 
-# get count of all states as a list
-x = pd.DataFrame(df['WORKSITE_STATE'].value_counts())
-x['WORKSITE_STATE'] = x.index
-sorted_states = x['WORKSITE_STATE'].tolist()
+    The partitions' versions are read from disk, so this changes as soon as a
+    partition is rebuilt.
+    """
+    return ','.join('%d:%s' % (year, catalog.version(year)) for year in catalog.years)
+
+
+# values selected when the dashboard opens
+DEFAULT_JOBS = ['SOFTWARE DEVELOPERS, APPLICATIONS', ]
+DEFAULT_COMPANIES = ['GOOGLE', 'MICROSOFT', 'AMAZON SERVICES', ]
+DEFAULT_STATES = ['CA', 'WA', 'NY', 'NJ', 'TX', ]
+DEFAULT_PERCENTILES = [25, 50, 75, ]
+
+
+def dropdown_options(dim, search_value, selected, year=None):
+    """options for a dropdown: the selected values, then the most frequent
+    values matching what has been typed into it
+
+    Only H1B_SEARCH_RESULTS matches are sent, rather than every value.
+    """
+    selected = list(selected or [])
+    matches = get_dataset(year).search(dim, search_value, settings.H1B_SEARCH_RESULTS)
+    values = selected + [v for v in matches if v not in selected]
+    return [{'label': v, 'value': v} for v in values]
+
+
+def export_url(companies, jobs, states, year=None):
+    """link to download the rows of a selection, see dashboard.export"""
+    # an empty selection is sent as an empty value, since leaving the
+    # parameter out would export every value
+    query = urlencode({
+        'companies': companies or [''], 'jobs': jobs or [''], 'states': states or [''],
+        'year': year or catalog.default_year,
+    }, doseq=True)
+    return '%s?%s' % (reverse('dashboards_export'), query)
+
+# percentiles that can be shown on the descriptive salary chart
+PERCENTILE_OPTIONS = [10, 25, 50, 75, 90, ]
 
 
 app = DjangoDash('h1b_salary', external_stylesheets=external_stylesheets)
 
+# figures computed at warm-up for the default and popular selections
+materialized = Materialized(layout_version)
+
 
 app.layout = html.Div([
 
@@ -132,6 +159,19 @@ app.layout = html.Div([
     '''),
     )], style={'textAlign': "center"}),
 
+    dcc.Markdown('''
+    Select the fiscal year of disclosure data to view.
+    '''),
+    dcc.Dropdown(
+        id='year_selection',
+        options=[
+            {'label': f"FY{year}", 'value': year}
+            for year in reversed(catalog.years)
+        ],
+        value=catalog.default_year,
+        clearable=False,
+    ),
+
     dcc.Markdown('''
     
     First, select the type of occupation to view - this dashboard defaults to 
@@ -141,12 +181,8 @@ app.layout = html.Div([
 
     dcc.Dropdown(
         id='job_selection',
-        options=[
-            {'label': c, 'value': c}
-            for c in sorted_jobs
-
-        ],
-        value=['SOFTWARE DEVELOPERS, APPLICATIONS',],
+        options=dropdown_options(SOC, '', DEFAULT_JOBS),
+        value=DEFAULT_JOBS,
         multi=True,
         clearable=False,
     ),
@@ -161,12 +197,8 @@ app.layout = html.Div([
         html.Div([
             dcc.Dropdown(
                 id='company_selection',
-                options=[
-                    {'label': c, 'value': c}
-                    for c in sorted_companies
-
-                ],
-                value=['GOOGLE', 'MICROSOFT', 'AMAZON SERVICES', ],
+                options=dropdown_options(EMPLOYER, '', DEFAULT_COMPANIES),
+                value=DEFAULT_COMPANIES,
                 multi=True,
                 clearable=False,
             ),
@@ -176,12 +208,8 @@ app.layout = html.Div([
         html.Div([
             dcc.Dropdown(
                 id='state_selection',
-                options=[
-                    {'label': c, 'value': c}
-                    for c in sorted_states
-
-                ],
-                value=['CA', 'WA', 'NY', 'NJ', 'TX', ],
+                options=dropdown_options(STATE, '', DEFAULT_STATES),
+                value=DEFAULT_STATES,
                 multi=True,
                 clearable=False,
             ),
@@ -190,6 +218,15 @@ app.layout = html.Div([
     ],
         ),
 
+    # csv of the rows behind the charts
+    html.Div([
+        html.A(
+            "Download the selected records (csv)",
+            id='export_link',
+            href=export_url(DEFAULT_COMPANIES, DEFAULT_JOBS, DEFAULT_STATES),
+        ),
+    ], style={'textAlign': "right"}),
+
 
     # side by side descriptive charts
     html.Div([
@@ -220,7 +257,22 @@ app.layout = html.Div([
     dcc.Graph(id='salary_bars'),
 
     # salary descriptive bar chart
+    dcc.Markdown('''
+    Choose which percentiles of annual pay to compare across companies.
+    '''),
+    dcc.Dropdown(
+        id='percentile_selection',
+        options=[
+            {'label': f"{p}th percentile", 'value': p}
+            for p in PERCENTILE_OPTIONS
+        ],
+        value=DEFAULT_PERCENTILES,
+        multi=True,
+        clearable=False,
+    ),
     dcc.Graph(id='salary_bar_descriptive'),
+    # compares the selected companies across every fiscal year
+    dcc.Graph(id='year_trend_bars'),
     # shows the distribution across states
     dcc.Graph(id='state_bar'),
     # shows all companies available for the jobs in the dataset
@@ -229,6 +281,40 @@ app.layout = html.Div([
     each company, and each job. Selecting companies/jobs that have many results
     on this list will make for the most informative charts displayed above.
     '''),
+    dcc.Markdown('''
+    Rank the companies by their number of filings or by their median annual
+    pay, and page through the ranking.
+    '''),
+    html.Div([
+        html.Div([
+            dcc.RadioItems(
+                id='company_rank_by',
+                options=[
+                    {'label': 'most filings', 'value': 'count'},
+                    {'label': 'highest median pay', 'value': 'median'},
+                ],
+                value='count',
+                labelStyle={'display': 'inline-block'},
+            ),
+        ],
+            style={'width': '50%', 'display': 'inline-block'}),
+        html.Div([
+            dcc.Dropdown(
+                id='company_rank_size',
+                options=[
+                    {'label': f"{size} per page", 'value': size}
+                    for size in settings.H1B_TOP_EMPLOYERS_PAGE_SIZES
+                ],
+                value=settings.H1B_TOP_EMPLOYERS_PAGE_SIZES[0],
+                clearable=False,
+            ),
+        ],
+            style={'width': '25%', 'display': 'inline-block'}),
+        html.Div([
+            dcc.Input(id='company_rank_page', type='number', min=1, step=1, value=1),
+        ],
+            style={'width': '25%', 'display': 'inline-block', 'align': 'right'}),
+    ]),
     dcc.Graph(id='all_company_count_bars',
               style={
                   'height': 800,
@@ -240,33 +326,55 @@ app.layout = html.Div([
 ], className='container')
 
 
-
-@app.callback(
-    Output('all_job_count_bars', 'figure'),
-    [Input('company_selection', 'value'),
-     Input('state_selection', 'value')]
-)
-def update_all_job_count_bars(companies, states):
-    target_df = df.loc[df['EMPLOYER_NAME'].isin(companies)]
-    target_df = target_df.loc[target_df['WORKSITE_STATE'].isin(states)]
-
-    job_counts = pd.DataFrame(target_df['SOC_NAME'].value_counts())
-    job_counts = job_counts.rename(columns={'SOC_NAME': 'count'})
-    job_counts['SOC_NAME'] = job_counts.index
-    job_counts = job_counts.reset_index(drop=True)
-
-    trace = go.Bar(
-        y=job_counts['SOC_NAME'],
-        x=job_counts['count'],
+# count charts drawn in the browser, as (output, callback name, arguments)
+clientside_charts = []
+
+if settings.H1B_CLIENTSIDE_COUNTS:
+    # the count table for the selected year, the page of the median pay
+    # ranking (which needs the pay histograms, so is ranked on the server),
+    # and the functions drawing the count charts from them
+    app.layout.children.append(dcc.Store(id='count_table'))
+    app.layout.children.append(dcc.Store(id='company_median_ranking'))
+    app.scripts.append_script({'external_url': static('dashboard/counts.js')})
+
+
+def count_chart_callback(output, inputs, browser_inputs=()):
+    """app.callback for a count chart, drawn in the browser with H1B_CLIENTSIDE_COUNTS
+
+    On the server the chart also depends on the fiscal year. In the browser
+    it is drawn by the function of the same name in counts.js from the count
+    table, which changes with the year instead, and the python function is
+    only used for the figure embedded in the layout. browser_inputs are
+    passed to the browser function only, after the count table.
+    """
+    def register(callback):
+        if not settings.H1B_CLIENTSIDE_COUNTS:
+            return app.callback(output, inputs + [Input('year_selection', 'value')])(callback)
+        app.clientside_callback(
+            ClientsideFunction('h1b', callback.__name__),
+            output, [Input('count_table', 'data')] + list(browser_inputs) + inputs,
+        )
+        arguments = [(item.component_id, item.component_property) for item in inputs]
+        clientside_charts.append((
+            output.component_id, callback.__name__, arguments + [('year_selection', 'value')],
+        ))
+        return callback
+    return register
+
+
+def count_bar_figure(names, counts, title, xaxis_title='count of jobs'):
+    """horizontal bar chart of counts, largest first - counts.js draws the same"""
+    trace = figures.bar(
+        y=names,
+        x=counts,
         orientation='h',
-        text=job_counts['count'],
+        text=counts,
         textposition='auto',
-
     )
 
-    layout = go.Layout(
-        title=f"Count of All Jobs Available in Data",
-        xaxis={'title': 'count of jobs'},
+    layout = figures.layout(
+        title=title,
+        xaxis={'title': xaxis_title},
         yaxis={
             'title': '',
             'automargin': True,
@@ -274,34 +382,140 @@ def update_all_job_count_bars(companies, states):
         },
     )
 
-    figure = {'data': [trace], 'layout': layout}
+    return {'data': [trace], 'layout': layout}
+
+
+# count table of each loaded dataset version, see count_table
+count_tables = {}
+
+
+def count_table(year=None):
+    """the count cube of a year's dataset for the browser
+
+    The cells that occur are sent as parallel arrays of codes into the
+    vocabularies (code len(vocab) for missing values) and their counts.
+    Tables of datasets that are no longer loaded are dropped.
+    """
+    data = get_dataset(year)
+    if data.version not in count_tables:
+        loaded = {dataset.version for dataset in catalog.loaded().values()}
+        for version in set(count_tables) - loaded:
+            count_tables.pop(version, None)
+        count_tables[data.version] = {
+            'version': data.version,
+            'vocab': {CUBE_DIMENSIONS[dim]: data.vocab[dim] for dim in DIMENSIONS},
+            'cells': {
+                'employer': data.cube.employer,
+                'soc': data.cube.soc,
+                'state': data.cube.state,
+                'count': data.cube.counts,
+            },
+        }
+    return count_tables[data.version]
 
-    return figure
+
+if settings.H1B_CLIENTSIDE_COUNTS:
+    @app.callback(
+        Output('count_table', 'data'),
+        [Input('year_selection', 'value')]
+    )
+    @instrument
+    def update_count_table(year):
+        return count_table(year)
+
+
+@app.callback(
+    Output('company_selection', 'options'),
+    [Input('company_selection', 'search_value'),
+     Input('year_selection', 'value')],
+    [State('company_selection', 'value')]
+)
+@instrument
+def update_company_options(search_value, year, companies):
+    """employers matching the search text, most filings first"""
+    return dropdown_options(EMPLOYER, search_value, companies, year)
+
+
+@app.callback(
+    Output('job_selection', 'options'),
+    [Input('job_selection', 'search_value'),
+     Input('year_selection', 'value')],
+    [State('job_selection', 'value')]
+)
+@instrument
+def update_job_options(search_value, year, jobs):
+    """jobs matching the search text, most filings first"""
+    return dropdown_options(SOC, search_value, jobs, year)
+
+
+@app.callback(
+    Output('state_selection', 'options'),
+    [Input('state_selection', 'search_value'),
+     Input('year_selection', 'value')],
+    [State('state_selection', 'value')]
+)
+@instrument
+def update_state_options(search_value, year, states):
+    """states matching the search text, most filings first"""
+    return dropdown_options(STATE, search_value, states, year)
 
 
 
+@app.callback(
+    Output('export_link', 'href'),
+    [Input('company_selection', 'value'),
+     Input('job_selection', 'value'),
+     Input('state_selection', 'value'),
+     Input('year_selection', 'value')]
+)
+@instrument
+def update_export_link(companies, jobs, states, year=None):
+    return export_url(companies, jobs, states, year)
+
+
+@count_chart_callback(
+    Output('all_job_count_bars', 'figure'),
+    [Input('company_selection', 'value'),
+     Input('state_selection', 'value')]
+)
+@instrument
+@materialized.serve
+def update_all_job_count_bars(companies, states, year=None):
+    data = get_dataset(year)
+    jobs, counts = data.count_by(SOC, companies=companies, states=states)
+    return count_bar_figure(jobs, counts, "Count of All Jobs Available in Data")
+
+
 @app.callback(
     Output('salary_bars', 'figure'),
     [Input('company_selection', 'value'),
      Input('job_selection', 'value'),
      Input('state_selection', 'value'),
+     Input('year_selection', 'value'),
      ]
 )
-def update_salary_bars(companies, jobs, states):
-    dff = df.loc[df['EMPLOYER_NAME'].isin(companies)]
-    states_df = dff.loc[dff['WORKSITE_STATE'].isin(states)]
-    job_df = states_df.loc[states_df['SOC_NAME'].isin(jobs)]
+@instrument
+@materialized.serve
+def update_salary_bars(companies, jobs, states, year=None):
+    """distribution of salaries per company, binned on the server so only
+    the bin counts are sent to the browser"""
+    data = get_dataset(year)
+    histograms = data.salary_histograms(companies, jobs=jobs, states=states)
+    bin_centers = SALARY_BIN_EDGES[:-1] + SALARY_BIN_WIDTH / 2
 
     all_traces = []
     for company in companies:
-        company_df = job_df.loc[job_df['EMPLOYER_NAME'] == company]
-        company = go.Histogram(
-            x=company_df['annual_pay'],
+        counts = histograms[company]
+        # empty bins are left out of the payload
+        nonzero = counts > 0
+        company = figures.bar(
+            x=bin_centers[nonzero],
+            y=counts[nonzero],
             name=company,
         )
         all_traces.append(company)
 
-    layout = go.Layout(
+    layout = figures.layout(
         title=f"Distribution of Salaries by Each Company",
         xaxis={'title': 'Annual Pay (USD)'},
         yaxis={'title': 'count', },
@@ -317,50 +531,38 @@ def update_salary_bars(companies, jobs, states):
     [Input('company_selection', 'value'),
      Input('job_selection', 'value'),
      Input('state_selection', 'value'),
+     Input('percentile_selection', 'value'),
+     Input('year_selection', 'value'),
      ]
 )
-def update_salary_bar_descriptive(companies, jobs, states):
-    """calculate 25th, 50th, and 75th percentile annual per each company"""
-    dff = df.loc[df['EMPLOYER_NAME'].isin(companies)]
-    states_df = dff.loc[dff['WORKSITE_STATE'].isin(states)]
-    job_df = states_df.loc[states_df['SOC_NAME'].isin(jobs)]
+@instrument
+@materialized.serve
+def update_salary_bar_descriptive(companies, jobs, states, percentiles=(25, 50, 75), year=None):
+    """calculate the selected percentiles of annual pay for all companies at once"""
+    data = get_dataset(year)
+    percentiles = sorted(set(percentiles or [50]))
+    labels = [f"{p}th percentile" for p in percentiles]
+
+    rows = data.select(companies=companies, jobs=jobs, states=states)
+    company_percentiles = data.employer_percentiles(rows, companies, percentiles)
 
     all_traces = []
     for company in companies:
-        company_df = job_df.loc[job_df['EMPLOYER_NAME'] == company]
-
-        # create data frame format needed for chart
-        company_percentiles = company_df.groupby('EMPLOYER_NAME')['annual_pay'].describe().T
-        company_percentiles['EMPLOYER_NAME'] = company
-        company_percentiles = company_percentiles.rename(
-            columns={
-                company : 'value'
-            }
-        )
-        company_percentiles['metric'] = company_percentiles.index
-        company_percentiles = company_percentiles.reset_index(drop=True)
-
-        # select only needed percentiles
-        pct_df = company_percentiles.loc[company_percentiles['metric'].isin(
-            ['25%', '50%', '75%', ]
-        )].reset_index(drop=True)
-        pct_df['metric'] = pct_df['metric'].map({
-            '25%': '25th percentile',
-            '50%': '50th percentile',
-            '75%': '75th percentile',
-        })
-
-        company_trace = go.Bar(
-            y=pct_df['value'],
-            x=pct_df['metric'],
+        values = company_percentiles[company]
+        # companies with no matching rows get an empty trace
+        values = values if not np.isnan(values).all() else []
+
+        company_trace = figures.bar(
+            y=values,
+            x=labels[:len(values)],
             name=str(company),
-            text=pct_df['value'],
+            text=values,
             textposition='auto',
 
         )
         all_traces.append(company_trace)
 
-    layout = go.Layout(
+    layout = figures.layout(
         title=f"Percentiles of Salaries by Each Company",
         xaxis={'title': 'employer'},
         yaxis={
@@ -374,174 +576,231 @@ def update_salary_bar_descriptive(companies, jobs, states):
     return figure
 
 
+@app.callback(
+    Output('year_trend_bars', 'figure'),
+    [Input('company_selection', 'value'),
+     Input('job_selection', 'value'),
+     Input('state_selection', 'value'),
+     ]
+)
+@instrument
+@materialized.serve
+def update_year_trend_bars(companies, jobs, states):
+    """compares filings and average pay per company across fiscal years,
+    read from the per-year summaries so no partition has to be loaded"""
+    years = catalog.years
+    totals = [catalog.summary(year).employer_totals(companies, jobs, states) for year in years]
+
+    all_traces = []
+    for company in companies:
+        counts = [year_totals[company][0] for year_totals in totals]
+        pay = [year_totals[company][1] for year_totals in totals]
+
+        company_trace = figures.bar(
+            x=[f"FY{year}" for year in years],
+            y=pay,
+            name=str(company),
+            text=[f"{count} filings" for count in counts],
+            textposition='auto',
+        )
+        all_traces.append(company_trace)
+
+    layout = figures.layout(
+        title=f"Average Salary by Fiscal Year",
+        xaxis={'title': 'fiscal year'},
+        yaxis={
+            'title': 'average annual pay',
+            'automargin': True,
+        },
+    )
+
+    figure = {'data': all_traces, 'layout': layout}
+
+    return figure
+
+
 @app.callback(
     Output('state_bar', 'figure'),
     [Input('company_selection', 'value'),
      Input('job_selection', 'value'),
-     Input('state_selection', 'value')]
+     Input('state_selection', 'value'),
+     Input('year_selection', 'value')]
 )
-def update_location_bars(companies, jobs, states):
+@instrument
+@materialized.serve
+def update_location_bars(companies, jobs, states, year=None):
     """updates the chart displaying the percentage of jobs in each state"""
-    dff = df.loc[df['EMPLOYER_NAME'].isin(companies)]
-    states_df = dff.loc[dff['WORKSITE_STATE'].isin(states)]
-    job_df = states_df.loc[states_df['SOC_NAME'].isin(jobs)]
-
+    data = get_dataset(year)
     all_traces = []
     for company in companies:
-        company_df = job_df.loc[job_df['EMPLOYER_NAME'] == company]
-        state_counts = pd.DataFrame(company_df['WORKSITE_STATE'].value_counts())
-        state_counts['EMPLOYER_NAME'] = company
-        state_counts = state_counts.rename(columns={'WORKSITE_STATE': 'count'})
-        state_counts['WORKSITE_STATE'] = state_counts.index
-        state_counts['pct_total'] = round(state_counts['count'] / state_counts['count'].sum(), 2)
+        state_names, state_counts = data.count_by(
+            STATE, companies=[company], jobs=jobs, states=states,
+        )
+        pct_total = np.round(state_counts / max(state_counts.sum(), 1), 2)
         # remove <1% in state counts
-        state_counts = state_counts.loc[state_counts['pct_total'] >= .01]
-        state_counts = state_counts.reset_index(drop=True)
+        keep = pct_total >= .01
 
-        company = go.Bar(
-            y=state_counts['pct_total'],
-            x=state_counts['WORKSITE_STATE'],
+        company = figures.bar(
+            y=pct_total[keep],
+            x=[state for state, kept in zip(state_names, keep) if kept],
             name=company,
-            text=state_counts['pct_total'],
+            text=pct_total[keep],
             textposition='auto',
 
         )
         all_traces.append(company)
 
-    layout = go.Layout(title=f"Percent of All Job Locations by State",
-                       xaxis={'title': 'US State'},
-                       yaxis={
-                           'title': 'Percent of All Jobs per Company',
-                           'tickformat': ",.0%",
-                           'hoverformat': ",.0%",
-                        },
-                       bargap=0.1,
-                       )
+    layout = figures.layout(title=f"Percent of All Job Locations by State",
+                            xaxis={'title': 'US State'},
+                            yaxis={
+                                'title': 'Percent of All Jobs per Company',
+                                'tickformat': ",.0%",
+                                'hoverformat': ",.0%",
+                             },
+                            bargap=0.1,
+                            )
 
     figure = {'data': all_traces, 'layout': layout}
 
     return figure
 
-@app.callback(
+@count_chart_callback(
     Output('company_count_bar', 'figure'),
     [Input('company_selection', 'value'),
      Input('job_selection', 'value'),
      Input('state_selection', 'value')]
 )
-def update_company_count_bar(companies, jobs, states):
+@instrument
+@materialized.serve
+def update_company_count_bar(companies, jobs, states, year=None):
     """"""
-    dff = df.loc[df['EMPLOYER_NAME'].isin(companies)]
-    states_df = dff.loc[dff['WORKSITE_STATE'].isin(states)]
-    target_df = states_df.loc[states_df['SOC_NAME'].isin(jobs)]
-
-    company_counts = pd.DataFrame(target_df['EMPLOYER_NAME'].value_counts())
-    company_counts['Company'] = company_counts.index
-    company_counts = company_counts.reset_index(drop=True)
-    company_counts = company_counts.rename(columns={'EMPLOYER_NAME': 'count'})
-
-    trace = go.Bar(
-        y=company_counts['Company'],
-        x=company_counts['count'],
-        orientation='h',
-        text=company_counts['count'],
-        textposition='auto',
-    )
-
-    layout = go.Layout(
-        title=f"Count of Jobs per Each Company",
-        xaxis={'title': 'count of jobs'},
-        yaxis={
-            'title': '',
-            'automargin': True,
-            'autorange': 'reversed',
-        },
+    data = get_dataset(year)
+    company_names, company_counts = data.count_by(
+        EMPLOYER, companies=companies, jobs=jobs, states=states,
     )
+    return count_bar_figure(company_names, company_counts, "Count of Jobs per Each Company")
 
-    figure = {'data': [trace], 'layout': layout}
 
-    return figure
-
-
-@app.callback(
+@count_chart_callback(
     Output('job_count_bar', 'figure'),
     [Input('company_selection', 'value'),
      Input('job_selection', 'value'),
      Input('state_selection', 'value')]
 )
-
-def update_job_count_bar(companies, jobs, states):
+@instrument
+@materialized.serve
+def update_job_count_bar(companies, jobs, states, year=None):
     """"""
-    dff = df.loc[df['EMPLOYER_NAME'].isin(companies)]
-    states_df = dff.loc[dff['WORKSITE_STATE'].isin(states)]
-    target_df = states_df.loc[states_df['SOC_NAME'].isin(jobs)]
-
-    job_counts = pd.DataFrame(target_df['SOC_NAME'].value_counts())
-    job_counts = job_counts.rename(columns={'SOC_NAME': 'count'})
-    job_counts['SOC_NAME'] = job_counts.index
-    job_counts = job_counts.reset_index(drop=True)
-
-    trace = go.Bar(
-        y=job_counts['SOC_NAME'],
-        x=job_counts['count'],
-        orientation='h',
-        text=job_counts['count'],
-        textposition='auto',
+    data = get_dataset(year)
+    job_names, job_counts = data.count_by(SOC, companies=companies, jobs=jobs, states=states)
+    return count_bar_figure(job_names, job_counts, "Count of Total Jobs")
 
-    )
 
-    layout = go.Layout(
-        title=f"Count of Total Jobs",
-        xaxis={'title': 'count of jobs'},
-        yaxis={
-            'title': '',
-            'automargin': True,
-            'autorange': 'reversed',
-        },
+def company_ranking(jobs, states, rank_by, page_size, page, year):
+    """names and counts (or median pay) of one page of the ranked companies"""
+    page_size = page_size or settings.H1B_TOP_EMPLOYERS_PAGE_SIZES[0]
+    offset = (max(int(page or 1), 1) - 1) * page_size
+    company_names, values, _ = get_dataset(year).top_employers(
+        jobs, states, limit=page_size, offset=offset, by=rank_by,
     )
-
-    figure = {'data': [trace], 'layout': layout}
-
-    return figure
+    return company_names, values
 
 
-@app.callback(
+@count_chart_callback(
     Output('all_company_count_bars', 'figure'),
     [Input('job_selection', 'value'),
-     Input('state_selection', 'value')]
+     Input('state_selection', 'value'),
+     Input('company_rank_by', 'value'),
+     Input('company_rank_size', 'value'),
+     Input('company_rank_page', 'value')],
+    browser_inputs=[Input('company_median_ranking', 'data')],
 )
-def update_all_company_count_bars(jobs, states):
+@instrument
+@materialized.serve
+def update_all_company_count_bars(jobs, states, rank_by='count', page_size=None, page=1, year=None):
     """updates chart that shows all companies with results for
-    the target SOC_NAME (job family)"""
-    states_df = df.loc[df['WORKSITE_STATE'].isin(states)]
-    target_df = states_df.loc[states_df['SOC_NAME'].isin(jobs)]
-
-    company_job_counts = pd.DataFrame(target_df['EMPLOYER_NAME'].value_counts())
-    company_job_counts = company_job_counts.rename(columns={'EMPLOYER_NAME': 'count'})
-    company_job_counts['EMPLOYER_NAME'] = company_job_counts.index
-    company_job_counts = company_job_counts.reset_index(drop=True)
-
-    # only show the first n values
-    company_job_counts = company_job_counts.head(25)
-
-    trace = go.Bar(
-        y=company_job_counts['EMPLOYER_NAME'],
-        x=company_job_counts['count'],
-        orientation='h',
-        text=company_job_counts['count'],
-        textposition='auto',
-
+    the target SOC_NAME (job family), a page at a time"""
+    company_names, values = company_ranking(jobs, states, rank_by, page_size, page, year)
+    if rank_by == 'median':
+        return count_bar_figure(
+            company_names, values.round().astype(np.int64),
+            "Median Pay of All Companies Available in Data", xaxis_title='median annual pay',
+        )
+    return count_bar_figure(
+        company_names, values, "All Jobs for All Companies Available in Data",
     )
 
-    layout = go.Layout(
-        title=f"All Jobs for All Companies Available in Data",
-        xaxis={'title': 'count of jobs'},
-        yaxis={
-            'title': '',
-            'automargin': True,
-            'autorange': 'reversed',
-        },
+
+if settings.H1B_CLIENTSIDE_COUNTS:
+    @app.callback(
+        Output('company_median_ranking', 'data'),
+        [Input('job_selection', 'value'),
+         Input('state_selection', 'value'),
+         Input('company_rank_by', 'value'),
+         Input('company_rank_size', 'value'),
+         Input('company_rank_page', 'value'),
+         Input('year_selection', 'value')]
     )
+    @instrument
+    def update_company_median_ranking(jobs, states, rank_by, page_size, page, year):
+        """the page of the median pay ranking for counts.js, keyed by the
+        selection and dataset version it was ranked for"""
+        if rank_by != 'median':
+            raise PreventUpdate
+        company_names, values = company_ranking(jobs, states, rank_by, page_size, page, year)
+        return {
+            'version': get_dataset(year).version,
+            'key': [jobs, states, page_size, page],
+            'names': company_names,
+            'values': values.round().astype(np.int64),
+        }
 
-    figure = {'data': [trace], 'layout': layout}
 
-    return figure
+def selection_inputs(companies, jobs, states, percentiles=DEFAULT_PERCENTILES, year=None):
+    """value of each dashboard input for a selection, by (component id, property)"""
+    return {
+        ('company_selection', 'value'): companies,
+        ('job_selection', 'value'): jobs,
+        ('state_selection', 'value'): states,
+        ('percentile_selection', 'value'): percentiles,
+        ('company_rank_by', 'value'): 'count',
+        ('company_rank_size', 'value'): settings.H1B_TOP_EMPLOYERS_PAGE_SIZES[0],
+        ('company_rank_page', 'value'): 1,
+        ('year_selection', 'value'): year or catalog.default_year,
+    }
+
+
+def materialize():
+    """compute the figures for the default selection and H1B_MATERIALIZED_SELECTIONS
+
+    The default selection's figures are also set on the layout's graphs, so
+    they are drawn as soon as the page loads.
+    """
+    charts = [
+        (output.split('.')[0], route.function.__name__, route.arguments)
+        for output, route in figures.routes(app).items() if route.output == 'figure'
+    ] + clientside_charts
+    selections = [
+        {'companies': DEFAULT_COMPANIES, 'jobs': DEFAULT_JOBS, 'states': DEFAULT_STATES},
+    ] + list(settings.H1B_MATERIALIZED_SELECTIONS)
+    for i, selection in enumerate(selections):
+        inputs = selection_inputs(**selection)
+        results = materialized.compute(layout_version(), [
+            (name, [inputs[argument] for argument in arguments]) for _, name, arguments in charts
+        ])
+        if i == 0:
+            for (component_id, _, _), figure in zip(charts, results):
+                app.layout[component_id].figure = figure
+
+
+def refresh_figures():
+    """layout_version(), first computing the materialized figures again if
+    the data has changed since they were"""
+    version = layout_version()
+    if version != materialized.version:
+        materialize()
+    return version
+
+
+warmup.progress("computing the figures for the default selection")
+materialize()
@@ -0,0 +1,448 @@
+"""
+In-memory form of the dataset used by the dashboard callbacks.
+
+The three dimensions the dashboard filters on (employer, SOC name and state)
+are held as dictionary-encoded integer codes rather than strings. Dropdown
+values are translated to codes once per callback, and rows are selected with
+boolean lookup tables indexed by code, so no string comparisons happen on
+the hot path.
+
+Each dimension also has an inverted index from code to the sorted ids of the
+rows with that code, so a selection only touches the rows of its most
+selective dimension instead of scanning the whole table.
+
+One dropdown change fires several callbacks with the same selection, so the
+selected row ids are memoized in an LRUCache keyed on the normalized
+selection and shared between them.
+
+The count-only charts don't need rows at all: they are answered from a
+CountCube of the (employer, SOC, state) combinations built at load time,
+which also carries per-combination pay histograms for the salary
+distribution chart. Top employer rankings are answered from the cube too
+(see dashboard.ranking).
+
+In shared mode every derived array (codes, indexes and the cube) is saved
+once next to the store when it is built and memory mapped read-only, so all
+the worker processes on a machine share the same pages instead of each
+building a private copy.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from dashboard import store
+from dashboard.cache import LRUCache, normalize_selection
+from dashboard.cube import CountCube
+from dashboard.metrics import staged
+from dashboard.ranking import EmployerRanking
+from dashboard.search import SearchIndex
+from dashboard.pipeline import MAX_ANNUAL_PAY
+
+EMPLOYER = 'EMPLOYER_NAME'
+SOC = 'SOC_NAME'
+STATE = 'WORKSITE_STATE'
+
+DIMENSIONS = (EMPLOYER, SOC, STATE)
+
+# name of each dimension in the count cube
+CUBE_DIMENSIONS = {EMPLOYER: 'employer', SOC: 'soc', STATE: 'state'}
+
+# shared bin grid for the salary distribution histograms
+SALARY_BIN_WIDTH = 5000
+SALARY_BIN_EDGES = np.arange(0, MAX_ANNUAL_PAY + SALARY_BIN_WIDTH, SALARY_BIN_WIDTH, dtype=np.float64)
+
+# SOC major groups shown in the dashboard - "Computer and Mathematical Occupations"
+DEFAULT_SOC_MAJOR_GROUPS = ('15',)
+
+SHARED_MANIFEST_NAME = 'dataset.json'
+
+
+def _encode_by_frequency(codes, vocab):
+    """re-encode codes so that code 0 is the most frequent value
+
+    Values that never occur are dropped from the vocabulary, and missing
+    values (code -1 in the store) get the code len(vocab), one past the end,
+    so lookup tables can be indexed directly by code.
+    """
+    counts = np.bincount(codes + 1, minlength=len(vocab) + 1)[1:]
+    order = np.argsort(-counts, kind='stable')
+    order = order[counts[order] > 0]
+
+    # the extra last slot of remap is what code -1 indexes
+    remap = np.full(len(vocab) + 1, len(order), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+
+    new_vocab = [vocab[i] for i in order]
+    dtype = np.min_scalar_type(len(new_vocab))
+    return remap[codes].astype(dtype), new_vocab
+
+
+def group_percentiles(groups, values, percentiles, n_groups):
+    """percentiles of values within each group from a single sort
+
+    groups holds a group number in [0, n_groups) for each value. Returns an
+    (n_groups, len(percentiles)) array using the same linear interpolation as
+    np.percentile, with NaN rows for empty groups.
+    """
+    q = np.asarray(percentiles, dtype=np.float64) / 100
+    result = np.full((n_groups, len(q)), np.nan)
+    if not len(values):
+        return result
+
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+
+    position = (counts[:, None] - 1) * q[None, :]
+    below = np.floor(position)
+    weight_above = position - below
+    below = starts[:, None] + below.astype(np.int64)
+    above = np.minimum(below + 1, starts[:, None] + counts[:, None] - 1)
+
+    present = counts > 0
+    below = below[present]
+    above = above[present]
+    weight_above = weight_above[present]
+    result[present] = (
+        sorted_values[below] * (1 - weight_above) + sorted_values[above] * weight_above
+    )
+    return result
+
+
+def shared_dir(store_dir, soc_major_groups):
+    """directory inside store_dir holding the saved dataset for soc_major_groups"""
+    key = ','.join(sorted(soc_major_groups))
+    return os.path.join(store_dir, 'dataset-' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:12])
+
+
+def soc_group_rows(store_dir, soc_major_groups):
+    """indexes of the store's rows in the given SOC major groups"""
+    major_vocab = store.read_vocab(store_dir, 'soc_major_group')
+    wanted = np.zeros(len(major_vocab) + 1, dtype=bool)
+    for group in soc_major_groups:
+        if group in major_vocab:
+            wanted[major_vocab.index(group)] = True
+    return np.flatnonzero(wanted[store.read_column(store_dir, 'soc_major_group')])
+
+
+def _read_json(path):
+    """contents of a json file, or an empty dict if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _build_index(codes, size):
+    """row ids grouped by code: the rows for code c are order[offsets[c]:offsets[c + 1]]"""
+    order = np.argsort(codes, kind='stable')
+    offsets = np.zeros(size + 2, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=size + 1), out=offsets[1:])
+    return order, offsets
+
+
+class H1BDataset:
+    """dimension codes, vocabularies and annual pay for the dashboard's rows"""
+
+    def __init__(self, codes, vocab, annual_pay, version=None, selection_cache=None,
+                 index=None, cube=None):
+        self.codes = codes
+        self.vocab = vocab
+        self.annual_pay = annual_pay
+        self.version = version
+        self.lookup = {
+            dim: {value: code for code, value in enumerate(values)}
+            for dim, values in vocab.items()
+        }
+        if index is None:
+            index = {
+                dim: _build_index(codes[dim], len(vocab[dim]))
+                for dim in codes
+            }
+        self.index = index
+        if cube is None:
+            cube = CountCube.from_codes(
+                codes[EMPLOYER], codes[SOC], codes[STATE],
+                sizes=self.cube_sizes(vocab),
+                pay=annual_pay,
+                bin_edges=SALARY_BIN_EDGES,
+            )
+        self.cube = cube
+        if selection_cache is None:
+            selection_cache = LRUCache()
+        self.selection_cache = selection_cache
+        # search indexes are only built for dimensions that get searched,
+        # and the employer ranking the first time it is asked for
+        self.search_index = {}
+        self.ranking = None
+
+    @staticmethod
+    def cube_sizes(vocab):
+        """number of codes per cube dimension, including the missing value code"""
+        return tuple(len(vocab[dim]) + 1 for dim in DIMENSIONS)
+
+    @classmethod
+    def from_store(cls, store_dir, soc_major_groups=DEFAULT_SOC_MAJOR_GROUPS,
+                   selection_cache=None, shared=False):
+        """load the rows of the given SOC major groups from a dataset store
+
+        With shared=True the dataset is memory mapped from the copy saved in
+        the store by save_shared, which `manage.py build_h1b_store` calls.
+        The copy is never built here, where a worker building it would hold
+        up every other worker on the machine behind the store's build lock:
+        a missing or out of date copy raises FileNotFoundError instead.
+        """
+        if shared:
+            directory = shared_dir(store_dir, soc_major_groups)
+            version = store.read_manifest(store_dir)['dataset_version']
+            if _read_json(os.path.join(directory, SHARED_MANIFEST_NAME)).get('version') != version:
+                raise FileNotFoundError(
+                    "no saved dataset for the current store at %s - run "
+                    "`python manage.py build_h1b_store` to save it" % store_dir
+                )
+            return cls.load(directory, selection_cache=selection_cache)
+
+        manifest = store.read_manifest(store_dir)
+        rows = soc_group_rows(store_dir, soc_major_groups)
+
+        codes = {}
+        vocab = {}
+        for dim in DIMENSIONS:
+            codes[dim], vocab[dim] = _encode_by_frequency(
+                store.read_column(store_dir, dim)[rows], store.read_vocab(store_dir, dim),
+            )
+        annual_pay = store.read_column(store_dir, 'annual_pay')[rows]
+
+        return cls(codes, vocab, annual_pay, version=manifest['dataset_version'],
+                   selection_cache=selection_cache)
+
+    @classmethod
+    def save_shared(cls, store_dir, soc_major_groups=DEFAULT_SOC_MAJOR_GROUPS):
+        """save the dataset for soc_major_groups inside store_dir unless it is up to date
+
+        Returns the directory it is saved in. Holds the store's build lock so
+        builds running together only save it once.
+        """
+        directory = shared_dir(store_dir, soc_major_groups)
+        with store.build_lock(store_dir):
+            version = store.read_manifest(store_dir)['dataset_version']
+            if _read_json(os.path.join(directory, SHARED_MANIFEST_NAME)).get('version') != version:
+                shutil.rmtree(directory, ignore_errors=True)
+                cls.from_store(store_dir, soc_major_groups).save(directory)
+        return directory
+
+    def arrays(self):
+        """dict of every array of the dataset, by file name"""
+        arrays = {'annual_pay': self.annual_pay}
+        for dim in DIMENSIONS:
+            arrays['codes.' + dim] = self.codes[dim]
+            arrays['order.' + dim], arrays['offsets.' + dim] = self.index[dim]
+        for name, values in self.cube.arrays().items():
+            arrays['cube.' + name] = values
+        return arrays
+
+    def save(self, directory):
+        """write every array to directory as .npy files, for load()"""
+        tmp_dir = '%s.tmp-%d' % (directory, os.getpid())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, values in self.arrays().items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), values)
+        with open(os.path.join(tmp_dir, SHARED_MANIFEST_NAME), 'w') as f:
+            json.dump({'version': self.version, 'vocab': self.vocab}, f)
+        os.rename(tmp_dir, directory)
+
+    @classmethod
+    def load(cls, directory, selection_cache=None):
+        """memory map a dataset written by save(), without copying any array"""
+        with open(os.path.join(directory, SHARED_MANIFEST_NAME)) as f:
+            saved = json.load(f)
+
+        def array(name):
+            # plain read-only ndarray views of the mapping, so results of
+            # indexing them are ordinary arrays
+            return np.asarray(np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+
+        vocab = saved['vocab']
+        cube_arrays = {}
+        for name in CountCube.ARRAYS + CountCube.HISTOGRAM_ARRAYS:
+            cube_arrays[name] = array('cube.' + name)
+        return cls(
+            {dim: array('codes.' + dim) for dim in DIMENSIONS},
+            vocab,
+            array('annual_pay'),
+            version=saved['version'],
+            selection_cache=selection_cache,
+            index={dim: (array('order.' + dim), array('offsets.' + dim)) for dim in DIMENSIONS},
+            cube=CountCube.from_arrays(cube_arrays, cls.cube_sizes(vocab)),
+        )
+
+    def __len__(self):
+        return len(self.annual_pay)
+
+    def codes_for(self, dim, values):
+        """translate dropdown values to codes, skipping values not in the data"""
+        lookup = self.lookup[dim]
+        return np.array([lookup[v] for v in values or [] if v in lookup], dtype=np.int64)
+
+    @staged('search')
+    def search(self, dim, query, limit=50):
+        """up to limit values of dim matching a dropdown search, most frequent first"""
+        index = self.search_index.get(dim)
+        if index is None:
+            index = self.search_index[dim] = SearchIndex(self.vocab[dim])
+        return index.search(query, limit)
+
+    def lookup_table(self, dim, values):
+        """boolean table indexed by code that is True for the codes of values"""
+        table = np.zeros(len(self.vocab[dim]) + 1, dtype=bool)
+        table[self.codes_for(dim, values)] = True
+        return table
+
+    def postings(self, dim, values):
+        """sorted row ids whose dim is one of values, from the inverted index"""
+        order, offsets = self.index[dim]
+        codes = np.unique(self.codes_for(dim, values))
+        if len(codes) == 1:
+            return order[offsets[codes[0]]:offsets[codes[0] + 1]]
+        rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in codes] or [order[:0]])
+        rows.sort()
+        return rows
+
+    def posting_size(self, dim, values):
+        """number of rows postings(dim, values) would return"""
+        _, offsets = self.index[dim]
+        codes = np.unique(self.codes_for(dim, values))
+        return int((offsets[codes + 1] - offsets[codes]).sum())
+
+    @staged('filter')
+    def select(self, companies=None, jobs=None, states=None):
+        """sorted row ids matching the selection; a dimension given as None is not filtered
+
+        Results are cached per normalized selection and returned read-only,
+        since every callback for one interaction shares the same array.
+        """
+        key = (
+            normalize_selection(companies),
+            normalize_selection(jobs),
+            normalize_selection(states),
+        )
+        return self.selection_cache.get_or_compute(key, lambda: self._select(*key))
+
+    def _select(self, companies, jobs, states):
+        """uncached select()
+
+        The values within a dimension are unioned from the inverted index of
+        whichever dimension matches the fewest rows, and those candidate rows
+        are then intersected with the other dimensions by probing their codes.
+        """
+        filters = [
+            (dim, values)
+            for dim, values in ((EMPLOYER, companies), (SOC, jobs), (STATE, states))
+            if values is not None
+        ]
+        if not filters:
+            rows = np.arange(len(self))
+            rows.flags.writeable = False
+            return rows
+
+        filters.sort(key=lambda f: self.posting_size(*f))
+        rows = self.postings(*filters[0])
+        for dim, values in filters[1:]:
+            if not len(rows):
+                break
+            rows = rows[self.lookup_table(dim, values)[self.codes[dim][rows]]]
+        rows.flags.writeable = False
+        return rows
+
+    def _ranked(self, dim, counts):
+        """values of dim with a non-zero count, most frequent first"""
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] > 0]
+        return [self.vocab[dim][i] for i in order], counts[order]
+
+    @staged('aggregate')
+    def employer_percentiles(self, rows, companies, percentiles):
+        """pay percentiles for each of companies over rows, in one grouped pass
+
+        Returns a dict of company to an array of percentiles, with NaNs for
+        companies that have no rows in the selection.
+        """
+        codes = np.unique(self.codes_for(EMPLOYER, companies))
+        groups = np.full(len(self.vocab[EMPLOYER]) + 1, -1, dtype=np.int64)
+        groups[codes] = np.arange(len(codes))
+        row_groups = groups[self.codes[EMPLOYER][rows]]
+        in_group = row_groups >= 0
+
+        table = group_percentiles(
+            row_groups[in_group], self.annual_pay[rows][in_group], percentiles, len(codes),
+        )
+        empty = np.full(len(percentiles), np.nan)
+        return {
+            company: table[groups[self.lookup[EMPLOYER][company]]]
+            if company in self.lookup[EMPLOYER] else empty
+            for company in companies
+        }
+
+    @staged('filter')
+    def _cells(self, companies=None, jobs=None, states=None):
+        """count cube cells matching a selection"""
+        return self.cube.cells(
+            employers=None if companies is None else self.codes_for(EMPLOYER, companies),
+            soc_table=None if jobs is None else self.lookup_table(SOC, jobs),
+            state_table=None if states is None else self.lookup_table(STATE, states),
+        )
+
+    @staged('aggregate')
+    def salary_histograms(self, companies, jobs=None, states=None):
+        """pay histogram on SALARY_BIN_EDGES for each of companies
+
+        Returns a dict of company to bin counts, summed from the count cube
+        (all zeros for companies not in the data).
+        """
+        codes = np.unique(self.codes_for(EMPLOYER, companies))
+        counts = self.cube.histograms(
+            'employer', self._cells(companies, jobs, states), codes,
+        )
+        by_code = dict(zip(codes.tolist(), counts))
+        empty = np.zeros(len(self.cube.bin_edges) - 1, dtype=np.int64)
+        return {
+            company: by_code.get(self.lookup[EMPLOYER].get(company), empty)
+            for company in companies
+        }
+
+    @staged('aggregate')
+    def count_by(self, dim, companies=None, jobs=None, states=None):
+        """values of dim with their row counts for a selection, most frequent first
+
+        The counts are summed from the count cube, so no rows are read.
+        """
+        cells = self._cells(companies, jobs, states)
+        counts = self.cube.count_by(CUBE_DIMENSIONS[dim], cells)[:-1]
+        return self._ranked(dim, counts)
+
+    @staged('aggregate')
+    def top_employers(self, jobs=None, states=None, limit=25, offset=0, by='count'):
+        """a page of the employers with the most filings, or highest median pay, for a selection
+
+        Returns the employer names, their filings or median pay (by 'count'
+        or 'median') and their filings, best first from rank offset.
+        """
+        if self.ranking is None:
+            self.ranking = EmployerRanking(self.cube)
+        soc_table = None if jobs is None else self.lookup_table(SOC, jobs)
+        state_table = None if states is None else self.lookup_table(STATE, states)
+        if by == 'count':
+            codes, counts = self.ranking.top_by_count(offset + limit, soc_table, state_table)
+            values = counts
+        elif by == 'median':
+            codes, values, counts = self.ranking.top_by_median(offset + limit, soc_table, state_table)
+        else:
+            raise ValueError("employers can be ranked by 'count' or 'median', not %r" % by)
+        names = [self.vocab[EMPLOYER][code] for code in codes[offset:]]
+        return names, values[offset:], counts[offset:]
@@ -0,0 +1,142 @@
+"""
+Download of the rows behind the dashboard's charts.
+
+export_view takes the same company, job and state selection as the
+callbacks (each as a repeated query parameter, all values when left out)
+and streams the matching rows as csv, or as an Arrow IPC stream if the
+pyarrow package is installed. Rows are written a chunk at a time straight
+from the dataset's code and pay arrays, so neither a filtered DataFrame nor
+the whole response body is ever held in memory. Under ASGI the chunks are
+generated on the server's thread pool rather than the event loop (see
+concurrency.ThreadedStreamingHandler).
+"""
+import csv
+import io
+
+import numpy as np
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+
+from dashboard import warmup
+from dashboard.dataset import DIMENSIONS, EMPLOYER, SOC, STATE
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+COLUMNS = DIMENSIONS + ('annual_pay', )
+
+# query parameter holding the selection of each dimension
+PARAMETERS = {EMPLOYER: 'companies', SOC: 'jobs', STATE: 'states'}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def csv_chunks(data, rows, chunk_rows):
+    """the header and then rows of data as csv text, chunk_rows rows at a time"""
+    # missing values have the code one past the end of the vocabulary
+    names = {dim: np.array(data.vocab[dim] + [''], dtype=object) for dim in DIMENSIONS}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        columns = [names[dim][data.codes[dim][chunk]] for dim in DIMENSIONS]
+        # to the cent, so floating point noise from annualizing isn't written
+        columns.append(data.annual_pay[chunk].round(2).tolist())
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(zip(*columns))
+        yield buffer.getvalue()
+
+
+class _Sink:
+    """file-like object collecting what pyarrow writes until it is drained"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_chunks(data, rows, chunk_rows):
+    """rows of data as an Arrow IPC stream, one record batch per chunk_rows rows
+
+    The employer, job and state columns are dictionary arrays over the
+    dataset's vocabularies, so each chunk only carries the codes.
+    """
+    schema = pyarrow.schema(
+        [(dim, pyarrow.dictionary(pyarrow.int32(), pyarrow.string())) for dim in DIMENSIONS]
+        + [('annual_pay', pyarrow.float64())]
+    )
+    dictionaries = {dim: pyarrow.array(data.vocab[dim], type=pyarrow.string()) for dim in DIMENSIONS}
+    sink = _Sink()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        columns = []
+        for dim in DIMENSIONS:
+            codes = data.codes[dim][chunk].astype(np.int32)
+            columns.append(pyarrow.DictionaryArray.from_arrays(
+                codes, dictionaries[dim], mask=codes == len(data.vocab[dim]),
+            ))
+        columns.append(pyarrow.array(data.annual_pay[chunk], type=pyarrow.float64()))
+        writer.write_batch(pyarrow.record_batch(columns, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def selection(request, dim):
+    """the values selected for dim, or None when the parameter is left out"""
+    name = PARAMETERS[dim]
+    if name not in request.GET:
+        return None
+    return [value for value in request.GET.getlist(name) if value]
+
+
+def export_view(request):
+    """stream the rows of one fiscal year matching the selection in the query string"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        return HttpResponseBadRequest("format must be one of %s" % ', '.join(CONTENT_TYPES))
+    if export_format == 'arrow' and pyarrow is None:
+        return HttpResponseBadRequest("arrow exports need the pyarrow package")
+
+    module = warmup.wait()
+    try:
+        year = int(request.GET.get('year') or module.catalog.default_year)
+        data = module.get_dataset(year)
+    except (KeyError, ValueError):
+        raise Http404("no H1B data for fiscal year %r" % request.GET.get('year'))
+
+    rows = data.select(selection(request, EMPLOYER), selection(request, SOC), selection(request, STATE))
+    chunks = csv_chunks if export_format == 'csv' else arrow_chunks
+    response = StreamingHttpResponse(
+        chunks(data, rows, settings.H1B_EXPORT_CHUNK_ROWS),
+        content_type=CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = 'attachment; filename="h1b-fy%d.%s"' % (year, export_format)
+    return response
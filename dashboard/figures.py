@@ -0,0 +1,151 @@
+"""
+Fast path from a dashboard callback to its json response.
+
+The callbacks build figures from plain dicts holding numpy arrays (bar()
+and layout() below) instead of plotly.graph_objs objects, so none of
+plotly's per-property validation runs for figures the server built itself.
+
+fast_update wraps django_plotly_dash's update view. Requests for a
+single-output callback of the dashboard's stateless app are dispatched
+straight to the callback function. The result is encoded with orjson, which
+writes numpy arrays natively, so there is no per-request Dash instance, flask
+request context or PlotlyJSONEncoder pass. Any other request falls through to
+the wrapped view. orjson is pinned in requirements.txt; without it,
+responses are encoded with PlotlyJSONEncoder as before, and a warning is
+logged once the fast path is set up.
+"""
+import json
+import logging
+from functools import lru_cache, wraps
+
+import numpy as np
+from dash.exceptions import PreventUpdate
+from django.conf import settings
+from django.http import HttpResponse
+from plotly.utils import PlotlyJSONEncoder
+
+from dashboard import warmup
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def bar(**props):
+    """a bar trace as a plain dict"""
+    return dict(props, type='bar')
+
+
+def _title(title):
+    return title if isinstance(title, dict) else {'text': title}
+
+
+def layout(title=None, xaxis=None, yaxis=None, **props):
+    """a figure layout as a plain dict
+
+    Titles are given as strings, like go.Layout takes them, and written in
+    the {'text': ...} form go.Layout would have turned them into.
+    """
+    result = dict(props)
+    if title is not None:
+        result['title'] = _title(title)
+    for name, axis in (('xaxis', xaxis), ('yaxis', yaxis)):
+        if axis is not None:
+            axis = dict(axis)
+            if 'title' in axis:
+                axis['title'] = _title(axis['title'])
+            result[name] = axis
+    return result
+
+
+# the encoder's default() turns what json can't write into what it can
+_plotly_encoder = PlotlyJSONEncoder()
+
+
+def _default(value):
+    """orjson fallback for what it doesn't write natively, written as PlotlyJSONEncoder would
+
+    That covers graph objects, pandas objects and timestamps, and numpy
+    arrays orjson leaves out (object arrays, or ones that aren't C-contiguous).
+    """
+    return _plotly_encoder.default(value)
+
+
+def dumps(value):
+    """json bytes for a callback result, NaN written as null"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, cls=PlotlyJSONEncoder).encode('utf-8')
+
+
+def loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class Route:
+    """a registered callback: the property it updates and the ones it reads"""
+
+    def __init__(self, output, arguments, function):
+        self.output = output
+        self.arguments = arguments
+        self.function = function
+
+
+@lru_cache(maxsize=None)
+def routes(app):
+    """dict of "id.property" to Route for each single-output callback of a DjangoDash app"""
+    table = {}
+    for callback_set, function in app._callback_sets:
+        output = callback_set['output']
+        if isinstance(output, (list, tuple)):
+            continue
+        arguments = [
+            (item.component_id, item.component_property)
+            for item in list(callback_set['inputs']) + list(callback_set['state'])
+        ]
+        table['%s.%s' % (output.component_id, output.component_property)] = Route(
+            output.component_property, arguments, function,
+        )
+    return table
+
+
+def fast_update(view):
+    """django_plotly_dash's update view, with the fast path for the dashboard's callbacks"""
+    if orjson is None and settings.H1B_FAST_FIGURES:
+        logger.warning(
+            "orjson is not installed - dashboard callback responses are encoded with "
+            "PlotlyJSONEncoder, which is much slower for figures (pip install -r requirements.txt)"
+        )
+
+    @wraps(view)
+    def fast_view(request, ident, stateless=False, **kwargs):
+        if not (stateless and settings.H1B_FAST_FIGURES):
+            return view(request, ident, stateless=stateless, **kwargs)
+        app = warmup.load_stateless_app(ident)
+        body = loads(request.body)
+        output = body.get('output') if app is not None else None
+        route = routes(app).get(output) if isinstance(output, str) else None
+        if route is None:
+            return view(request, ident, stateless=stateless, **kwargs)
+
+        values = {
+            (item['id'], item['property']): item.get('value')
+            for item in body.get('inputs', []) + body.get('state', [])
+        }
+        if not all(argument in values for argument in route.arguments):
+            return view(request, ident, stateless=stateless, **kwargs)
+
+        try:
+            value = route.function(*[values[argument] for argument in route.arguments])
+        except PreventUpdate:
+            return HttpResponse(status=204)
+        return HttpResponse(
+            dumps({'response': {'props': {route.output: value}}}),
+            content_type='application/json',
+        )
+    return fast_view
@@ -0,0 +1,118 @@
+"""
+In-process cache for responses that only change with the dataset.
+
+The Dash layout and dependency responses are the same for every visitor
+until the data is rebuilt, so they are rendered once per version, stored
+along with gzip (and, if the brotli package is installed, brotli) encoded
+copies, and served with a strong ETag. Repeat visitors sending the ETag back
+in If-None-Match get a 304 Not Modified with no body.
+"""
+import gzip
+import hashlib
+import re
+import threading
+from functools import wraps
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# encodings tried in order of preference
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip', )
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=9)
+
+
+def accepted_encoding(request):
+    """best encoding in ENCODINGS the client accepts, or None for identity"""
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = re.search(r'q=([0-9.]+)', params)
+        accepted[name.strip().lower()] = float(quality.group(1)) if quality else 1.0
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class CachedBody:
+    """a rendered response body with its encoded copies and ETags"""
+
+    def __init__(self, version, body, content_type):
+        self.version = version
+        self.content_type = content_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {None: body}
+        self.etags = {None: '"%s"' % digest}
+        for encoding in ENCODINGS:
+            self.bodies[encoding] = compress(body, encoding)
+            self.etags[encoding] = '"%s-%s"' % (digest, encoding)
+
+    def matches(self, request):
+        """check whether If-None-Match names any encoding of this body"""
+        header = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if header.strip() == '*':
+            return True
+        # compare weakly - proxies may add W/ to tags they pass on
+        tags = {tag.strip().replace('W/', '', 1) for tag in header.split(',')}
+        return not tags.isdisjoint(self.etags.values())
+
+
+def cached_response(request, entry, cache_control):
+    """response for a CachedBody in the best encoding the client accepts
+
+    A 304 with no body if the client already has it.
+    """
+    encoding = accepted_encoding(request)
+    if entry.matches(request):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(entry.bodies[encoding], content_type=entry.content_type)
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = entry.etags[encoding]
+    response['Cache-Control'] = cache_control
+    patch_vary_headers(response, ('Accept-Encoding', ))
+    return response
+
+
+def cache_per_version(version, cache_control='public, max-age=0, must-revalidate'):
+    """decorator caching a GET view's 200 responses until version() changes
+
+    Responses are cached per set of url keyword arguments. Requests with a
+    cache_id (initial arguments stored in the session) are not cached.
+    """
+    def decorator(view):
+        entries = {}
+        lock = threading.Lock()
+
+        @wraps(view)
+        def cached_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or kwargs.get('cache_id'):
+                return view(request, *args, **kwargs)
+
+            key = tuple(sorted(kwargs.items()))
+            current = version()
+            with lock:
+                entry = entries.get(key)
+            if entry is None or entry.version != current:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                entry = CachedBody(current, response.content, response['Content-Type'])
+                with lock:
+                    entries[key] = entry
+
+            return cached_response(request, entry, cache_control)
+
+        return cached_view
+    return decorator
@@ -0,0 +1,251 @@
+import inspect
+import json
+import os
+import resource
+import statistics
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+import plotly.graph_objs as go
+from plotly.utils import PlotlyJSONEncoder
+
+from dashboard import figures, partitions, pipeline, synthetic
+from dashboard.dataset import EMPLOYER, SOC, STATE, H1BDataset
+
+# fiscal year the synthetic partitions are built as
+BENCH_YEAR = 2019
+
+# timings faster than this are not reported as regressions
+NOISE_SECONDS = 0.001
+
+
+def peak_rss_mb():
+    """peak resident memory of this process so far, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def flatten(results, prefix=''):
+    """{'a': {'b': 1}} -> {'a/b': 1}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '/'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the store build, dataset load and dashboard callbacks on "
+        "synthetic disclosure data at several sizes."
+    )
+    # the url checks import the dashboard, which needs a store to exist
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[100000, 1000000],
+            help="sizes of the synthetic csv files to benchmark, in rows",
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="times each callback is run - the median is reported",
+        )
+        parser.add_argument(
+            '--workdir', default=os.path.join(settings.BASE_DIR, 'data', 'bench'),
+            help="directory for the synthetic csv files and stores (reused between runs)",
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="random seed for the synthetic data",
+        )
+        parser.add_argument(
+            '--save-baseline', metavar='FILE',
+            help="write the results to FILE as json",
+        )
+        parser.add_argument(
+            '--baseline', metavar='FILE',
+            help="compare against results saved with --save-baseline",
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="fraction a timing may exceed its baseline before it counts as a regression",
+        )
+
+    def handle(self, *args, **options):
+        os.makedirs(options['workdir'], exist_ok=True)
+        results = {}
+        for rows in options['rows']:
+            results[str(rows)] = self.bench_scale(rows, options)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write("saved results to %s" % options['save_baseline'])
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def bench_scale(self, rows, options):
+        """build a synthetic partition of rows rows and time the dashboard on it"""
+        workdir = options['workdir']
+        source = os.path.join(workdir, 'synthetic-%d-%d.csv' % (rows, options['seed']))
+        if not os.path.exists(source):
+            self.stdout.write("generating %s" % source)
+            synthetic.generate_csv(source, rows, seed=options['seed'])
+
+        root = os.path.join(workdir, 'store-%d-%d' % (rows, options['seed']))
+        store_dir = partitions.partition_dir(root, BENCH_YEAR)
+        build_seconds, _ = timed(
+            pipeline.build_store, source, store_dir, soc_major_groups=settings.H1B_SOC_MAJOR_GROUPS,
+            finalize=partial(partitions.write_summary, soc_major_groups=settings.H1B_SOC_MAJOR_GROUPS),
+        )
+        if settings.H1B_SHARED_DATASET:
+            seconds, _ = timed(H1BDataset.save_shared, store_dir, settings.H1B_SOC_MAJOR_GROUPS)
+            build_seconds += seconds
+
+        with override_settings(
+            H1B_STORE_DIR=root, H1B_DEFAULT_FISCAL_YEAR=BENCH_YEAR, H1B_SOURCES={},
+        ):
+            # imported here so the module level load finds the synthetic store
+            from dashboard.dash_apps.finished_apps import h1b_salary
+
+            def load():
+                catalog = h1b_salary.get_catalog()
+                return catalog, catalog.dataset()
+
+            load_seconds, (h1b_salary.catalog, data) = timed(load)
+
+            result = {
+                'build_store': build_seconds,
+                'get_dataset': load_seconds,
+                'callbacks': {
+                    name: self.bench_callbacks(h1b_salary, data, selection, options['repeat'])
+                    for name, selection in self.selections(h1b_salary, data).items()
+                },
+                'dataset_rows': len(data),
+                'peak_rss_mb': peak_rss_mb(),
+            }
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            "%d csv rows -> %d dashboard rows: build %.3fs, get_dataset %.3fs, peak rss %.0f MB" % (
+                rows, len(data), build_seconds, load_seconds, result['peak_rss_mb'],
+            )
+        ))
+        self.stdout.write("%-10s %-34s %10s %10s %10s %10s %10s" % (
+            'selection', 'callback', 'call', 'validate', 'serialize', 'fast', 'bytes',
+        ))
+        for selection, callbacks in result['callbacks'].items():
+            for name, timing in callbacks.items():
+                self.stdout.write("%-10s %-34s %10.4f %10.4f %10.4f %10.4f %10d" % (
+                    selection, name, timing['call'], timing['validate'], timing['serialize'],
+                    timing['serialize_fast'], timing['bytes'],
+                ))
+        return result
+
+    def selections(self, module, data):
+        """small, default and large dropdown selections for a dataset"""
+        return {
+            'small': {
+                'companies': data.vocab[EMPLOYER][:1],
+                'jobs': data.vocab[SOC][:1],
+                'states': data.vocab[STATE][:1],
+            },
+            'default': {
+                'companies': module.DEFAULT_COMPANIES,
+                'jobs': module.DEFAULT_JOBS,
+                'states': module.DEFAULT_STATES,
+            },
+            'large': {
+                'companies': data.vocab[EMPLOYER][:25],
+                'jobs': data.vocab[SOC][:5],
+                'states': data.vocab[STATE],
+            },
+        }
+
+    def bench_callbacks(self, module, data, selection, repeat):
+        """median call and serialization time of every update_* callback
+
+        Arguments are filled in by parameter name, and the selection cache is
+        cleared before every call so each one does the full work. Each result
+        is encoded both the way Dash does it (PlotlyJSONEncoder) and by the
+        fast path (figures.dumps); validate is what building the figure
+        through plotly's graph objects would add on top.
+        """
+        arguments = dict(
+            selection,
+            year=BENCH_YEAR,
+            percentiles=[25, 50, 75],
+            search_value=selection['companies'][0][:3],
+        )
+        timings = {}
+        for name in sorted(vars(module)):
+            callback = getattr(module, name)
+            if not name.startswith('update_') or not callable(callback):
+                continue
+            parameters = inspect.signature(callback).parameters
+            kwargs = {key: arguments[key] for key in parameters if key in arguments}
+
+            calls = []
+            validations = []
+            serializations = []
+            fast_serializations = []
+            for _ in range(repeat):
+                data.selection_cache.clear()
+                seconds, figure = timed(callback, **kwargs)
+                calls.append(seconds)
+                validations.append(timed(self.validate, figure)[0])
+                seconds, body = timed(json.dumps, figure, cls=PlotlyJSONEncoder)
+                serializations.append(seconds)
+                seconds, fast_body = timed(figures.dumps, figure)
+                fast_serializations.append(seconds)
+            timings[name] = {
+                'call': statistics.median(calls),
+                'validate': statistics.median(validations),
+                'serialize': statistics.median(serializations),
+                'serialize_fast': statistics.median(fast_serializations),
+                'bytes': len(body),
+                'fast_bytes': len(fast_body),
+            }
+        return timings
+
+    @staticmethod
+    def validate(figure):
+        """build a figure's traces and layout as plotly graph objects, as the callbacks used to"""
+        if isinstance(figure, dict) and 'data' in figure:
+            for trace in figure['data']:
+                go.Bar(trace)
+            go.Layout(figure['layout'])
+
+    def compare(self, results, baseline_path, tolerance):
+        """print each timing against the baseline and fail on regressions"""
+        with open(baseline_path) as f:
+            baseline = flatten(json.load(f))
+
+        regressions = []
+        self.stdout.write("%-70s %10s %10s %8s" % ('timing', 'baseline', 'current', 'ratio'))
+        for key, current in sorted(flatten(results).items()):
+            before = baseline.get(key)
+            if before is None or key.endswith(('bytes', 'rows')):
+                continue
+            ratio = current / before if before else float('inf')
+            line = "%-70s %10.4f %10.4f %8.2f" % (key, before, current, ratio)
+            if ratio > 1 + tolerance and current - before > NOISE_SECONDS and 'rss' not in key:
+                regressions.append(key)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        if regressions:
+            raise CommandError("%d timings regressed more than %d%% against %s" % (
+                len(regressions), tolerance * 100, baseline_path,
+            ))
+        self.stdout.write(self.style.SUCCESS("no regressions against %s" % baseline_path))
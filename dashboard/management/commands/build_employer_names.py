@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import pipeline
+from dashboard.canonical import EmployerNames
+
+
+class Command(BaseCommand):
+    help = (
+        "Group the spelling variants of every employer name in the raw disclosure "
+        "csv files and save the table build_h1b_store canonicalizes names with."
+    )
+    # the url checks import the dashboard, which needs a store to exist
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', nargs='+',
+            help="raw disclosure csv files to read (default: every csv in H1B_SOURCES)",
+        )
+        parser.add_argument(
+            '--output', default=settings.H1B_EMPLOYER_NAMES,
+            help="file to save the table to",
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=settings.H1B_EMPLOYER_SIMILARITY,
+            help="trigram similarity two names need to be treated as the same employer",
+        )
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError("H1B_EMPLOYER_NAMES is not set - pass --output")
+
+        sources = options['source']
+        if not sources:
+            sources = []
+            for year, source in sorted(settings.H1B_SOURCES.items()):
+                for path, _ in pipeline.source_files(source):
+                    if os.path.exists(path) and not pipeline.is_lfs_pointer(path):
+                        sources.append(path)
+                    else:
+                        self.stderr.write("skipping FY%d - %s is missing or a git-lfs pointer" % (
+                            year, path,
+                        ))
+        for source in sources:
+            if not os.path.exists(source):
+                raise CommandError("source csv %s does not exist" % source)
+
+        started = time.perf_counter()
+        table = EmployerNames.from_sources(sources, threshold=options['threshold'])
+        table.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            "grouped %d employer names into %d employers in %.3fs - saved to %s" % (
+                len(table), len(table.canonical), time.perf_counter() - started, options['output'],
+            )
+        ))
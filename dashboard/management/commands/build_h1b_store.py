@@ -0,0 +1,162 @@
+import os
+from functools import partial
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import partitions, pipeline, store
+from dashboard.dataset import H1BDataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Clean and annualize the raw H1B disclosure csv for each fiscal year and "
+        "write the columnar store partitions that the dashboard loads."
+    )
+    # the url checks import the dashboard, which needs the store this builds
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year', type=int, nargs='+', default=sorted(settings.H1B_SOURCES),
+            help="fiscal years to build (default: every year in H1B_SOURCES)",
+        )
+        parser.add_argument(
+            '--source', nargs='+',
+            help="raw disclosure csv files to build from instead of H1B_SOURCES - needs a single --year",
+        )
+        parser.add_argument(
+            '--store', default=settings.H1B_STORE_DIR,
+            help="directory to write the year partitions to",
+        )
+        parser.add_argument(
+            '--chunksize', type=int, default=pipeline.DEFAULT_CHUNKSIZE,
+            help="rows per chunk read from the csv",
+        )
+        parser.add_argument(
+            '--soc-groups', nargs='+', default=settings.H1B_SOC_MAJOR_GROUPS,
+            help="SOC major groups to keep (first two digits of SOC_CODE)",
+        )
+        parser.add_argument(
+            '--all-soc-groups', action='store_true',
+            help="keep every SOC major group instead of --soc-groups",
+        )
+        parser.add_argument(
+            '--download', action='store_true',
+            help="fetch each csv from its H1B_SOURCES url if it is missing or a git-lfs pointer",
+        )
+        parser.add_argument(
+            '--append', action='store_true',
+            help="only read the csv files that are new or changed since a partition was built, "
+                 "keeping the rows of the others",
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help="rebuild even if a partition is up to date with its csv",
+        )
+
+    def handle(self, *args, **options):
+        years = options['year']
+        if options['source'] and len(years) != 1:
+            raise CommandError("--source needs exactly one --year")
+        if options['append'] and options['force']:
+            raise CommandError("--append and --force can't be used together")
+
+        soc_groups = None if options['all_soc_groups'] else sorted(options['soc_groups'])
+        sources = {}
+        for year in years:
+            if options['source']:
+                files = [(source, None) for source in options['source']]
+            elif year in settings.H1B_SOURCES:
+                files = pipeline.source_files(settings.H1B_SOURCES[year])
+            else:
+                raise CommandError("fiscal year %d is not in H1B_SOURCES" % year)
+            sources[year] = [self.fetch_source(source, url, options) for source, url in files]
+            try:
+                store.source_names(sources[year])
+            except ValueError as e:
+                raise CommandError("FY%d: %s" % (year, e))
+
+        # every year is canonicalized with the same table, built from all the
+        # sources the first time
+        if settings.H1B_EMPLOYER_NAMES and not os.path.exists(settings.H1B_EMPLOYER_NAMES):
+            call_command('build_employer_names', stdout=self.stdout, stderr=self.stderr)
+
+        for year, files in sources.items():
+            self.build_year(
+                year, files, partitions.partition_dir(options['store'], year), soc_groups, options,
+            )
+
+    def fetch_source(self, source, url, options):
+        """check the csv for a year exists, downloading it first with --download"""
+        if options['download'] and url and (
+            not os.path.exists(source) or pipeline.is_lfs_pointer(source)
+        ):
+            self.stdout.write("downloading %s" % url)
+            pipeline.download_source(url, source)
+
+        if not os.path.exists(source):
+            raise CommandError("source csv %s does not exist" % source)
+        if pipeline.is_lfs_pointer(source):
+            raise CommandError(
+                "%s is a git-lfs pointer - run `git lfs pull` or pass --download" % source
+            )
+        return source
+
+    def build_year(self, year, sources, store_dir, soc_groups, options):
+        """build the partition for one fiscal year unless it is up to date
+
+        With --append only the new or changed csv files are read, if the
+        partition was built with the same settings.
+        """
+        metadata = pipeline.build_metadata(soc_groups, settings.H1B_EMPLOYER_NAMES)
+        plan = None if options['force'] else store.plan_append(store_dir, sources, metadata=metadata)
+        if plan is not None and not plan[1] and not plan[2]:
+            self.stdout.write("FY%d store at %s is up to date with %s" % (
+                year, store_dir, ', '.join(sources),
+            ))
+            # the dashboard only reads summaries, so write any it would refuse
+            if partitions.ensure_summary(store_dir, settings.H1B_SOC_MAJOR_GROUPS):
+                self.stdout.write("wrote the FY%d summary tables for SOC groups %s" % (
+                    year, ', '.join(sorted(settings.H1B_SOC_MAJOR_GROUPS)),
+                ))
+            self.save_shared(store_dir)
+            return
+
+        keep = None
+        if options['append'] and plan is not None:
+            keep, sources, dropped = plan
+            self.stdout.write("FY%d: keeping the rows of %s, dropping %s, reading %s" % (
+                year, ', '.join(source['path'] for source in keep) or 'no files',
+                ', '.join(dropped) or 'no files', ', '.join(sources) or 'no files',
+            ))
+        elif options['append']:
+            self.stdout.write(
+                "FY%d store at %s is missing or was built with other settings - "
+                "rebuilding it from every file" % (year, store_dir)
+            )
+
+        # the summaries count the groups the dashboard shows, whatever the store keeps
+        manifest, stats = pipeline.build_store(
+            sources, store_dir, chunksize=options['chunksize'], soc_major_groups=soc_groups,
+            finalize=partial(partitions.write_summary, soc_major_groups=settings.H1B_SOC_MAJOR_GROUPS),
+            employer_names_path=settings.H1B_EMPLOYER_NAMES, keep=keep,
+        )
+
+        self.stdout.write("%-22s %10s %12s %12s" % ('stage', 'seconds', 'rows in', 'rows out'))
+        for stage in stats:
+            self.stdout.write("%-22s %10.3f %12d %12d" % (
+                stage.name, stage.seconds, stage.rows_in, stage.rows_out,
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            "wrote %d FY%d rows to %s (dataset version %s)" % (
+                manifest['rows'], year, store_dir, manifest['dataset_version'],
+            )
+        ))
+        self.save_shared(store_dir)
+
+    def save_shared(self, store_dir):
+        """save the dashboard's memory mapped copy now rather than on the first request"""
+        if settings.H1B_SHARED_DATASET:
+            H1BDataset.save_shared(store_dir, settings.H1B_SOC_MAJOR_GROUPS)
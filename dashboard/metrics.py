@@ -0,0 +1,296 @@
+"""
+In-process latency and size metrics for the dashboard callbacks.
+
+Callbacks wrapped with instrument() record their total duration, the size
+of each dropdown selection they were called with, and how long they spent in
+each stage. Stages are timed with stage() (or the staged() decorator on the
+dataset methods): "filter" for selecting rows or cube cells, "aggregate"
+for counting and percentiles, and whatever is left of the callback counts as
+"figure". The wrapped Dash update view adds "serialize", the time dash spent
+turning the figure into json, and the size of the response.
+
+Everything is kept as histograms in this process and rendered in the
+Prometheus text format by metrics_view. Optionally a sampling profiler
+records where slow callbacks spend their time and logs it.
+"""
+import inspect
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels, **extra):
+    """label set in the text format, with backslashes, quotes and newlines escaped"""
+    labels = OrderedDict(labels, **extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """histograms and gauges of one process, rendered for Prometheus"""
+
+    def __init__(self):
+        self.histograms = OrderedDict()
+        self.help = {}
+        self.gauges = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, help='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, OrderedDict())
+            if key not in series:
+                series[key] = Histogram(buckets)
+                self.help.setdefault(name, help)
+            series[key].observe(value)
+
+    def gauge(self, name, collect, help=''):
+        """register collect(), returning a list of (labels dict, value), as gauge name"""
+        self.gauges[name] = (collect, help)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self):
+        """every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in self.histograms.items():
+                lines.append('# HELP %s %s' % (name, self.help.get(name, '')))
+                lines.append('# TYPE %s histogram' % name)
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf', ), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (name, _labels(key, le=bound), cumulative))
+                    lines.append('%s_sum%s %s' % (name, _labels(key), _number(histogram.sum)))
+                    lines.append('%s_count%s %d' % (name, _labels(key), histogram.count))
+
+        for name, (collect, help) in list(self.gauges.items()):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in collect():
+                lines.append('%s%s %s' % (name, _labels(sorted(labels.items())), _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# per-thread state of the callback being run
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """time a stage of the running instrumented callback
+
+    Time spent in stages nested inside this one is only counted for the
+    innermost stage. Outside an instrumented callback this does nothing.
+    """
+    frames = getattr(_local, 'frames', None)
+    if frames is None:
+        yield
+        return
+    frame = [name, 0.0]
+    frames.append(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        frames.pop()
+        frames[-1][1] += elapsed
+        _local.stages[name] = _local.stages.get(name, 0.0) + elapsed - frame[1]
+
+
+def staged(name):
+    """decorator running a function as stage name"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SlowCallbackProfiler:
+    """samples the stacks of threads running callbacks, from one background thread
+
+    Stacks are only kept while a callback runs; callbacks slower than
+    threshold seconds log their most common stacks.
+    """
+
+    def __init__(self, threshold, interval=0.005, top=5):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, counter in self.samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counter[tuple(traceback.format_stack(frame, limit=12))] += 1
+
+    def start(self, thread_id):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='h1b-profiler', daemon=True)
+                self._thread.start()
+            self.samples[thread_id] = Counter()
+
+    def stop(self, thread_id, callback, seconds):
+        with self._lock:
+            samples = self.samples.pop(thread_id, Counter())
+        if seconds < self.threshold or not samples:
+            return
+        total = sum(samples.values())
+        report = ['%s took %.3fs - %d stack samples' % (callback, seconds, total)]
+        for stack, count in samples.most_common(self.top):
+            report.append('%d%% of samples in:\n%s' % (100 * count // total, ''.join(stack)))
+        logger.warning('\n'.join(report))
+
+
+profiler = None
+
+
+def configure(profile_slow_seconds=None, profile_interval=0.005):
+    """turn the slow callback profiler on (threshold in seconds) or off (None)"""
+    global profiler
+    profiler = None
+    if profile_slow_seconds is not None:
+        profiler = SlowCallbackProfiler(profile_slow_seconds, interval=profile_interval)
+
+
+def instrument(callback):
+    """record duration, stages and selection sizes of a Dash callback"""
+    name = callback.__name__
+    parameters = list(inspect.signature(callback).parameters)
+
+    @wraps(callback)
+    def wrapper(*args, **kwargs):
+        arguments = dict(zip(parameters, args), **kwargs)
+        for key, value in arguments.items():
+            if isinstance(value, (list, tuple)):
+                registry.observe(
+                    'h1b_callback_selection_size', len(value), buckets=SIZE_BUCKETS,
+                    help='number of values selected in each callback input',
+                    callback=name, input=key,
+                )
+
+        active_profiler = profiler
+        thread_id = threading.get_ident()
+        if active_profiler is not None:
+            active_profiler.start(thread_id)
+        _local.frames = [['figure', 0.0]]
+        _local.stages = {}
+        started = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            stages = _local.stages
+            stages['figure'] = seconds - _local.frames[0][1]
+            _local.frames = None
+            _local.last_callback = (name, seconds)
+            if active_profiler is not None:
+                active_profiler.stop(thread_id, name, seconds)
+
+            registry.observe(
+                'h1b_callback_seconds', seconds,
+                help='time spent in each dashboard callback', callback=name,
+            )
+            for stage_name, stage_seconds in stages.items():
+                registry.observe(
+                    'h1b_callback_stage_seconds', stage_seconds,
+                    help='time spent in each stage of each dashboard callback',
+                    callback=name, stage=stage_name,
+                )
+
+    return wrapper
+
+
+def instrument_update_view(view):
+    """record serialization time and response size of the Dash update view"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        _local.last_callback = None
+        started = time.perf_counter()
+        response = view(request, *args, **kwargs)
+        seconds = time.perf_counter() - started
+
+        callback = 'unknown'
+        if _local.last_callback is not None:
+            callback, callback_seconds = _local.last_callback
+            registry.observe(
+                'h1b_callback_stage_seconds', max(seconds - callback_seconds, 0.0),
+                help='time spent in each stage of each dashboard callback',
+                callback=callback, stage='serialize',
+            )
+        registry.observe(
+            'h1b_update_seconds', seconds,
+            help='time to answer each Dash update request', callback=callback,
+        )
+        if not response.streaming:
+            registry.observe(
+                'h1b_update_response_bytes', len(response.content), buckets=BYTES_BUCKETS,
+                help='size of each Dash update response', callback=callback,
+            )
+        return response
+    return wrapper
+
+
+def metrics_view(request):
+    """the process's metrics in the Prometheus text format"""
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,465 @@
+"""
+Fiscal-year partitions of the dataset store.
+
+Each fiscal year is built into its own store under H1B_STORE_DIR/fy<year>.
+A partition is only loaded into memory the first time its year is selected,
+and only a bounded number stay loaded. Every partition also carries a small
+summary of filing counts and pay totals per (employer, SOC, state), so charts
+comparing years read the summaries instead of opening every partition.
+A partition rebuilt while the dashboard runs (`build_h1b_store --append`) is
+noticed by its manifest changing, and its year is loaded again.
+
+Partitions also carry aggregate tables for the JSON API: the filing count,
+mean pay and pay percentiles for every combination of employer, SOC and
+state, and for every rollup to one or two of those dimensions.
+
+A store can hold more SOC major groups than the dashboard shows (see
+`build_h1b_store --soc-groups`). The summary and aggregate tables only count
+the rows of the dashboard's groups, so the API agrees with the charts, and
+record which groups those were. Like the shared dataset, the tables are only
+ever written by `build_h1b_store` - the dashboard refuses tables that are
+missing or count other groups rather than writing them on a request.
+"""
+import itertools
+import os
+import re
+import threading
+
+import numpy as np
+
+from dashboard import store
+from dashboard.cache import LRUCache
+from dashboard.dataset import (
+    CUBE_DIMENSIONS, DEFAULT_SOC_MAJOR_GROUPS, DIMENSIONS, EMPLOYER, SOC, STATE, H1BDataset,
+    group_percentiles, soc_group_rows,
+)
+from dashboard.metrics import staged
+
+PARTITION_PATTERN = re.compile(r'^fy(\d{4})$')
+
+SUMMARY_NAME = 'summary.npz'
+AGGREGATES_NAME = 'aggregates.npz'
+
+# pay percentiles in the aggregate tables
+AGGREGATE_PERCENTILES = (25, 50, 75)
+
+# every grouping with an aggregate table, as tuples of dimensions
+GROUPINGS = [
+    grouping
+    for size in range(1, len(DIMENSIONS) + 1)
+    for grouping in itertools.combinations(DIMENSIONS, size)
+]
+
+
+def partition_dir(root, year):
+    """store directory for one fiscal year"""
+    return os.path.join(root, 'fy%d' % int(year))
+
+
+def list_years(root):
+    """fiscal years with a built partition under root, oldest first"""
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    years = []
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match and store.read_manifest(os.path.join(root, name)) is not None:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+def _save_npz(directory, name, arrays):
+    """write arrays to directory/name, replacing it atomically so readers never see part of it"""
+    # .npz is appended by np.savez unless the name already ends with it
+    tmp_path = os.path.join(directory, '%s.tmp-%d.npz' % (name, os.getpid()))
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+
+def write_summary(directory, soc_major_groups=DEFAULT_SOC_MAJOR_GROUPS):
+    """write the summary and aggregate tables for the rows of soc_major_groups in a store"""
+    rows = soc_group_rows(directory, soc_major_groups)
+    codes = [store.read_column(directory, dim)[rows].astype(np.int64) for dim in DIMENSIONS]
+    sizes = [len(store.read_vocab(directory, dim)) + 1 for dim in DIMENSIONS]
+    pay = store.read_column(directory, 'annual_pay')[rows]
+
+    # shift codes by one so missing values (-1) get their own cell
+    key = ((codes[0] + 1) * sizes[1] + codes[1] + 1) * sizes[2] + codes[2] + 1
+    cells, row_cells, counts = np.unique(key, return_inverse=True, return_counts=True)
+    _save_npz(directory, SUMMARY_NAME, {
+        'employer': cells // (sizes[1] * sizes[2]) - 1,
+        'soc': (cells // sizes[2]) % sizes[1] - 1,
+        'state': cells % sizes[2] - 1,
+        'count': counts,
+        'pay_sum': np.bincount(row_cells, weights=pay, minlength=len(cells)),
+        'soc_major_groups': np.array(sorted(soc_major_groups), dtype=str),
+    })
+    write_aggregates(directory, soc_major_groups)
+
+
+def grouping_name(grouping):
+    """'employer.state' for (EMPLOYER, STATE)"""
+    return '.'.join(CUBE_DIMENSIONS[dim] for dim in grouping)
+
+
+def write_aggregates(directory, soc_major_groups=DEFAULT_SOC_MAJOR_GROUPS):
+    """write counts, mean pay and pay percentiles of every grouping for the rows of soc_major_groups
+
+    Each grouping's cells are keyed by their codes combined in mixed radix,
+    shifted by one so missing values (-1) get their own cell, and sorted so
+    lookups can binary search them.
+    """
+    rows = soc_group_rows(directory, soc_major_groups)
+    codes = {dim: store.read_column(directory, dim)[rows].astype(np.int64) + 1 for dim in DIMENSIONS}
+    sizes = {dim: len(store.read_vocab(directory, dim)) + 1 for dim in DIMENSIONS}
+    pay = np.asarray(store.read_column(directory, 'annual_pay')[rows], dtype=np.float64)
+
+    arrays = {'soc_major_groups': np.array(sorted(soc_major_groups), dtype=str)}
+    for grouping in GROUPINGS:
+        key = np.zeros(len(pay), dtype=np.int64)
+        for dim in grouping:
+            key = key * sizes[dim] + codes[dim]
+        cells, groups = np.unique(key, return_inverse=True)
+        count = np.bincount(groups, minlength=len(cells))
+        name = grouping_name(grouping)
+        arrays[name + '.key'] = cells
+        arrays[name + '.count'] = count
+        arrays[name + '.mean'] = np.bincount(groups, weights=pay, minlength=len(cells)) / count
+        arrays[name + '.percentiles'] = group_percentiles(
+            groups, pay, AGGREGATE_PERCENTILES, len(cells),
+        )
+
+    _save_npz(directory, AGGREGATES_NAME, arrays)
+
+
+def saved_groups(saved):
+    """sorted SOC major groups a loaded summary or aggregates file counts, None if unknown"""
+    if 'soc_major_groups' not in saved:
+        return None
+    return sorted(saved['soc_major_groups'].tolist())
+
+
+def tables_count(directory, soc_major_groups):
+    """whether a store's summary and aggregate tables exist and count soc_major_groups"""
+    for name in (SUMMARY_NAME, AGGREGATES_NAME):
+        try:
+            with np.load(os.path.join(directory, name)) as saved:
+                if saved_groups(saved) != sorted(soc_major_groups):
+                    return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def ensure_summary(directory, soc_major_groups=DEFAULT_SOC_MAJOR_GROUPS):
+    """write a store's summary and aggregate tables unless they already count soc_major_groups
+
+    Returns whether they were written. Holds the store's build lock.
+    """
+    with store.build_lock(directory):
+        if tables_count(directory, soc_major_groups):
+            return False
+        write_summary(directory, soc_major_groups)
+        return True
+
+
+class YearSummary:
+    """filing counts and pay totals per (employer, SOC, state) for one year"""
+
+    def __init__(self, directory):
+        self.version = store.read_manifest(directory)['dataset_version']
+        with np.load(os.path.join(directory, SUMMARY_NAME)) as summary:
+            self.soc_major_groups = saved_groups(summary)
+            self.cells = {
+                EMPLOYER: summary['employer'],
+                SOC: summary['soc'],
+                STATE: summary['state'],
+            }
+            self.count = summary['count']
+            self.pay_sum = summary['pay_sum']
+        self.lookup = {
+            dim: {value: code for code, value in enumerate(store.read_vocab(directory, dim))}
+            for dim in DIMENSIONS
+        }
+
+    def _matching(self, dim, values):
+        codes = [self.lookup[dim][v] for v in values if v in self.lookup[dim]]
+        return np.isin(self.cells[dim], codes)
+
+    @staged('aggregate')
+    def employer_totals(self, companies, jobs, states):
+        """dict of company to (filings, mean annual pay) for the selection"""
+        selected = self._matching(SOC, jobs) & self._matching(STATE, states)
+        totals = {}
+        for company in companies:
+            cells = selected & (self.cells[EMPLOYER] == self.lookup[EMPLOYER].get(company, -2))
+            count = int(self.count[cells].sum())
+            pay = self.pay_sum[cells].sum() / count if count else None
+            totals[company] = (count, pay)
+        return totals
+
+
+class YearAggregates:
+    """aggregate tables of one year, answering queries by value names"""
+
+    def __init__(self, directory):
+        self.version = store.read_manifest(directory)['dataset_version']
+        self.vocab = {dim: store.read_vocab(directory, dim) for dim in DIMENSIONS}
+        self.sizes = {dim: len(self.vocab[dim]) + 1 for dim in DIMENSIONS}
+        # shifted codes, as in the tables
+        self.lookup = {
+            dim: {value: code + 1 for code, value in enumerate(self.vocab[dim])}
+            for dim in DIMENSIONS
+        }
+        self.tables = {}
+        with np.load(os.path.join(directory, AGGREGATES_NAME)) as saved:
+            self.soc_major_groups = saved_groups(saved)
+            for grouping in GROUPINGS:
+                name = grouping_name(grouping)
+                self.tables[grouping] = {
+                    field: saved[name + '.' + field]
+                    for field in ('key', 'count', 'mean', 'percentiles')
+                }
+
+    def _decode(self, grouping, keys):
+        """dict of dim to shifted codes of each key"""
+        codes = {}
+        for dim in reversed(grouping):
+            codes[dim] = keys % self.sizes[dim]
+            keys = keys // self.sizes[dim]
+        return codes
+
+    def _records(self, grouping, positions, codes):
+        """one dict per table position, naming the cell by its values"""
+        table = self.tables[grouping]
+        records = []
+        for i, position in enumerate(positions):
+            record = {
+                CUBE_DIMENSIONS[dim]: self.vocab[dim][codes[dim][i] - 1] if codes[dim][i] else None
+                for dim in grouping
+            }
+            if position is None:
+                record.update(count=0, mean_pay=None, pay_percentiles=None)
+            else:
+                record.update(
+                    count=int(table['count'][position]),
+                    mean_pay=round(float(table['mean'][position]), 2),
+                    pay_percentiles={
+                        str(p): round(float(value), 2)
+                        for p, value in zip(AGGREGATE_PERCENTILES, table['percentiles'][position])
+                    },
+                )
+            records.append(record)
+        return records
+
+    @staged('aggregate')
+    def query(self, group_by, selection, limit):
+        """the largest cells of grouping group_by among the selection
+
+        selection maps each dimension to a list of values, or None for every
+        value. A dimension filtered but not grouped by can only have one
+        value - it is then added to the grouping, since percentiles can't be
+        combined across cells.
+        """
+        grouping = set(group_by)
+        for dim, values in selection.items():
+            if values is not None and dim not in grouping:
+                if len(values) != 1:
+                    raise ValueError(
+                        "group by %s to select more than one of its values" % CUBE_DIMENSIONS[dim]
+                    )
+                grouping.add(dim)
+        grouping = tuple(dim for dim in DIMENSIONS if dim in grouping)
+
+        table = self.tables[grouping]
+        codes = self._decode(grouping, table['key'])
+        matching = np.ones(len(table['key']), dtype=bool)
+        for dim, values in selection.items():
+            if values is not None:
+                wanted = [self.lookup[dim][v] for v in values if v in self.lookup[dim]]
+                matching &= np.isin(codes[dim], wanted)
+
+        positions = np.flatnonzero(matching)
+        positions = positions[np.argsort(-table['count'][positions], kind='stable')][:limit]
+        return grouping, self._records(
+            grouping, positions, {dim: codes[dim][positions] for dim in grouping},
+        )
+
+    @staged('aggregate')
+    def lookup_cells(self, cells):
+        """the aggregates of each cell, a dict of dimension to value
+
+        Cells are answered from the table of the dimensions they name, with a
+        zero count for values or combinations with no filings.
+        """
+        results = [None] * len(cells)
+        by_grouping = {}
+        for i, cell in enumerate(cells):
+            grouping = tuple(dim for dim in DIMENSIONS if dim in cell)
+            by_grouping.setdefault(grouping, []).append(i)
+
+        for grouping, indexes in by_grouping.items():
+            table = self.tables[grouping]
+            # unknown values get code -1, which no key can match
+            codes = {
+                dim: np.array([self.lookup[dim].get(cells[i][dim], -1) for i in indexes],
+                              dtype=np.int64)
+                for dim in grouping
+            }
+            keys = np.zeros(len(indexes), dtype=np.int64)
+            for dim in grouping:
+                keys = keys * self.sizes[dim] + codes[dim]
+            known = np.all([codes[dim] >= 0 for dim in grouping], axis=0)
+            positions = np.searchsorted(table['key'], keys).clip(max=len(table['key']) - 1)
+            found = known & (table['key'][positions] == keys)
+
+            records = self._records(
+                grouping, [p if f else None for p, f in zip(positions, found)],
+                {dim: codes[dim].clip(min=0) for dim in grouping},
+            )
+            for i, record in zip(indexes, records):
+                # echo the requested values, known or not
+                record.update({CUBE_DIMENSIONS[dim]: cells[i][dim] for dim in grouping})
+                results[i] = record
+        return results
+
+
+class PartitionCatalog:
+    """lazily loaded datasets and summaries for the fiscal-year partitions
+
+    At most max_open partitions are kept loaded; the least recently selected
+    one is dropped when another year is opened. With shared=True partitions
+    are memory mapped (see H1BDataset.from_store). Each year is loaded under
+    its own lock, so loading one year never holds up callbacks for the years
+    already loaded.
+
+    Every lookup checks the partition's dataset version, read again from its
+    manifest whenever the file changes, and a year whose partition has been
+    rebuilt is loaded again. A rebuilt partition whose shared copy isn't saved
+    yet keeps being answered from the loaded one until it is.
+    """
+
+    def __init__(self, root, soc_major_groups, default_year=None, max_open=2,
+                 selection_cache=None, shared=False):
+        self.root = root
+        self.soc_major_groups = soc_major_groups
+        self.shared = shared
+        self.selection_cache = selection_cache or {}
+        self.years = list_years(root)
+        if default_year not in self.years:
+            default_year = self.years[-1] if self.years else None
+        self.default_year = default_year
+
+        self._datasets = LRUCache(max_entries=max_open, sizeof=lambda value: 0)
+        self._summaries = {}
+        self._aggregates = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._year_locks = {}
+
+    def _year(self, year):
+        year = self.default_year if year is None else int(year)
+        if year not in self.years:
+            raise KeyError('no H1B partition for fiscal year %s under %s' % (year, self.root))
+        return year
+
+    def _year_lock(self, year):
+        """the lock held while one year's partition is being loaded"""
+        with self._lock:
+            return self._year_locks.setdefault(year, threading.Lock())
+
+    def version(self, year=None):
+        """dataset version of a year's partition as it is on disk now
+
+        The manifest is only read again when it has been replaced, and the
+        last version read is kept while a rebuild is swapping it.
+        """
+        year = self._year(year)
+        directory = partition_dir(self.root, year)
+        known = self._versions.get(year)
+        try:
+            stat = os.stat(os.path.join(directory, store.MANIFEST_NAME))
+        except OSError:
+            stat = None
+        if stat is not None and (known is None or known[0] != (stat.st_ino, stat.st_mtime_ns)):
+            manifest = store.read_manifest(directory)
+            if manifest is not None:
+                known = self._versions[year] = (
+                    (stat.st_ino, stat.st_mtime_ns), manifest['dataset_version'],
+                )
+        return known[1] if known is not None else None
+
+    @staged('load')
+    def dataset(self, year=None):
+        """the H1BDataset for a fiscal year, loading its partition on first use
+        and again after it is rebuilt"""
+        year = self._year(year)
+        version = self.version(year)
+        dataset = self._datasets.get(year)
+        if dataset is None or dataset.version != version:
+            with self._year_lock(year):
+                dataset = self._datasets.get(year)
+                if dataset is None or dataset.version != version:
+                    try:
+                        dataset = self._datasets.put(year, H1BDataset.from_store(
+                            partition_dir(self.root, year),
+                            soc_major_groups=self.soc_major_groups,
+                            selection_cache=LRUCache(**self.selection_cache),
+                            shared=self.shared,
+                        ))
+                    except FileNotFoundError:
+                        # the shared copy of the new version isn't saved yet
+                        if dataset is None:
+                            raise
+        return dataset
+
+    def loaded(self):
+        """dict of year to dataset for the partitions currently loaded"""
+        return dict(self._datasets.items())
+
+    def _read_tables(self, directory, table_class):
+        """a YearSummary or YearAggregates of the catalog's SOC major groups
+
+        Tables that are missing (partitions built before they existed) or
+        count other groups raise FileNotFoundError - they are never written
+        here, where a worker writing them would hold up every other worker
+        on the machine behind the store's build lock.
+        """
+        wanted = sorted(self.soc_major_groups)
+        try:
+            tables = table_class(directory)
+        except FileNotFoundError:
+            tables = None
+        if tables is None or tables.soc_major_groups != wanted:
+            raise FileNotFoundError(
+                "no summary tables of SOC groups %s in %s - run `python manage.py "
+                "build_h1b_store --soc-groups %s` to write them" % (
+                    ', '.join(wanted), directory, ' '.join(wanted),
+                )
+            )
+        return tables
+
+    def _tables(self, year, loaded, table_class):
+        year = self._year(year)
+        version = self.version(year)
+        tables = loaded.get(year)
+        if tables is None or tables.version != version:
+            with self._year_lock(year):
+                tables = loaded.get(year)
+                if tables is None or tables.version != version:
+                    tables = loaded[year] = self._read_tables(
+                        partition_dir(self.root, year), table_class,
+                    )
+        return tables
+
+    @staged('load')
+    def summary(self, year):
+        """the YearSummary for a fiscal year, read once per dataset version"""
+        return self._tables(year, self._summaries, YearSummary)
+
+    @staged('load')
+    def aggregates(self, year=None):
+        """the YearAggregates for a fiscal year, read once per dataset version"""
+        return self._tables(year, self._aggregates, YearAggregates)
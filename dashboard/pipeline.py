@@ -0,0 +1,301 @@
+"""
+Cleaning and annualization pipeline for the raw H1B disclosure csv.
+
+The raw file is read in chunks and each chunk is passed through the stages in
+STAGES in order. Every stage is a vectorized function from DataFrame to
+DataFrame, and the runner records how long each stage took and how many rows
+went in and came out, so `manage.py build_h1b_store` can report where the
+build spends its time.
+
+Employer names are replaced by their canonical names, from the table built
+by `manage.py build_employer_names` when there is one (see
+dashboard.canonical).
+
+Only the columns in RAW_COLUMNS are parsed, rows outside the wanted SOC major
+groups are dropped as soon as each chunk is read, and cleaned chunks are
+streamed straight into the store, so peak memory depends on the chunk size
+rather than the size of the disclosure file.
+
+A year can be built from several disclosure files (OFLC publishes them a
+quarter at a time). When files are added or replaced, build_store can keep
+the cleaned rows of the files that haven't changed and only run the new ones
+through the pipeline (see store.plan_append).
+"""
+import os
+import shutil
+import time
+from collections import OrderedDict
+from functools import partial
+from urllib.request import urlopen
+
+import pandas as pd
+
+from dashboard import canonical, store
+
+DEFAULT_CHUNKSIZE = 200000
+
+# raw csv columns the pipeline reads - everything is parsed as a string and
+# converted by the stages below
+RAW_COLUMNS = [
+    'EMPLOYER_NAME',
+    'SOC_CODE',
+    'SOC_NAME',
+    'WAGE_UNIT_OF_PAY',
+    'WAGE_RATE_OF_PAY_FROM',
+    'JOB_TITLE',
+    'WORKSITE_STATE',
+]
+RAW_DTYPES = {name: str for name in RAW_COLUMNS}
+
+# columns kept in the local dataset store
+STORE_COLUMNS = [
+    'EMPLOYER_NAME',
+    'SOC_CODE',
+    'SOC_NAME',
+    'WAGE_UNIT_OF_PAY',
+    'JOB_TITLE',
+    'WORKSITE_STATE',
+    'annual_pay',
+    'soc_major_group',
+]
+
+# multiplier to convert each WAGE_UNIT_OF_PAY to annual pay
+ANNUALIZED_CONVERSION = {
+    'Year': 1,
+    'Hour': 2080,
+    'Month': 12,
+    'Week': 52,
+    'Bi-Weekly': 26,
+}
+
+# annual pay at or above this is treated as an outlier
+MAX_ANNUAL_PAY = 400000
+
+
+def split_soc_code(df):
+    """separate SOC CODE into two groups - first two digits are the major group"""
+    df['soc_major_group'] = df['SOC_CODE'].astype(str).str.split('-', n=1).str[0]
+    return df
+
+
+def filter_soc_groups(df, soc_major_groups):
+    """keep only the rows in the given SOC major groups"""
+    # copy so later stages can add columns to the filtered chunk
+    return df.loc[df['soc_major_group'].isin(soc_major_groups)].copy()
+
+
+def parse_pay(df):
+    """standardize pay field"""
+    df['base_salary'] = df['WAGE_RATE_OF_PAY_FROM'].astype(str).str.replace(
+        '$', '', regex=False,
+    ).str.replace(',', '', regex=False).astype(float)
+    return df
+
+
+def clean_employer_names(df, employer_names=None):
+    """replace employer names with their canonical names from an EmployerNames table
+
+    Without a table names are only normalized - case, punctuation and legal
+    suffixes removed.
+    """
+    if employer_names is None:
+        employer_names = canonical.EmployerNames([], [], [])
+    df['EMPLOYER_NAME'] = employer_names.lookup(df['EMPLOYER_NAME'])
+    return df
+
+
+def annualize_pay(df):
+    """convert pay field to annual"""
+    df['annual_pay'] = df['base_salary'] * df['WAGE_UNIT_OF_PAY'].map(ANNUALIZED_CONVERSION)
+    return df
+
+
+def drop_outliers(df):
+    """remove outliers on annual pay"""
+    return df.loc[df['annual_pay'] < MAX_ANNUAL_PAY]
+
+
+def project_columns(df):
+    """shrink to only needed columns"""
+    return df[STORE_COLUMNS]
+
+
+STAGES = [
+    ('split_soc_code', split_soc_code),
+    ('parse_pay', parse_pay),
+    ('clean_employer_names', clean_employer_names),
+    ('annualize_pay', annualize_pay),
+    ('drop_outliers', drop_outliers),
+    ('project_columns', project_columns),
+]
+
+
+def build_stages(soc_major_groups=None, employer_names=None):
+    """STAGES, filtering to soc_major_groups right after the SOC split if given
+
+    Filtering first means the employer name cleanup only runs on rows that
+    are kept. employer_names is the EmployerNames table to clean names with.
+    """
+    stages = list(STAGES)
+    if employer_names is not None:
+        position = [name for name, _ in stages].index('clean_employer_names')
+        stages[position] = (
+            'clean_employer_names', partial(clean_employer_names, employer_names=employer_names),
+        )
+    if soc_major_groups:
+        position = [name for name, _ in stages].index('split_soc_code') + 1
+        stages.insert(position, (
+            'filter_soc_groups', partial(filter_soc_groups, soc_major_groups=list(soc_major_groups)),
+        ))
+    return stages
+
+
+def empty_frame():
+    """a cleaned frame with no rows, for sources with no data"""
+    return pd.DataFrame({
+        name: pd.Series([], dtype='float64' if name == 'annual_pay' else 'object')
+        for name in STORE_COLUMNS
+    })
+
+
+def source_files(source):
+    """(csv path, url) of each file of an H1B_SOURCES entry
+
+    'csv' is a single path or a list of them, and 'url', if given, is the
+    same shape.
+    """
+    paths = store.source_paths(source['csv'])
+    urls = source.get('url')
+    urls = [None] * len(paths) if urls is None else store.source_paths(urls)
+    return list(zip(paths, urls))
+
+
+def is_lfs_pointer(path):
+    """check whether path is a git-lfs pointer stub rather than the real csv"""
+    with open(path, 'rb') as f:
+        return f.read(40).startswith(b'version https://git-lfs')
+
+
+def download_source(url, path):
+    """stream url to path, replacing the file only once the download completes"""
+    tmp_path = '%s.download-%d' % (path, os.getpid())
+    with urlopen(url) as response, open(tmp_path, 'wb') as f:
+        shutil.copyfileobj(response, f, 1 << 20)
+    os.replace(tmp_path, path)
+
+
+class StageStats:
+    """running totals for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def record(self, seconds, rows_in, rows_out):
+        self.seconds += seconds
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+
+    def __repr__(self):
+        return '%s: %.3fs, %d -> %d rows' % (self.name, self.seconds, self.rows_in, self.rows_out)
+
+
+def run_pipeline(source_csv, sink, chunksize=DEFAULT_CHUNKSIZE, soc_major_groups=None,
+                 employer_names=None):
+    """read and clean source_csv chunk by chunk, passing each cleaned chunk to sink
+
+    Returns the list of StageStats, starting with the csv read and ending
+    with the time spent in sink.
+    """
+    stages = build_stages(soc_major_groups, employer_names=employer_names)
+    stats = OrderedDict([('read_csv', StageStats('read_csv'))])
+    for name, _ in stages:
+        stats[name] = StageStats(name)
+    stats['write_store'] = StageStats('write_store')
+
+    reader = pd.read_csv(source_csv, usecols=RAW_COLUMNS, dtype=RAW_DTYPES, chunksize=chunksize)
+    chunks = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            chunk = next(reader)
+        except StopIteration:
+            break
+        stats['read_csv'].record(time.perf_counter() - started, len(chunk), len(chunk))
+
+        for name, stage in stages:
+            rows_in = len(chunk)
+            started = time.perf_counter()
+            chunk = stage(chunk)
+            stats[name].record(time.perf_counter() - started, rows_in, len(chunk))
+
+        started = time.perf_counter()
+        sink(chunk)
+        stats['write_store'].record(time.perf_counter() - started, len(chunk), len(chunk))
+        chunks += 1
+
+    if not chunks:
+        sink(empty_frame())
+    return list(stats.values())
+
+
+def build_metadata(soc_major_groups=None, employer_names_path=None):
+    """build options recorded in the manifest - a store is stale if they change"""
+    return {
+        'soc_major_groups': sorted(soc_major_groups) if soc_major_groups else None,
+        'employer_names': canonical.table_version(employer_names_path),
+    }
+
+
+def build_store(source_csvs, store_dir, chunksize=DEFAULT_CHUNKSIZE, soc_major_groups=None,
+                finalize=None, employer_names_path=None, keep=None):
+    """stream source_csvs through the pipeline into a new store at store_dir
+
+    source_csvs is a csv path or a list of them, written in order.
+    employer_names_path is a saved EmployerNames table to canonicalize
+    employer names with, if it exists. keep are sources of the current store
+    at store_dir whose rows are copied over rather than rebuilt, from
+    store.plan_append. finalize is passed on to StoreWriter.close. Returns
+    the new manifest and the per-stage stats. Raises ValueError for sources
+    with the same file name, see store.source_names.
+    """
+    store.source_names(source_csvs)
+    metadata = build_metadata(soc_major_groups, employer_names_path)
+    employer_names = None
+    if metadata['employer_names'] is not None:
+        employer_names = canonical.EmployerNames.load(employer_names_path)
+    with store.build_lock(store_dir):
+        writer = store.StoreWriter(store_dir, metadata=metadata)
+        try:
+            stats = OrderedDict()
+            if keep:
+                started = time.perf_counter()
+                writer.carry_over(keep)
+                stats['carry_over'] = StageStats('carry_over')
+                stats['carry_over'].record(time.perf_counter() - started, writer.rows, writer.rows)
+
+            for source_csv in store.source_paths(source_csvs):
+                for stage in run_pipeline(
+                    source_csv, writer.append, chunksize=chunksize,
+                    soc_major_groups=soc_major_groups, employer_names=employer_names,
+                ):
+                    stats.setdefault(stage.name, StageStats(stage.name)).record(
+                        stage.seconds, stage.rows_in, stage.rows_out,
+                    )
+                writer.end_source(source_csv)
+            if writer.columns is None:
+                writer.append(empty_frame())
+
+            started = time.perf_counter()
+            manifest = writer.close(finalize=finalize)
+            stats.setdefault('write_store', StageStats('write_store')).record(
+                time.perf_counter() - started, 0, 0,
+            )
+            stats = list(stats.values())
+        except BaseException:
+            writer.abort()
+            raise
+
+    return manifest, stats
@@ -0,0 +1,142 @@
+"""
+Top employers for a job and state selection, without counting every employer.
+
+The count cube's cells are regrouped into one list per (SOC, state) pair,
+holding the employers with filings in that pair sorted by count, most first.
+Ranking by filings is a threshold algorithm over the lists the selection
+picks: the first `depth` entries of every list are read, the exact totals of
+the employers seen are looked up in the cube, and an employer not yet seen
+can total at most the sum of the next count in each list. Once the k-th best
+total beats that bound the top k are known; otherwise the depth is doubled.
+Popular employers sit at the top of most lists, so the search usually stops
+after a small fraction of the cells.
+
+Ranking by median pay can't be bounded that way, so it sums the cube's pay
+histograms per employer over the selected cells and reads the median off the
+combined histogram, interpolating within the bin it falls in. Neither
+ranking reads any rows.
+"""
+import numpy as np
+
+from dashboard.cube import ranges
+
+# the lists are summed outright once the search would read more than
+# 1 / SCAN_SHARE of their entries
+SCAN_SHARE = 4
+
+
+def _best(codes, values, limit):
+    """the limit codes with the largest values, largest first and ties by code"""
+    if len(values) > limit > 0:
+        kth = np.partition(values, len(values) - limit)[len(values) - limit]
+        keep = values >= kth
+        codes, values = codes[keep], values[keep]
+    order = np.lexsort((codes, -values))[:limit]
+    return codes[order], values[order]
+
+
+class EmployerRanking:
+    """employer counts of each (SOC, state) pair of a CountCube, sorted by count"""
+
+    def __init__(self, cube):
+        self.cube = cube
+        # employers are ranked by name, so filings without one are left out
+        self.missing = cube.sizes[0] - 1
+        n_state = cube.sizes[2]
+        pairs = cube.soc.astype(np.int64) * n_state + cube.state
+        order = np.lexsort((cube.employer, -cube.counts, pairs))
+        order = order[cube.employer[order] != self.missing]
+
+        # entries of list l are offsets[l]:offsets[l + 1], most filings first
+        keys, starts = np.unique(pairs[order], return_index=True)
+        self.list_soc = keys // n_state
+        self.list_state = keys % n_state
+        self.offsets = np.append(starts, len(order)).astype(np.int64)
+        self.employers = cube.employer[order].astype(np.int64)
+        self.counts = cube.counts[order]
+
+    def lists(self, soc_table=None, state_table=None):
+        """the lists of the (SOC, state) pairs selected by two lookup tables"""
+        selected = np.ones(len(self.list_soc), dtype=bool)
+        if soc_table is not None:
+            selected &= soc_table[self.list_soc]
+        if state_table is not None:
+            selected &= state_table[self.list_state]
+        return np.flatnonzero(selected)
+
+    def totals(self, employers, soc_table=None, state_table=None):
+        """filings of each of employers (unique codes) in the selected pairs"""
+        cube = self.cube
+        cells = cube.cells(employers=employers, soc_table=soc_table, state_table=state_table)
+        counts = np.bincount(cube.employer[cells], weights=cube.counts[cells], minlength=cube.sizes[0])
+        return counts[employers].astype(np.int64)
+
+    def top_by_count(self, limit, soc_table=None, state_table=None):
+        """codes and filings of the limit employers with the most filings
+
+        Ties are broken by code, as in H1BDataset.count_by. Returns fewer
+        employers if fewer have filings in the selection.
+        """
+        if limit <= 0:
+            return self.employers[:0], self.counts[:0].astype(np.int64)
+        lists = self.lists(soc_table, state_table)
+        starts, ends = self.offsets[lists], self.offsets[lists + 1]
+        size = (ends - starts).sum()
+        depth = limit
+        while True:
+            read = np.minimum(starts + depth, ends)
+            if (read - starts).sum() * SCAN_SHARE >= size:
+                # reading this deep is most of the lists - summing them is cheaper
+                entries = ranges(starts, ends)
+                totals = np.bincount(
+                    self.employers[entries], weights=self.counts[entries], minlength=self.missing,
+                ).astype(np.int64)
+                codes = np.flatnonzero(totals)
+                return _best(codes, totals[codes], limit)
+
+            seen = np.unique(self.employers[ranges(starts, read)])
+            codes, totals = _best(seen, self.totals(seen, soc_table, state_table), limit)
+            # an employer not seen yet has at most the next count of every list
+            threshold = self.counts[read[read < ends]].sum()
+            if len(codes) == limit and totals[-1] > threshold:
+                return codes, totals
+            depth *= 2
+
+    def top_by_median(self, limit, soc_table=None, state_table=None):
+        """codes, median pay and filings of the limit employers with the highest median pay
+
+        Medians are interpolated within the salary bin they fall in. Ties are
+        broken by filings, then by code.
+        """
+        cube = self.cube
+        n_bins = len(cube.bin_edges) - 1
+        cells = cube.cells(soc_table=soc_table, state_table=state_table)
+        cells = cells[cube.employer[cells] != self.missing]
+        entries = ranges(cube.hist_offsets[cells], cube.hist_offsets[cells + 1])
+        keys, groups = np.unique(
+            cube.employer[cube.hist_cells[entries]].astype(np.int64) * n_bins
+            + cube.hist_bins[entries],
+            return_inverse=True,
+        )
+        bin_counts = np.bincount(groups, weights=cube.hist_counts[entries], minlength=len(keys))
+        if not len(keys):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, np.zeros(0), empty
+
+        # keys are sorted by employer, then bin
+        employers, starts = np.unique(keys // n_bins, return_index=True)
+        bins = keys % n_bins
+        cumulative = np.cumsum(bin_counts)
+        before = np.append(0, cumulative[starts[1:] - 1])
+        counts = np.append(cumulative[starts[1:] - 1], cumulative[-1]) - before
+
+        # the first bin of each employer reaching half its filings
+        half = before + counts / 2
+        median_entry = np.searchsorted(cumulative, half, side='left')
+        below = np.append(0, cumulative)[median_entry]
+        lower = cube.bin_edges[bins[median_entry]]
+        width = cube.bin_edges[bins[median_entry] + 1] - lower
+        medians = lower + width * (half - below) / bin_counts[median_entry]
+
+        order = np.lexsort((employers, -counts, -medians))[:limit]
+        return employers[order], medians[order], counts[order].astype(np.int64)
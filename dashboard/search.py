@@ -0,0 +1,92 @@
+"""
+Type-ahead search over the values of one dataset dimension.
+
+Values are given in rank order (the dataset keeps each dimension's
+vocabulary most frequent first), so the best match is always the one with
+the lowest code. Queries of three or more characters are substring matches
+answered from a trigram index: the postings of the query's trigrams are
+intersected and the candidates checked in rank order until enough matches
+are found. Shorter queries are prefix matches found by bisecting the sorted
+values.
+"""
+from bisect import bisect_left
+
+import numpy as np
+
+GRAM = 3
+
+
+def normalize(value):
+    """case-insensitive form of a value or query"""
+    return str(value).casefold()
+
+
+class SearchIndex:
+    """trigram and prefix index over values ordered best first"""
+
+    def __init__(self, values):
+        self.values = values
+        self.keys = [normalize(v) for v in values]
+
+        grams = {}
+        gram_ids = []
+        codes = []
+        for code, key in enumerate(self.keys):
+            for gram in {key[i:i + GRAM] for i in range(len(key) - GRAM + 1)}:
+                gram_ids.append(grams.setdefault(gram, len(grams)))
+                codes.append(code)
+        gram_ids = np.array(gram_ids, dtype=np.int64)
+
+        # codes containing gram g are postings[offsets[g]:offsets[g + 1]], ascending
+        self.grams = grams
+        self.postings = np.array(codes, dtype=np.int64)[np.argsort(gram_ids, kind='stable')]
+        self.offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(grams)), out=self.offsets[1:])
+
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self.sorted_keys = [self.keys[code] for code in order]
+        self.sorted_codes = np.array(order, dtype=np.int64)
+
+    def _prefix(self, query, limit):
+        start = bisect_left(self.sorted_keys, query)
+        end = bisect_left(self.sorted_keys, query + '\U0010ffff', lo=start)
+        codes = self.sorted_codes[start:end]
+        if len(codes) > limit:
+            codes = np.partition(codes, limit - 1)[:limit]
+        return np.sort(codes)
+
+    def _substring(self, query, limit):
+        postings = []
+        for i in range(len(query) - GRAM + 1):
+            gram = self.grams.get(query[i:i + GRAM])
+            if gram is None:
+                return []
+            postings.append(self.postings[self.offsets[gram]:self.offsets[gram + 1]])
+
+        postings.sort(key=len)
+        candidates = postings[0]
+        for other in postings[1:]:
+            candidates = np.intersect1d(candidates, other, assume_unique=True)
+
+        # trigrams can all match without the query itself matching
+        matches = []
+        for code in candidates.tolist():
+            if query in self.keys[code]:
+                matches.append(code)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def search(self, query, limit=50):
+        """up to limit values matching query, best ranked first
+
+        An empty query returns the top ranked values.
+        """
+        query = normalize(query or '').strip()
+        if not query:
+            codes = range(min(limit, len(self.values)))
+        elif len(query) < GRAM:
+            codes = self._prefix(query, limit)
+        else:
+            codes = self._substring(query, limit)
+        return [self.values[code] for code in codes]
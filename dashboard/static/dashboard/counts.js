@@ -0,0 +1,171 @@
+/*
+ * Count charts drawn in the browser, with H1B_CLIENTSIDE_COUNTS on.
+ *
+ * The count_table store holds the count cube of the selected fiscal year:
+ * its dataset version, the vocabulary of each dimension, and the
+ * (employer, soc, state) cells that occur as parallel arrays of codes with
+ * their counts. Each function in the h1b namespace mirrors the python
+ * callback of the same name in dash_apps/finished_apps/h1b_salary.py, and
+ * countBarFigure mirrors count_bar_figure.
+ *
+ * Ranking the companies by median pay needs their pay histograms, which
+ * aren't sent, so that page of the ranking is read from the
+ * company_median_ranking store the server fills instead.
+ */
+(function () {
+    'use strict';
+
+    // maps from value to code of each dimension, built once per table
+    var lookups = new WeakMap();
+
+    function codesOf(table, dim) {
+        var maps = lookups.get(table);
+        if (!maps) {
+            maps = {};
+            lookups.set(table, maps);
+        }
+        if (!maps[dim]) {
+            maps[dim] = new Map();
+            table.vocab[dim].forEach(function (value, code) {
+                maps[dim].set(value, code);
+            });
+        }
+        return maps[dim];
+    }
+
+    // table indexed by code that is 1 for the codes of values
+    function lookupTable(table, dim, values) {
+        var codes = codesOf(table, dim);
+        // the extra last slot is the code of missing values
+        var selected = new Uint8Array(table.vocab[dim].length + 1);
+        values.forEach(function (value) {
+            if (codes.has(value)) {
+                selected[codes.get(value)] = 1;
+            }
+        });
+        return selected;
+    }
+
+    // values of dim with their counts for a selection, most frequent first.
+    // selection maps dimensions to lists of values; null or missing ones
+    // aren't filtered
+    function countBy(table, dim, selection) {
+        var cells = table.cells;
+        var filters = [];
+        Object.keys(selection).forEach(function (name) {
+            if (selection[name] != null) {
+                filters.push([cells[name], lookupTable(table, name, selection[name])]);
+            }
+        });
+
+        var vocab = table.vocab[dim];
+        var totals = new Float64Array(vocab.length + 1);
+        var codes = cells[dim];
+        var counts = cells.count;
+        for (var i = 0; i < counts.length; i++) {
+            var keep = true;
+            for (var f = 0; keep && f < filters.length; f++) {
+                keep = filters[f][1][filters[f][0][i]] === 1;
+            }
+            if (keep) {
+                totals[codes[i]] += counts[i];
+            }
+        }
+
+        // missing values, the last code, aren't shown; ties keep code order
+        var order = [];
+        for (var code = 0; code < vocab.length; code++) {
+            if (totals[code] > 0) {
+                order.push(code);
+            }
+        }
+        order.sort(function (a, b) {
+            return totals[b] - totals[a] || a - b;
+        });
+        return {
+            names: order.map(function (code) { return vocab[code]; }),
+            counts: order.map(function (code) { return totals[code]; })
+        };
+    }
+
+    function countBarFigure(result, title, xaxisTitle) {
+        return {
+            data: [{
+                y: result.names,
+                x: result.counts,
+                orientation: 'h',
+                text: result.counts,
+                textposition: 'auto',
+                type: 'bar'
+            }],
+            layout: {
+                title: {text: title},
+                xaxis: {title: {text: xaxisTitle || 'count of jobs'}},
+                yaxis: {
+                    title: {text: ''},
+                    automargin: true,
+                    autorange: 'reversed'
+                }
+            }
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        h1b: {
+            update_all_job_count_bars: function (table, companies, states) {
+                // the table arrives after the page, which already shows
+                // the figure embedded in the layout
+                if (!table) {
+                    return window.dash_clientside.no_update;
+                }
+                return countBarFigure(
+                    countBy(table, 'soc', {employer: companies, state: states}),
+                    'Count of All Jobs Available in Data'
+                );
+            },
+
+            update_company_count_bar: function (table, companies, jobs, states) {
+                if (!table) {
+                    return window.dash_clientside.no_update;
+                }
+                return countBarFigure(
+                    countBy(table, 'employer', {employer: companies, soc: jobs, state: states}),
+                    'Count of Jobs per Each Company'
+                );
+            },
+
+            update_job_count_bar: function (table, companies, jobs, states) {
+                if (!table) {
+                    return window.dash_clientside.no_update;
+                }
+                return countBarFigure(
+                    countBy(table, 'soc', {employer: companies, soc: jobs, state: states}),
+                    'Count of Total Jobs'
+                );
+            },
+
+            update_all_company_count_bars: function (table, ranking, jobs, states, rankBy, pageSize, page) {
+                if (!table || !pageSize) {
+                    return window.dash_clientside.no_update;
+                }
+                if (rankBy === 'median') {
+                    // wait for the server's page of this selection and year
+                    if (!ranking || ranking.version !== table.version ||
+                            JSON.stringify(ranking.key) !== JSON.stringify([jobs, states, pageSize, page])) {
+                        return window.dash_clientside.no_update;
+                    }
+                    return countBarFigure(
+                        {names: ranking.names, counts: ranking.values},
+                        'Median Pay of All Companies Available in Data', 'median annual pay'
+                    );
+                }
+                var first = (Math.max(Math.floor(page) || 1, 1) - 1) * pageSize;
+                var result = countBy(table, 'employer', {soc: jobs, state: states});
+                return countBarFigure({
+                    names: result.names.slice(first, first + pageSize),
+                    counts: result.counts.slice(first, first + pageSize)
+                }, 'All Jobs for All Companies Available in Data');
+            }
+        }
+    });
+})();
@@ -0,0 +1,360 @@
+"""
+Local columnar store for the cleaned H1B dataset.
+
+Every column is saved as its own .npy file so it can be loaded (or memory
+mapped) without parsing, and string columns are dictionary-encoded as integer
+codes plus a json vocabulary. Stores are written by appending chunks, so
+building one never needs the whole dataset in memory.
+
+A manifest.json next to the columns records the checksum and row count of
+every raw csv the store was built from, in the order their rows were
+written. A store only needs rebuilding when those files change, and when
+files are added (a new quarter of disclosures) or replaced, plan_append
+works out which files' rows can be kept: StoreWriter.carry_over copies them
+over as they are and only the new or changed files go through the pipeline.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# bump when the on-disk layout changes so old stores are rebuilt
+FORMAT_VERSION = 2
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_checksum(path, block_size=1 << 20):
+    """sha256 of a file, read in blocks so large csv files are not held in memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_fingerprint(path, checksum=True):
+    """size, modification time and (optionally) checksum of a raw source file"""
+    stat = os.stat(path)
+    fingerprint = {
+        'path': os.path.basename(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+    if checksum:
+        fingerprint['sha256'] = file_checksum(path)
+    return fingerprint
+
+
+def read_manifest(store_dir):
+    """return the manifest of a store, or None if the store does not exist"""
+    try:
+        with open(os.path.join(store_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def source_paths(sources):
+    """a single source path, or a list of them, as a list"""
+    return [sources] if isinstance(sources, str) else list(sources)
+
+
+def source_names(sources):
+    """dict of file name to path for sources, which manifests know by file name
+
+    Raises ValueError for two sources with the same file name (2019/h1b.csv
+    and 2020/h1b.csv), which a manifest couldn't tell apart.
+    """
+    paths = {}
+    for path in source_paths(sources):
+        name = os.path.basename(path)
+        if name in paths:
+            raise ValueError(
+                "%s and %s have the same file name - rename one, the store records "
+                "its sources by file name" % (paths[name], path)
+            )
+        paths[name] = path
+    return paths
+
+
+def is_unchanged(fingerprint, path):
+    """check whether the file at path is the one fingerprint was taken of
+
+    The size and mtime are compared first so an unchanged file is never
+    hashed; the checksum is only computed when those differ (e.g. after a
+    fresh checkout touched the file).
+    """
+    if fingerprint['path'] != os.path.basename(path):
+        return False
+    current = source_fingerprint(path, checksum=False)
+    if current['size'] != fingerprint['size']:
+        return False
+    if current['mtime_ns'] == fingerprint['mtime_ns']:
+        return True
+    return file_checksum(path) == fingerprint['sha256']
+
+
+def plan_append(store_dir, sources, metadata=None):
+    """which of a store's source files can be kept and which need to be read
+
+    Returns (keep, read, dropped): the manifest entries of the files still
+    among sources and unchanged, the paths of the other sources, new or
+    changed, and the names of the files whose rows would be left out because
+    they changed or are no longer among sources. Returns None when there is
+    no store to append to, or it was built with a different format or
+    metadata. Raises ValueError for sources with the same file name.
+    """
+    manifest = read_manifest(store_dir)
+    if manifest is None or manifest.get('format_version') != FORMAT_VERSION:
+        return None
+    for key, value in (metadata or {}).items():
+        if manifest.get(key) != value:
+            return None
+
+    paths = source_names(sources)
+    keep = [
+        fingerprint for fingerprint in manifest['sources']
+        if fingerprint['path'] in paths and is_unchanged(fingerprint, paths[fingerprint['path']])
+    ]
+    kept = {fingerprint['path'] for fingerprint in keep}
+    read = [path for name, path in paths.items() if name not in kept]
+    dropped = [
+        fingerprint['path'] for fingerprint in manifest['sources'] if fingerprint['path'] not in kept
+    ]
+    return keep, read, dropped
+
+
+def is_fresh(store_dir, sources, metadata=None):
+    """check whether the store was built from the current version of every source
+
+    Any metadata given must also match what the store was built with.
+    """
+    plan = plan_append(store_dir, sources, metadata=metadata)
+    return plan is not None and not plan[1] and not plan[2]
+
+
+def dataset_version(source_sha256s, options=None):
+    """short identifier for a built dataset, used to key caches
+
+    source_sha256s are the checksums of the source files, in the order their
+    rows were written, and options any build settings that change the
+    contents of the store.
+    """
+    key = '%s:%s:%s' % (
+        FORMAT_VERSION, ','.join(source_sha256s), json.dumps(options or {}, sort_keys=True),
+    )
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+@contextmanager
+def build_lock(store_dir):
+    """exclusive lock so concurrently booting workers don't build the store twice"""
+    os.makedirs(os.path.dirname(os.path.abspath(store_dir)), exist_ok=True)
+    with open(store_dir + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class _ColumnWriter:
+    """appends one column to a raw temporary file, chunk by chunk
+
+    Numeric columns keep the dtype of their first chunk. Anything else is
+    dictionary-encoded against a vocabulary that grows as new values are
+    seen, so codes stay stable across chunks and only the distinct values
+    are ever held in memory.
+    """
+
+    def __init__(self, directory, name, kind, dtype, vocab=None):
+        self.directory = directory
+        self.name = name
+        self.rows = 0
+        self.kind = kind
+        self.dtype = np.dtype(dtype)
+        self.vocab = vocab
+        self.raw_path = os.path.join(directory, name + '.raw')
+        self.raw = open(self.raw_path, 'wb')
+
+    @classmethod
+    def for_series(cls, directory, name, series):
+        """a writer for a new column, of the kind series needs"""
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            return cls(directory, name, 'numeric', series.dtype)
+        return cls(directory, name, 'category', np.int32, vocab={})
+
+    @classmethod
+    def carrying_over(cls, directory, name, store_dir, info):
+        """a writer continuing a column of the store at store_dir
+
+        The vocabulary is kept as it was, so copied codes stay valid and new
+        values are added after the existing ones.
+        """
+        if info['kind'] == 'numeric':
+            return cls(directory, name, 'numeric', info['dtype'])
+        vocab = {value: code for code, value in enumerate(read_vocab(store_dir, name))}
+        return cls(directory, name, 'category', info['dtype'], vocab=vocab)
+
+    def copy_rows(self, values, start, stop, block_rows=1 << 20):
+        """append values[start:stop] as they are, a block at a time"""
+        for first in range(start, stop, block_rows):
+            block = values[first:min(first + block_rows, stop)]
+            self.raw.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+            self.rows += len(block)
+
+    def append(self, series):
+        if self.kind == 'numeric':
+            values = series.to_numpy().astype(self.dtype, copy=False)
+        else:
+            codes, uniques = pd.factorize(series)
+            vocab = self.vocab
+            global_codes = np.array(
+                [vocab.setdefault(str(u), len(vocab)) for u in uniques] + [-1],
+                dtype=self.dtype,
+            )
+            # missing values are -1 in codes, which picks the trailing -1
+            values = global_codes[codes]
+        self.raw.write(np.ascontiguousarray(values).tobytes())
+        self.rows += len(values)
+
+    def close(self):
+        """turn the raw file into a .npy file and write the vocabulary"""
+        self.raw.close()
+        npy_path = os.path.join(self.directory, self.name + '.npy')
+        with open(npy_path, 'wb') as out, open(self.raw_path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(self.dtype),
+                'fortran_order': False,
+                'shape': (self.rows,),
+            })
+            shutil.copyfileobj(raw, out, 1 << 20)
+        os.remove(self.raw_path)
+
+        if self.kind == 'numeric':
+            return {'kind': 'numeric', 'dtype': str(self.dtype)}
+        with open(os.path.join(self.directory, self.name + '.vocab.json'), 'w') as f:
+            json.dump(list(self.vocab), f)
+        return {'kind': 'category', 'dtype': str(self.dtype), 'size': len(self.vocab)}
+
+
+class StoreWriter:
+    """streams cleaned chunks into a new store
+
+    Columns are written to a temporary sibling directory which is swapped in
+    by close(), so readers never see a half written store. Memory use is
+    bounded by the chunk size plus the distinct values of the encoded
+    columns. The rows appended since the last end_source() call are recorded
+    in the manifest as coming from that source file.
+    """
+
+    def __init__(self, store_dir, metadata=None):
+        self.store_dir = store_dir
+        self.metadata = metadata or {}
+        self.rows = 0
+        self.columns = None
+        self.sources = []
+        self._source_start = 0
+
+        self.tmp_dir = '%s.tmp-%d' % (store_dir, os.getpid())
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+
+    def carry_over(self, keep):
+        """copy the rows of the source files keep from the current store
+
+        keep are entries of the current manifest's sources, as returned by
+        plan_append. Must be called before anything is appended.
+        """
+        manifest = read_manifest(self.store_dir)
+        self.columns = [
+            _ColumnWriter.carrying_over(self.tmp_dir, name, self.store_dir, info)
+            for name, info in manifest['columns'].items()
+        ]
+        starts = {}
+        start = 0
+        for fingerprint in manifest['sources']:
+            starts[fingerprint['path']] = start
+            start += fingerprint['rows']
+
+        for column in self.columns:
+            values = read_column(self.store_dir, column.name)
+            for fingerprint in keep:
+                first = starts[fingerprint['path']]
+                column.copy_rows(values, first, first + fingerprint['rows'])
+        for fingerprint in keep:
+            self.rows += fingerprint['rows']
+            self.sources.append(fingerprint)
+        self._source_start = self.rows
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = [
+                _ColumnWriter.for_series(self.tmp_dir, name, df[name]) for name in df.columns
+            ]
+        for column in self.columns:
+            column.append(df[column.name])
+        self.rows += len(df)
+
+    def end_source(self, source_path):
+        """record the rows appended since the last source as coming from source_path"""
+        fingerprint = source_fingerprint(source_path)
+        fingerprint['rows'] = self.rows - self._source_start
+        self.sources.append(fingerprint)
+        self._source_start = self.rows
+
+    def close(self, finalize=None):
+        """finish every column, write the manifest and swap the store in
+
+        finalize, if given, is called with the temporary directory once the
+        columns are complete, so derived files can be added before readers
+        can see the store.
+        """
+        columns = {column.name: column.close() for column in self.columns or []}
+        if finalize is not None:
+            finalize(self.tmp_dir)
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'dataset_version': dataset_version(
+                [source['sha256'] for source in self.sources], self.metadata,
+            ),
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'rows': self.rows,
+            'sources': self.sources,
+            'columns': columns,
+        }
+        manifest.update(self.metadata)
+        with open(os.path.join(self.tmp_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        old_dir = '%s.old-%d' % (self.store_dir, os.getpid())
+        if os.path.exists(self.store_dir):
+            os.rename(self.store_dir, old_dir)
+        os.rename(self.tmp_dir, self.store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return manifest
+
+    def abort(self):
+        """throw away a partially written store"""
+        for column in self.columns or []:
+            column.raw.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def read_column(store_dir, name, mmap_mode='r'):
+    """load the raw array for one column (codes for categorical columns)"""
+    return np.load(os.path.join(store_dir, name + '.npy'), mmap_mode=mmap_mode)
+
+
+def read_vocab(store_dir, name):
+    """load the vocabulary of a dictionary-encoded column"""
+    with open(os.path.join(store_dir, name + '.vocab.json')) as f:
+        return json.load(f)
+
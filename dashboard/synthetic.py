@@ -0,0 +1,191 @@
+"""
+Synthetic H1B disclosure data for running the dashboard and its benchmarks
+offline.
+
+The generated csv has the columns of the real disclosure file that the
+pipeline reads, with similar skew: employers follow a Zipf distribution
+(a few employers file most petitions), most rows fall in the Computer and
+Mathematical SOC major group, states are weighted roughly like the real
+data, and pay is given in a mix of units, formats and a few outliers that
+the pipeline has to clean up.
+"""
+import numpy as np
+import pandas as pd
+
+# the largest real employers, so the dashboard's default selection exists
+REAL_EMPLOYERS = [
+    'COGNIZANT TECHNOLOGY SOLUTIONS US CORP',
+    'GOOGLE LLC',
+    'INFOSYS LIMITED',
+    'TATA CONSULTANCY SERVICES LIMITED',
+    'AMAZON.COM SERVICES, INC.',
+    'MICROSOFT CORPORATION',
+    'DELOITTE CONSULTING LLP',
+    'ACCENTURE LLP',
+    'WIPRO LIMITED',
+    'FACEBOOK, INC.',
+    'CAPGEMINI AMERICA INC',
+    'APPLE INC.',
+    'INTEL CORPORATION',
+    'ERNST & YOUNG U.S. LLP',
+    'HCL AMERICA, INC.',
+    'IBM CORPORATION',
+    'TECH MAHINDRA (AMERICAS),INC.',
+    'AMAZON WEB SERVICES, INC.',
+    'LARSEN & TOUBRO INFOTECH LIMITED',
+    'CISCO SYSTEMS, INC.',
+]
+
+# words synthetic employer names are made from
+NAME_WORDS = [
+    'ADVANCED', 'ALPHA', 'APEX', 'BLUE', 'BRIGHT', 'CLOUD', 'CORE', 'DATA',
+    'DIGITAL', 'DYNAMIC', 'GLOBAL', 'INFO', 'INTEGRATED', 'LOGIC', 'MATRIX',
+    'NET', 'NEXT', 'NOVA', 'PRIME', 'QUANTUM', 'SMART', 'SOFT', 'SUMMIT',
+    'SYNERGY', 'TECH', 'UNITED', 'VECTOR', 'VISION',
+]
+NAME_KINDS = [
+    'SYSTEMS', 'SOLUTIONS', 'TECHNOLOGIES', 'CONSULTING', 'SOFTWARE',
+    'SERVICES', 'LABS', 'GROUP', 'ANALYTICS', 'NETWORKS',
+]
+NAME_SUFFIXES = ['INC', 'INC.', ', INC.', 'LLC', 'CORPORATION', 'CORP', 'LLP', 'LIMITED', '']
+
+# (SOC_CODE, SOC_NAME, share of rows, median annual pay)
+SOC_CODES = [
+    ('15-1132', 'SOFTWARE DEVELOPERS, APPLICATIONS', 0.30, 112000),
+    ('15-1121', 'COMPUTER SYSTEMS ANALYSTS', 0.10, 88000),
+    ('15-1199', 'COMPUTER OCCUPATIONS, ALL OTHER', 0.08, 95000),
+    ('15-1133', 'SOFTWARE DEVELOPERS, SYSTEMS SOFTWARE', 0.06, 118000),
+    ('15-1131', 'COMPUTER PROGRAMMERS', 0.04, 82000),
+    ('15-1141', 'DATABASE ADMINISTRATORS', 0.02, 96000),
+    ('15-2041', 'STATISTICIANS', 0.02, 105000),
+    ('15-1142', 'NETWORK AND COMPUTER SYSTEMS ADMINISTRATORS', 0.015, 90000),
+    ('15-1111', 'COMPUTER AND INFORMATION RESEARCH SCIENTISTS', 0.01, 135000),
+    ('15-1143', 'COMPUTER NETWORK ARCHITECTS', 0.01, 120000),
+    ('15-1134', 'WEB DEVELOPERS', 0.01, 80000),
+    ('15-1122', 'INFORMATION SECURITY ANALYSTS', 0.008, 102000),
+    ('15-1151', 'COMPUTER USER SUPPORT SPECIALISTS', 0.005, 60000),
+    ('15-2031', 'OPERATIONS RESEARCH ANALYSTS', 0.005, 92000),
+    ('15-2011', 'ACTUARIES', 0.002, 115000),
+    ('17-2072', 'ELECTRONICS ENGINEERS, EXCEPT COMPUTER', 0.03, 110000),
+    ('17-2141', 'MECHANICAL ENGINEERS', 0.02, 90000),
+    ('17-2071', 'ELECTRICAL ENGINEERS', 0.02, 100000),
+    ('13-2011', 'ACCOUNTANTS AND AUDITORS', 0.03, 70000),
+    ('13-1111', 'MANAGEMENT ANALYSTS', 0.04, 95000),
+    ('13-1161', 'MARKET RESEARCH ANALYSTS AND MARKETING SPECIALISTS', 0.03, 65000),
+    ('11-3021', 'COMPUTER AND INFORMATION SYSTEMS MANAGERS', 0.03, 150000),
+    ('11-2021', 'MARKETING MANAGERS', 0.01, 130000),
+    ('29-1141', 'REGISTERED NURSES', 0.01, 70000),
+    ('29-1069', 'PHYSICIANS AND SURGEONS, ALL OTHER', 0.01, 220000),
+    ('25-1071', 'HEALTH SPECIALTIES TEACHERS, POSTSECONDARY', 0.01, 85000),
+    ('19-1042', 'MEDICAL SCIENTISTS, EXCEPT EPIDEMIOLOGISTS', 0.01, 75000),
+]
+
+# worksite states with their rough share of petitions; the rest of the
+# states and territories split what is left
+STATE_SHARES = {
+    'CA': 0.24, 'TX': 0.09, 'NY': 0.08, 'NJ': 0.07, 'WA': 0.06, 'IL': 0.05,
+    'MA': 0.04, 'PA': 0.03, 'GA': 0.03, 'NC': 0.025, 'FL': 0.025, 'VA': 0.02,
+    'MI': 0.02, 'OH': 0.02, 'MN': 0.015,
+}
+OTHER_STATES = [
+    'AL', 'AK', 'AZ', 'AR', 'CO', 'CT', 'DE', 'DC', 'HI', 'ID', 'IN', 'IA',
+    'KS', 'KY', 'LA', 'ME', 'MD', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NM',
+    'ND', 'OK', 'OR', 'RI', 'SC', 'SD', 'TN', 'UT', 'VT', 'WV', 'WI', 'WY',
+    'PR', 'GU', 'VI',
+]
+
+# (WAGE_UNIT_OF_PAY, share of rows, periods per year)
+WAGE_UNITS = [
+    ('Year', 0.90, 1),
+    ('Hour', 0.08, 2080),
+    ('Month', 0.01, 12),
+    ('Week', 0.005, 52),
+    ('Bi-Weekly', 0.005, 26),
+]
+
+# share of rows with pay far above the outlier cutoff, and with no state
+OUTLIER_SHARE = 0.001
+MISSING_STATE_SHARE = 0.001
+
+
+def employer_names(count, rng):
+    """REAL_EMPLOYERS followed by distinct synthetic names"""
+    names = list(REAL_EMPLOYERS[:count])
+    words = rng.choice(NAME_WORDS, size=(count, 2))
+    kinds = rng.choice(NAME_KINDS, size=count)
+    suffixes = rng.choice(NAME_SUFFIXES, size=count)
+    for i in range(len(names), count):
+        names.append(' '.join(filter(None, [words[i, 0], words[i, 1], kinds[i], str(i), suffixes[i]])))
+    return names
+
+
+def zipf_weights(count, exponent=1.1):
+    """probability of each rank under a Zipf distribution"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def state_weights():
+    """every state with its share of rows"""
+    remaining = (1 - sum(STATE_SHARES.values())) / len(OTHER_STATES)
+    states = list(STATE_SHARES) + OTHER_STATES
+    weights = np.array(list(STATE_SHARES.values()) + [remaining] * len(OTHER_STATES))
+    return states, weights / weights.sum()
+
+
+def generate_frame(rows, rng, employers, employer_weights, start=0):
+    """one chunk of synthetic disclosure rows, numbered from start"""
+    soc_weights = np.array([share for _, _, share, _ in SOC_CODES])
+    soc = rng.choice(len(SOC_CODES), size=rows, p=soc_weights / soc_weights.sum())
+    states, weights = state_weights()
+    unit_weights = np.array([share for _, share, _ in WAGE_UNITS])
+    unit = rng.choice(len(WAGE_UNITS), size=rows, p=unit_weights / unit_weights.sum())
+
+    medians = np.array([median for _, _, _, median in SOC_CODES], dtype=np.float64)
+    annual = rng.lognormal(np.log(medians[soc]), 0.25)
+    annual[rng.random(rows) < OUTLIER_SHARE] *= 20
+    periods = np.array([per_year for _, _, per_year in WAGE_UNITS], dtype=np.float64)
+    pay = np.round(annual / periods[unit], 2)
+
+    # the raw file mixes "1,234.50", "$1,234.50" and "1234.5"
+    pay_text = pd.Series(pay).map('{:,.2f}'.format)
+    style = rng.integers(0, 3, size=rows)
+    pay_text[style == 1] = '$' + pay_text[style == 1]
+    pay_text[style == 2] = pd.Series(pay[style == 2]).astype(str).values
+
+    worksite = np.array(states, dtype=object)[rng.choice(len(states), size=rows, p=weights)]
+    worksite[rng.random(rows) < MISSING_STATE_SHARE] = None
+
+    soc_codes = np.array([code for code, _, _, _ in SOC_CODES], dtype=object)
+    soc_names = np.array([name for _, name, _, _ in SOC_CODES], dtype=object)
+    return pd.DataFrame({
+        'CASE_NUMBER': ['I-200-%08d' % i for i in range(start, start + rows)],
+        'CASE_STATUS': 'CERTIFIED',
+        'EMPLOYER_NAME': np.array(employers, dtype=object)[
+            rng.choice(len(employers), size=rows, p=employer_weights)
+        ],
+        'SOC_CODE': soc_codes[soc],
+        'SOC_NAME': soc_names[soc],
+        'JOB_TITLE': soc_names[soc],
+        'WAGE_RATE_OF_PAY_FROM': pay_text.values,
+        'WAGE_UNIT_OF_PAY': np.array([name for name, _, _ in WAGE_UNITS], dtype=object)[unit],
+        'WORKSITE_STATE': worksite,
+    })
+
+
+def generate_csv(path, rows, seed=0, employers=None, chunksize=1000000):
+    """write rows of synthetic disclosure data to path, chunk by chunk
+
+    The number of distinct employers defaults to one per 50 rows, which is
+    about the ratio in the real data.
+    """
+    rng = np.random.default_rng(seed)
+    names = employer_names(employers or max(len(REAL_EMPLOYERS), rows // 50), rng)
+    weights = zipf_weights(len(names))
+
+    written = 0
+    while written < rows:
+        chunk = generate_frame(min(chunksize, rows - written), rng, names, weights, start=written)
+        chunk.to_csv(path, mode='w' if not written else 'a', header=not written, index=False)
+        written += len(chunk)
+    return path
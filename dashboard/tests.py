@@ -1,3 +1,1368 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import dash_core_components as dcc
+import dash_html_components as html
+import numpy as np
+import pandas as pd
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponse, HttpResponseNotFound, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django_plotly_dash import DjangoDash
+from plotly.utils import PlotlyJSONEncoder
+
+from dashboard import (
+    api, canonical, export, figures, metrics, partitions, pipeline, store, synthetic, warmup,
+)
+from dashboard.cache import LRUCache
+from dashboard.concurrency import CallbackLimitMiddleware, ThreadedStreamingHandler
+from dashboard.dataset import (
+    EMPLOYER, SALARY_BIN_EDGES, SOC, STATE, H1BDataset, group_percentiles,
+)
+from dashboard.http_cache import cache_per_version
+from dashboard.materialized import Materialized
+from dashboard.search import SearchIndex
+
+
+class TempDirTestCase(SimpleTestCase):
+    """a scratch directory for each test, removed afterwards"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='h1b-test-')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+
+    def path(self, *names):
+        return os.path.join(self.tmp_dir, *names)
+
+    def write_file(self, name, text='raw disclosure data\n'):
+        """a stand-in source file, for the fingerprints in the manifest"""
+        path = self.path(name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def write_store(self, store_dir, sources, metadata=None):
+        """write a store from (source path, list of frames) pairs, in order"""
+        writer = store.StoreWriter(store_dir, metadata=metadata)
+        for source, frames in sources:
+            for frame in frames:
+                writer.append(frame)
+            writer.end_source(source)
+        return writer.close()
+
+
+def random_frame(rows, seed=0):
+    """cleaned rows with skewed employers, a few missing states and some rows
+    outside SOC major group 15"""
+    rng = np.random.default_rng(seed)
+    employers = np.array(['EMPLOYER %d' % i for i in range(40)], dtype=object)
+    jobs = np.array(['SOFTWARE DEVELOPERS', 'SYSTEMS ANALYSTS', 'STATISTICIANS', 'ACTUARIES'], dtype=object)
+    states = np.array(['CA', 'WA', 'NY', 'TX', 'NJ', None], dtype=object)
+    return pd.DataFrame({
+        EMPLOYER: employers[np.minimum(rng.zipf(1.5, rows), len(employers)) - 1],
+        SOC: jobs[rng.choice(len(jobs), rows, p=[0.5, 0.3, 0.15, 0.05])],
+        STATE: states[rng.choice(len(states), rows, p=[0.4, 0.2, 0.2, 0.1, 0.08, 0.02])],
+        'annual_pay': np.round(rng.lognormal(np.log(100000), 0.3, rows), 2),
+        'soc_major_group': np.where(rng.random(rows) < 0.9, '15', '17'),
+    })
+
+
+def decoded(store_dir, name):
+    """values of a dictionary-encoded column, None for missing values"""
+    vocab = store.read_vocab(store_dir, name)
+    return [vocab[code] if code >= 0 else None for code in store.read_column(store_dir, name)]
+
+
+class StoreTests(TempDirTestCase):
+
+    def test_round_trip(self):
+        store_dir = self.path('store')
+        source = self.write_file('h1b.csv')
+        manifest = self.write_store(store_dir, [(source, [
+            pd.DataFrame({'EMPLOYER_NAME': ['GOOGLE', 'MICROSOFT', None], 'annual_pay': [1.5, 2.0, 3.0]}),
+            pd.DataFrame({'EMPLOYER_NAME': ['MICROSOFT', 'APPLE'], 'annual_pay': [4.0, 5.0]}),
+        ])])
+
+        # codes stay stable across chunks, and new values are added at the end
+        self.assertEqual(store.read_vocab(store_dir, 'EMPLOYER_NAME'), ['GOOGLE', 'MICROSOFT', 'APPLE'])
+        self.assertEqual(
+            decoded(store_dir, 'EMPLOYER_NAME'), ['GOOGLE', 'MICROSOFT', None, 'MICROSOFT', 'APPLE'],
+        )
+        np.testing.assert_array_equal(
+            store.read_column(store_dir, 'annual_pay'), [1.5, 2.0, 3.0, 4.0, 5.0],
+        )
+
+        self.assertEqual(store.read_manifest(store_dir), manifest)
+        self.assertEqual(manifest['rows'], 5)
+        self.assertEqual(manifest['format_version'], store.FORMAT_VERSION)
+        self.assertEqual([(s['path'], s['rows']) for s in manifest['sources']], [('h1b.csv', 5)])
+        self.assertEqual(manifest['sources'][0]['sha256'], store.file_checksum(source))
+        self.assertEqual(manifest['columns']['EMPLOYER_NAME']['kind'], 'category')
+        self.assertEqual(manifest['columns']['annual_pay']['kind'], 'numeric')
+
+    def test_rebuild_replaces_store(self):
+        store_dir = self.path('store')
+        source = self.write_file('h1b.csv')
+        self.write_store(store_dir, [(source, [pd.DataFrame({'annual_pay': [1.0, 2.0]})])])
+        self.write_store(store_dir, [(source, [pd.DataFrame({'annual_pay': [3.0]})])])
+        np.testing.assert_array_equal(store.read_column(store_dir, 'annual_pay'), [3.0])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['h1b.csv', 'store'])
+
+    def test_abort_keeps_previous_store(self):
+        store_dir = self.path('store')
+        source = self.write_file('h1b.csv')
+        self.write_store(store_dir, [(source, [pd.DataFrame({'annual_pay': [1.0]})])])
+        writer = store.StoreWriter(store_dir)
+        writer.append(pd.DataFrame({'annual_pay': [2.0]}))
+        writer.abort()
+        np.testing.assert_array_equal(store.read_column(store_dir, 'annual_pay'), [1.0])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['h1b.csv', 'store'])
+
+    def test_missing_store(self):
+        self.assertIsNone(store.read_manifest(self.path('nothing')))
+        self.assertFalse(store.is_fresh(self.path('nothing'), [self.write_file('h1b.csv')]))
+
+    def test_fresh_until_a_source_changes(self):
+        store_dir = self.path('store')
+        source = self.write_file('h1b.csv')
+        self.write_store(store_dir, [(source, [pd.DataFrame({'annual_pay': [1.0]})])], {'soc': ['15']})
+        self.assertTrue(store.is_fresh(store_dir, source, metadata={'soc': ['15']}))
+        self.assertFalse(store.is_fresh(store_dir, source, metadata={'soc': ['17']}))
+
+        # a touched but identical file is still fresh, an edited one isn't
+        os.utime(source, ns=(0, 0))
+        self.assertTrue(store.is_fresh(store_dir, source))
+        self.write_file('h1b.csv', 'other disclosure data\n')
+        self.assertFalse(store.is_fresh(store_dir, source))
+
+    def test_plan_append(self):
+        store_dir = self.path('store')
+        first, second = self.write_file('fy2019a.csv'), self.write_file('fy2019b.csv', 'more data\n')
+        frame = pd.DataFrame({'annual_pay': [1.0]})
+        self.write_store(store_dir, [(first, [frame]), (second, [frame])], {'soc': ['15']})
+        self.assertIsNone(store.plan_append(self.path('nothing'), [first]))
+        self.assertIsNone(store.plan_append(store_dir, [first], metadata={'soc': ['17']}))
+
+        added = self.write_file('fy2019c.csv', 'new data\n')
+        self.write_file('fy2019b.csv', 'corrected data\n')
+        keep, read, dropped = store.plan_append(store_dir, [first, second, added], {'soc': ['15']})
+        self.assertEqual([source['path'] for source in keep], ['fy2019a.csv'])
+        self.assertEqual(read, [second, added])
+        self.assertEqual(dropped, ['fy2019b.csv'])
+
+        # files left out of the sources are dropped too
+        keep, read, dropped = store.plan_append(store_dir, [added])
+        self.assertEqual((keep, read, dropped), ([], [added], ['fy2019a.csv', 'fy2019b.csv']))
+
+    def test_sources_with_the_same_file_name(self):
+        store_dir = self.path('store')
+        for year in ('2019', '2020'):
+            os.makedirs(self.path(year))
+        first, second = self.write_file('2019/h1b.csv'), self.write_file('2020/h1b.csv', 'more data\n')
+        self.write_store(store_dir, [(first, [pd.DataFrame({'annual_pay': [1.0]})])])
+        # the second file would otherwise replace the first and the store look fresh
+        for check in (store.plan_append, store.is_fresh):
+            with self.assertRaisesRegex(ValueError, 'same file name'):
+                check(store_dir, [first, second])
+        with self.assertRaisesRegex(ValueError, 'same file name'):
+            pipeline.build_store([first, second], self.path('other'))
+        self.assertFalse(os.path.exists(self.path('other')))
+
+    def test_dataset_version(self):
+        self.assertEqual(store.dataset_version(['a', 'b']), store.dataset_version(['a', 'b']))
+        self.assertNotEqual(store.dataset_version(['a', 'b']), store.dataset_version(['b', 'a']))
+        self.assertNotEqual(
+            store.dataset_version(['a'], {'soc': ['15']}), store.dataset_version(['a'], {'soc': ['17']}),
+        )
+
+
+class DatasetTestCase(TempDirTestCase):
+    """an H1BDataset loaded from a store of random rows, with the rows it holds as a frame"""
+
+    rows = 3000
+
+    def setUp(self):
+        super().setUp()
+        frame = random_frame(self.rows)
+        self.write_store(self.path('store'), [(self.write_file('h1b.csv'), [frame])])
+        self.data = H1BDataset.from_store(self.path('store'))
+        self.frame = frame[frame['soc_major_group'] == '15'].reset_index(drop=True)
+
+    def matching(self, companies=None, jobs=None, states=None):
+        """boolean mask of the frame's rows in a selection, with pandas"""
+        keep = np.ones(len(self.frame), dtype=bool)
+        for dim, values in ((EMPLOYER, companies), (SOC, jobs), (STATE, states)):
+            if values is not None:
+                keep &= self.frame[dim].isin(values).to_numpy()
+        return keep
+
+    def selections(self, count=50, seed=1):
+        """random selections, including unfiltered, empty and unknown values"""
+        rng = np.random.default_rng(seed)
+        values = {
+            dim: sorted(self.frame[dim].dropna().unique()) + ['NOT IN THE DATA']
+            for dim in (EMPLOYER, SOC, STATE)
+        }
+        yield None, None, None
+        yield [], None, None
+        for _ in range(count):
+            selection = []
+            for dim in (EMPLOYER, SOC, STATE):
+                if rng.random() < 0.3:
+                    selection.append(None)
+                else:
+                    size = rng.integers(1, 5)
+                    selection.append(list(rng.choice(values[dim], size=size, replace=False)))
+            yield tuple(selection)
+
+
+class SelectTests(DatasetTestCase):
+
+    def test_rows_of_the_wanted_soc_groups(self):
+        self.assertEqual(len(self.data), len(self.frame))
+        np.testing.assert_allclose(self.data.annual_pay, self.frame['annual_pay'])
+
+    def test_select_matches_pandas(self):
+        for selection in self.selections():
+            rows = self.data.select(*selection)
+            np.testing.assert_array_equal(
+                rows, np.flatnonzero(self.matching(*selection)), err_msg=repr(selection),
+            )
+
+    def test_selection_is_cached_read_only(self):
+        rows = self.data.select(['EMPLOYER 0', 'EMPLOYER 1'], None, ['CA'])
+        self.assertIs(self.data.select(['EMPLOYER 1', 'EMPLOYER 0'], None, ['CA']), rows)
+        self.assertFalse(rows.flags.writeable)
+
+
+class IndexTests(DatasetTestCase):
+
+    def test_postings_match_a_scan(self):
+        for dim in (EMPLOYER, SOC, STATE):
+            for values in (['NOT IN THE DATA'], [], self.data.vocab[dim][:1], self.data.vocab[dim][1:4]):
+                expected = np.flatnonzero(self.frame[dim].isin(values).to_numpy())
+                np.testing.assert_array_equal(self.data.postings(dim, values), expected)
+                self.assertEqual(self.data.posting_size(dim, values), len(expected))
+
+    def test_missing_values_have_their_own_postings(self):
+        order, offsets = self.data.index[STATE]
+        missing = len(self.data.vocab[STATE])
+        np.testing.assert_array_equal(
+            np.sort(order[offsets[missing]:offsets[missing + 1]]),
+            np.flatnonzero(self.frame[STATE].isna().to_numpy()),
+        )
+
+
+class CountCubeTests(DatasetTestCase):
+
+    def test_count_by_matches_pandas(self):
+        for selection in self.selections():
+            keep = self.matching(*selection)
+            for dim in (EMPLOYER, SOC, STATE):
+                names, counts = self.data.count_by(dim, *selection)
+                expected = self.frame.loc[keep, dim].value_counts()
+                self.assertEqual(dict(zip(names, counts.tolist())), expected.to_dict(), repr(selection))
+                self.assertTrue(np.all(np.diff(counts) <= 0))
+
+    def test_cube_holds_every_row(self):
+        cube = self.data.cube
+        self.assertEqual(cube.counts.sum(), len(self.frame))
+        # cells are sorted by employer, and each employer's cells are in its offsets
+        self.assertTrue(np.all(np.diff(cube.employer) >= 0))
+        np.testing.assert_array_equal(
+            np.diff(cube.employer_offsets), np.bincount(cube.employer, minlength=cube.sizes[0]),
+        )
+
+
+class PercentileTests(DatasetTestCase):
+
+    def test_group_percentiles_match_numpy(self):
+        rng = np.random.default_rng(2)
+        groups = rng.integers(0, 6, size=500)
+        values = rng.normal(100, 30, size=500)
+        percentiles = [0, 10, 25, 50, 75, 90, 100]
+        # group 6 is empty
+        table = group_percentiles(groups, values, percentiles, 7)
+        for group in range(6):
+            np.testing.assert_allclose(table[group], np.percentile(values[groups == group], percentiles))
+        self.assertTrue(np.isnan(table[6]).all())
+
+    def test_single_value_and_no_values(self):
+        one = group_percentiles(np.array([0]), np.array([5.0]), [25, 75], 1)
+        np.testing.assert_array_equal(one, [[5, 5]])
+        none = group_percentiles(np.array([], dtype=np.int64), np.array([]), [50], 2)
+        self.assertTrue(np.isnan(none).all())
+
+    def test_employer_percentiles_match_pandas(self):
+        companies = ['EMPLOYER 0', 'EMPLOYER 3', 'EMPLOYER 39', 'NOT IN THE DATA']
+        selections = [(None, None), (['SOFTWARE DEVELOPERS'], ['CA', 'WA']), (['ACTUARIES'], ['NJ'])]
+        for jobs, states in selections:
+            rows = self.data.select(companies, jobs, states)
+            result = self.data.employer_percentiles(rows, companies, [25, 50, 90])
+            selected = self.frame[self.matching(companies, jobs, states)]
+            for company in companies:
+                pay = selected.loc[selected[EMPLOYER] == company, 'annual_pay']
+                if len(pay):
+                    np.testing.assert_allclose(result[company], np.percentile(pay, [25, 50, 90]))
+                else:
+                    self.assertTrue(np.isnan(result[company]).all())
+
+
+class HistogramTests(DatasetTestCase):
+
+    def test_salary_histograms_match_numpy(self):
+        companies = ['EMPLOYER 0', 'EMPLOYER 1', 'EMPLOYER 20', 'NOT IN THE DATA']
+        for selection in self.selections(count=20):
+            jobs, states = selection[1:]
+            histograms = self.data.salary_histograms(companies, jobs, states)
+            selected = self.frame[self.matching(companies, jobs, states)]
+            for company in companies:
+                pay = selected.loc[selected[EMPLOYER] == company, 'annual_pay']
+                np.testing.assert_array_equal(
+                    histograms[company], np.histogram(pay, SALARY_BIN_EDGES)[0], repr(selection),
+                )
+
+
+class RankingTests(DatasetTestCase):
+
+    def test_top_by_count_matches_a_full_sort(self):
+        for selection in self.selections(count=30):
+            jobs, states = selection[1:]
+            names, counts = self.data.count_by(EMPLOYER, jobs=jobs, states=states)
+            for limit, offset in ((1, 0), (5, 0), (25, 0), (5, 3), (10, 35), (1000, 0), (0, 0)):
+                found, values, filings = self.data.top_employers(jobs, states, limit=limit, offset=offset)
+                self.assertEqual(list(found), list(names[offset:offset + limit]), repr(selection))
+                np.testing.assert_array_equal(values, counts[offset:offset + limit])
+                np.testing.assert_array_equal(filings, values)
+
+    def test_top_by_median_matches_the_grouped_median(self):
+        codes = {name: code for code, name in enumerate(self.data.vocab[EMPLOYER])}
+        for selection in self.selections(count=30):
+            jobs, states = selection[1:]
+            selected = self.frame[self.matching(None, jobs, states)].dropna(subset=[EMPLOYER])
+
+            # the median of each employer's pay histogram, interpolated within its bin
+            expected = []
+            for name, pay in selected.groupby(EMPLOYER)['annual_pay']:
+                counts = np.histogram(pay.clip(upper=SALARY_BIN_EDGES[-1] - 1), SALARY_BIN_EDGES)[0]
+                half = len(pay) / 2
+                cumulative = np.cumsum(counts)
+                median_bin = np.searchsorted(cumulative, half)
+                below = cumulative[median_bin] - counts[median_bin]
+                lower, upper = SALARY_BIN_EDGES[median_bin:median_bin + 2]
+                median = lower + (upper - lower) * (half - below) / counts[median_bin]
+                expected.append((-median, -len(pay), codes[name], name, median))
+            expected.sort()
+
+            for limit, offset in ((10, 0), (5, 4), (1000, 0)):
+                names, medians, filings = self.data.top_employers(
+                    jobs, states, limit=limit, offset=offset, by='median',
+                )
+                page = expected[offset:offset + limit]
+                self.assertEqual(list(names), [entry[3] for entry in page], repr(selection))
+                np.testing.assert_allclose(medians, [entry[4] for entry in page])
+                np.testing.assert_array_equal(filings, [-entry[1] for entry in page])
+
+    def test_unknown_ranking(self):
+        with self.assertRaises(ValueError):
+            self.data.top_employers(by='mean')
+
+
+class SearchTests(DatasetTestCase):
+
+    VALUES = [
+        'GOOGLE', 'GOOGOL LABS', 'ALPHABET', 'SOCIÉTÉ GÉNÉRALE', 'société générale americas',
+        'KÖLN SOFTWARE', 'STRASSE SYSTEMS', 'Straße Systems', 'GO', 'G', 'ERNST & YOUNG US',
+        'YOUNG & ERNST', 'AMAZON SERVICES', 'AMAZON WEB SERVICES', 'WEB SERVICES GROUP',
+    ]
+
+    def brute_force(self, values, query, limit):
+        """values matching query by scanning each one with str.find, in rank order"""
+        query = (query or '').casefold().strip()
+        keys = [value.casefold() for value in values]
+        if len(query) < 3:
+            matches = [value for value, key in zip(values, keys) if key.find(query) == 0]
+        else:
+            matches = [value for value, key in zip(values, keys) if key.find(query) >= 0]
+        return matches[:limit]
+
+    def queries(self, values, count=200, seed=2):
+        """every prefix and random substring of some values, with other cases and misses"""
+        rng = np.random.default_rng(seed)
+        yield from ('', None, '   ', 'zzz', 'q', 'é', 'ÉTÉ', 'straße', 'STRASSE', ' young ', 'o', 'go')
+        for _ in range(count):
+            value = values[rng.integers(len(values))]
+            start = rng.integers(len(value))
+            query = value[start:start + rng.integers(1, 8)]
+            yield query.lower() if rng.random() < 0.5 else query
+
+    def test_matches_a_brute_force_scan(self):
+        index = SearchIndex(self.VALUES)
+        for query in self.queries(self.VALUES):
+            for limit in (1, 3, 50):
+                expected = self.brute_force(self.VALUES, query, limit)
+                self.assertEqual(index.search(query, limit), expected, repr(query))
+
+    def test_dataset_search(self):
+        vocab = self.data.vocab[EMPLOYER]
+        for query in self.queries(vocab):
+            self.assertEqual(self.data.search(EMPLOYER, query, 10), self.brute_force(vocab, query, 10))
+        # the most frequent employers come first
+        found = self.data.search(EMPLOYER, 'employer 1', 3)
+        self.assertEqual(len(found), 3)
+        self.assertEqual(found, sorted(found, key=vocab.index))
+        self.assertEqual(self.data.search(EMPLOYER, '', 2), vocab[:2])
+
+
+class ExportTests(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def export(self, query):
+        """response of export_view for the query, serving self.data as FY2020"""
+        def get_dataset(year):
+            if year != 2020:
+                raise KeyError(year)
+            return self.data
+
+        module = mock.Mock(catalog=mock.Mock(default_year=2020), get_dataset=get_dataset)
+        with mock.patch.object(export.warmup, 'wait', return_value=module):
+            return export.export_view(self.factory.get('/export/', query))
+
+    def test_csv_chunks_match_pandas(self):
+        for selection in self.selections(count=10):
+            rows = self.data.select(*selection)
+            text = ''.join(export.csv_chunks(self.data, rows, chunk_rows=100))
+            dtypes = {EMPLOYER: str, SOC: str, STATE: str, 'annual_pay': float}
+            written = pd.read_csv(io.StringIO(text), dtype=dtypes, keep_default_na=False)
+            expected = self.frame[self.matching(*selection)]
+            self.assertEqual(list(written.columns), list(export.COLUMNS))
+            self.assertEqual(list(written[EMPLOYER]), list(expected[EMPLOYER]))
+            self.assertEqual(list(written[SOC]), list(expected[SOC]))
+            # missing states are written as empty fields
+            self.assertEqual(list(written[STATE]), list(expected[STATE].fillna('')))
+            np.testing.assert_allclose(written['annual_pay'], expected['annual_pay'], atol=0.005)
+
+    def test_selection(self):
+        request = self.factory.get('/export/', {'companies': ['EMPLOYER 0', '', 'EMPLOYER 1'], 'jobs': ''})
+        self.assertEqual(export.selection(request, EMPLOYER), ['EMPLOYER 0', 'EMPLOYER 1'])
+        self.assertEqual(export.selection(request, SOC), [])
+        self.assertIsNone(export.selection(request, STATE))
+
+    def test_export_view(self):
+        response = self.export({'states': ['CA', 'WA']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="h1b-fy2020.csv"')
+        written = pd.read_csv(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(written), self.matching(states=['CA', 'WA']).sum())
+        self.assertEqual(set(written[STATE]), {'CA', 'WA'})
+
+    def test_export_view_errors(self):
+        self.assertEqual(self.export({'format': 'xlsx'}).status_code, 400)
+        with mock.patch.object(export, 'pyarrow', None):
+            self.assertEqual(self.export({'format': 'arrow'}).status_code, 400)
+        for year in ('2019', 'next'):
+            with self.assertRaises(Http404):
+                self.export({'year': year})
+
+
+RAW_CSV = """EMPLOYER_NAME,SOC_CODE,SOC_NAME,WAGE_UNIT_OF_PAY,WAGE_RATE_OF_PAY_FROM,JOB_TITLE,WORKSITE_STATE
+Google LLC,15-1132,SOFTWARE DEVELOPERS,Year,"$120,000.00",ENGINEER,CA
+"GOOGLE, LLC",15-1132,SOFTWARE DEVELOPERS,Hour,50,ENGINEER,WA
+"Amazon.com Services, Inc.",15-1121,SYSTEMS ANALYSTS,Month,"10,000",ANALYST,
+Acme Corp,17-2141,MECHANICAL ENGINEERS,Year,90000,ENGINEER,TX
+Outlier Inc,15-1132,SOFTWARE DEVELOPERS,Year,"5,000,000",ENGINEER,CA
+"""
+
+
+class PipelineTests(TempDirTestCase):
+
+    def test_cleans_and_annualizes(self):
+        source = self.write_file('h1b.csv', RAW_CSV)
+        manifest, stats = pipeline.build_store(source, self.path('store'), soc_major_groups=['15'])
+        store_dir = self.path('store')
+
+        # names are normalized, other SOC groups and pay outliers dropped
+        self.assertEqual(decoded(store_dir, EMPLOYER), ['GOOGLE', 'GOOGLE', 'AMAZON SERVICES'])
+        self.assertEqual(decoded(store_dir, STATE), ['CA', 'WA', None])
+        self.assertEqual(decoded(store_dir, 'soc_major_group'), ['15', '15', '15'])
+        np.testing.assert_allclose(store.read_column(store_dir, 'annual_pay'), [120000, 104000, 120000])
+        self.assertEqual(set(manifest['columns']), set(pipeline.STORE_COLUMNS))
+        self.assertEqual(manifest['soc_major_groups'], ['15'])
+
+        stages = {stage.name: stage for stage in stats}
+        self.assertEqual(stages['read_csv'].rows_in, 5)
+        self.assertEqual(stages['filter_soc_groups'].rows_out, 4)
+        self.assertEqual(stages['drop_outliers'].rows_out, 3)
+        self.assertTrue(store.is_fresh(store_dir, source, pipeline.build_metadata(['15'])))
+
+    def test_chunk_size_does_not_change_the_store(self):
+        source = synthetic.generate_csv(self.path('synthetic.csv'), 3000, seed=3)
+        pipeline.build_store(source, self.path('small'), chunksize=250, soc_major_groups=['15'])
+        pipeline.build_store(source, self.path('large'), chunksize=10000, soc_major_groups=['15'])
+        for name in pipeline.STORE_COLUMNS:
+            if name == 'annual_pay':
+                np.testing.assert_array_equal(
+                    store.read_column(self.path('small'), name), store.read_column(self.path('large'), name),
+                )
+            else:
+                self.assertEqual(decoded(self.path('small'), name), decoded(self.path('large'), name))
+
+    def test_append_matches_full_rebuild(self):
+        first = synthetic.generate_csv(self.path('first.csv'), 2000, seed=4)
+        second = synthetic.generate_csv(self.path('second.csv'), 1000, seed=5)
+        full, _ = pipeline.build_store([first, second], self.path('full'), soc_major_groups=['15'])
+
+        pipeline.build_store(first, self.path('appended'), soc_major_groups=['15'])
+        metadata = pipeline.build_metadata(['15'])
+        keep, read, dropped = store.plan_append(self.path('appended'), [first, second], metadata)
+        self.assertEqual((read, dropped), ([second], []))
+        appended, stats = pipeline.build_store(
+            read, self.path('appended'), soc_major_groups=['15'], keep=keep,
+        )
+
+        self.assertEqual(stats[0].name, 'carry_over')
+        self.assertEqual(appended['dataset_version'], full['dataset_version'])
+        self.assertEqual(appended['rows'], full['rows'])
+        appended_dir, full_dir = self.path('appended'), self.path('full')
+        for name in pipeline.STORE_COLUMNS:
+            if name == 'annual_pay':
+                np.testing.assert_array_equal(
+                    store.read_column(appended_dir, name), store.read_column(full_dir, name),
+                )
+            else:
+                self.assertEqual(decoded(appended_dir, name), decoded(full_dir, name))
+
+    def test_source_with_no_rows(self):
+        source = self.write_file('h1b.csv', RAW_CSV.splitlines()[0] + '\n')
+        manifest, _ = pipeline.build_store(source, self.path('store'))
+        self.assertEqual(manifest['rows'], 0)
+        self.assertEqual(set(manifest['columns']), set(pipeline.STORE_COLUMNS))
+
+
+class CanonicalTests(TempDirTestCase):
+
+    def test_normalize(self):
+        self.assertEqual(canonical.normalize('AMAZON.COM SERVICES, INC.'), 'AMAZON SERVICES')
+        self.assertEqual(canonical.normalize('Google LLC'), 'GOOGLE')
+        self.assertEqual(canonical.normalize('The Walt Disney Company'), 'WALT DISNEY')
+        self.assertEqual(canonical.normalize('SMITH & CO'), 'SMITH')
+        self.assertEqual(canonical.normalize('Ernst & Young U.S. LLP'), 'ERNST & YOUNG US')
+        # a name that is only a suffix is kept
+        self.assertEqual(canonical.normalize('Inc'), 'INC')
+
+    def test_cluster(self):
+        names = [
+            'COGNIZANT TECHNOLOGY SOLUTIONS US', 'COGNIZANT TECHNOLOGY SOLUTION US',
+            'AMAZON SERVICES', 'AMAZONSERVICES', 'AMAZONCOM SERVICES',
+            'SYSTEMS 12', 'SYSTEMS 13', 'DELOITTE CONSULTING', 'INFOSYS',
+        ]
+        labels = canonical.cluster(names)
+        groups = {}
+        for name, label in zip(names, labels):
+            groups.setdefault(label, []).append(name)
+        self.assertEqual(sorted(groups.values()), [
+            ['AMAZON SERVICES', 'AMAZONSERVICES', 'AMAZONCOM SERVICES'],
+            ['COGNIZANT TECHNOLOGY SOLUTIONS US', 'COGNIZANT TECHNOLOGY SOLUTION US'],
+            ['DELOITTE CONSULTING'], ['INFOSYS'], ['SYSTEMS 12'], ['SYSTEMS 13'],
+        ])
+
+    def test_candidate_pairs_match_exact_similarity(self):
+        names = ['COGNIZANT TECHNOLOGY SOLUTIONS US', 'COGNIZANT TECHNOLOGY SOLUTION US', 'INFOSYS', 'AB']
+        signatures = canonical.minhash_signatures(names)
+        # names shorter than a trigram are never candidates
+        self.assertTrue((signatures[3] == -1).all())
+        first, second = canonical.candidate_pairs(signatures)
+        self.assertEqual(list(zip(first, second)), [(0, 1)])
+
+    def test_employer_names(self):
+        counts = pd.Series({
+            'Google LLC': 10, 'GOOGLE, INC.': 5, 'google inc': 1,
+            'Cognizant Technology Solutions US Corp': 20, 'COGNIZANT TECHNOLOGY SOLUTION US CORP': 2,
+            'SYSTEMS 12 INC': 3, 'SYSTEMS 13 INC': 4,
+        })
+        table = canonical.EmployerNames.build(counts)
+        path = self.path('employer_names.npz')
+        table.save(path)
+        loaded = canonical.EmployerNames.load(path)
+        self.assertEqual(len(loaded), len(counts))
+        self.assertEqual(canonical.table_version(path), canonical.table_version(path))
+        self.assertIsNone(canonical.table_version(self.path('missing.npz')))
+
+        names = pd.Series([
+            'google inc', 'COGNIZANT TECHNOLOGY SOLUTION US CORP', 'SYSTEMS 13 INC', None,
+            'Acme Widgets, Inc.', 'Google LLC',
+        ], index=[5, 4, 3, 2, 1, 0])
+        for names_table in (table, loaded):
+            found = names_table.lookup(names)
+            self.assertEqual(list(found.index), [5, 4, 3, 2, 1, 0])
+            # variants get the most common spelling, unknown names are
+            # normalized and missing names stay missing
+            self.assertEqual(list(found), [
+                'GOOGLE', 'COGNIZANT TECHNOLOGY SOLUTIONS US', 'SYSTEMS 13', None,
+                'ACME WIDGETS', 'GOOGLE',
+            ])
+
+
+class PartitionTestCase(TempDirTestCase):
+    """partitions of random rows for FY2019 and FY2020 under stores/"""
+
+    def setUp(self):
+        super().setUp()
+        self.root = self.path('stores')
+        for year, seed in ((2019, 0), (2020, 1)):
+            self.write_partition(year, random_frame(500, seed))
+
+    def write_partition(self, year, frame):
+        directory = partitions.partition_dir(self.root, year)
+        self.write_store(directory, [(self.write_file('fy%d.csv' % year), [frame])])
+        partitions.write_summary(directory)
+        return directory
+
+    def catalog(self, **options):
+        return partitions.PartitionCatalog(self.root, ['15'], **options)
+
+
+class PartitionCatalogTests(PartitionTestCase):
+
+    def test_years(self):
+        catalog = self.catalog()
+        self.assertEqual(catalog.years, [2019, 2020])
+        self.assertEqual(catalog.default_year, 2020)
+        self.assertEqual(self.catalog(default_year=2019).default_year, 2019)
+        with self.assertRaises(KeyError):
+            catalog.dataset(2018)
+
+    def test_keeps_max_open_years_loaded(self):
+        catalog = self.catalog(max_open=1)
+        data = catalog.dataset(2019)
+        self.assertIs(catalog.dataset('2019'), data)
+        self.assertEqual(catalog.loaded(), {2019: data})
+        self.assertEqual(list(catalog.loaded()), [2019])
+        catalog.dataset(2020)
+        self.assertEqual(list(catalog.loaded()), [2020])
+
+    def test_loading_a_year_does_not_block_the_others(self):
+        catalog = self.catalog()
+        catalog.dataset(2019)
+        catalog.summary(2019)
+        loading, release = threading.Event(), threading.Event()
+        from_store = H1BDataset.from_store
+
+        def slow_from_store(*args, **kwargs):
+            loading.set()
+            release.wait(10)
+            return from_store(*args, **kwargs)
+
+        with mock.patch.object(H1BDataset, 'from_store', side_effect=slow_from_store) as load:
+            loaders = [threading.Thread(target=catalog.dataset, args=(2020, )) for _ in range(2)]
+            for loader in loaders:
+                loader.start()
+            self.assertTrue(loading.wait(10))
+
+            # FY2019 is answered while FY2020 is still loading
+            other = threading.Thread(target=lambda: (
+                catalog.dataset(2019), catalog.summary(2019), catalog.aggregates(2019),
+            ))
+            other.start()
+            other.join(10)
+            self.assertFalse(other.is_alive())
+
+            release.set()
+            for loader in loaders:
+                loader.join(10)
+        # and FY2020 was only loaded once
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(sorted(catalog.loaded()), [2019, 2020])
+
+
+class PartitionRebuildTests(PartitionTestCase):
+    """a running catalog picking up partitions rebuilt by `build_h1b_store --append`"""
+
+    def rebuild(self, year, frames):
+        """write the year's partition again with a second source file added"""
+        directory = partitions.partition_dir(self.root, year)
+        added = self.write_file('fy%d-update.csv' % year, 'more disclosure data\n')
+        self.write_store(directory, [
+            (self.path('fy%d.csv' % year), [random_frame(500, 1)]), (added, frames),
+        ])
+        partitions.write_summary(directory)
+        return directory
+
+    def test_reloads_a_rebuilt_partition(self):
+        catalog = self.catalog()
+        before = catalog.version(2020)
+        data, summary, aggregates = catalog.dataset(2020), catalog.summary(2020), catalog.aggregates(2020)
+        self.assertEqual((data.version, summary.version, aggregates.version), (before,) * 3)
+        self.assertIs(catalog.dataset(2020), data)
+
+        added = random_frame(300, 2)
+        directory = self.rebuild(2020, [added])
+        after = catalog.version(2020)
+        self.assertNotEqual(after, before)
+        self.assertEqual(after, store.read_manifest(directory)['dataset_version'])
+        self.assertEqual(catalog.dataset(2020).version, after)
+        self.assertEqual(len(catalog.dataset(2020)), len(data) + (added['soc_major_group'] == '15').sum())
+        self.assertEqual(catalog.summary(2020).version, after)
+        self.assertEqual(catalog.aggregates(2020).version, after)
+        # the other year is untouched
+        self.assertEqual(catalog.version(2019), self.catalog().version(2019))
+
+    def test_shared_copy_of_a_rebuilt_partition(self):
+        directory = partitions.partition_dir(self.root, 2020)
+        H1BDataset.save_shared(directory, ['15'])
+        catalog = self.catalog(shared=True)
+        data = catalog.dataset(2020)
+
+        # served from the old copy until the new one is saved
+        self.rebuild(2020, [random_frame(300, 2)])
+        self.assertIs(catalog.dataset(2020), data)
+        H1BDataset.save_shared(directory, ['15'])
+        self.assertEqual(catalog.dataset(2020).version, catalog.version(2020))
+        self.assertNotEqual(catalog.dataset(2020).version, data.version)
+
+        # a year that was never loaded still needs its copy
+        with self.assertRaises(FileNotFoundError):
+            catalog.dataset(2019)
+
+
+class MaterializedTests(SimpleTestCase):
+
+    def test_serves_results_of_the_current_version(self):
+        version = ['v1']
+        calls = []
+        materialized = Materialized(lambda: version[0])
+
+        @materialized.serve
+        def figure(companies, year):
+            calls.append((companies, year))
+            return {'companies': companies, 'version': version[0]}
+
+        self.assertEqual(materialized.compute('v1', [('figure', [['GOOGLE'], 2019])]), [
+            {'companies': ['GOOGLE'], 'version': 'v1'},
+        ])
+        self.assertEqual(figure(['GOOGLE'], 2019), {'companies': ['GOOGLE'], 'version': 'v1'})
+        self.assertEqual(len(calls), 1)
+        figure(['MICROSOFT'], 2019)
+        self.assertEqual(len(calls), 2)
+
+        # results stored for an older version are computed again
+        version[0] = 'v2'
+        self.assertEqual(figure(['GOOGLE'], 2019), {'companies': ['GOOGLE'], 'version': 'v2'})
+        self.assertEqual(len(calls), 3)
+        materialized.compute('v2', [('figure', [['GOOGLE'], 2019])])
+        self.assertEqual(len(materialized), 1)
+        figure(['GOOGLE'], 2019)
+        self.assertEqual(len(calls), 4)
+
+
+class ApiTests(PartitionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.partitions = self.catalog()
+        patcher = mock.patch.object(api, 'catalog', return_value=self.partitions)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # every test's stores have the same version, but not always the same rows
+        api.responses.clear()
+        self.addCleanup(api.responses.clear)
+        frame = random_frame(500, seed=1)
+        self.frame = frame[frame['soc_major_group'] == '15']
+
+    def get(self, view, query=None, **headers):
+        return view(self.factory.get('/api/', query or {}, **headers))
+
+    def post(self, body):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        return api.batch_view(self.factory.post('/api/', body, content_type='application/json'))
+
+    def test_years(self):
+        # only the manifests are read, not any year's tables
+        with mock.patch.object(partitions, 'YearAggregates', side_effect=AssertionError):
+            body = json.loads(self.get(api.years_view).content)
+        self.assertEqual(body['default_year'], 2020)
+        self.assertEqual(body['years'], {
+            str(year): store.read_manifest(partitions.partition_dir(self.root, year))['dataset_version']
+            for year in (2019, 2020)
+        })
+        self.assertEqual(body['soc_major_groups'], ['15'])
+
+    def test_aggregates_match_pandas(self):
+        response = self.get(api.aggregates_view, {'year': '2020', 'group_by': 'employer', 'states': 'CA'})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body['group_by'], ['employer', 'state'])
+        # only the dashboard's SOC groups are counted, like in its charts
+        self.assertEqual(body['soc_major_groups'], ['15'])
+
+        selected = self.frame[self.frame[STATE] == 'CA']
+        counts = selected[EMPLOYER].value_counts()
+        found = {record['employer']: record['count'] for record in body['results']}
+        self.assertEqual(found, counts.to_dict())
+        self.assertEqual([record['count'] for record in body['results']], sorted(counts, reverse=True))
+        for record in body['results']:
+            self.assertEqual(record['state'], 'CA')
+            pay = selected.loc[selected[EMPLOYER] == record['employer'], 'annual_pay']
+            self.assertAlmostEqual(record['mean_pay'], pay.mean(), places=1)
+            self.assertAlmostEqual(record['pay_percentiles']['50'], np.percentile(pay, 50), places=1)
+
+    def test_batch(self):
+        employer = self.frame[EMPLOYER].iloc[0]
+        response = self.post({'cells': [
+            {'employer': employer}, {'state': 'CA', 'soc': 'ACTUARIES'}, {'employer': 'NOT IN THE DATA'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual(results[0]['count'], (self.frame[EMPLOYER] == employer).sum())
+        self.assertEqual(results[1]['count'], (
+            (self.frame[STATE] == 'CA') & (self.frame[SOC] == 'ACTUARIES')
+        ).sum())
+        self.assertEqual(results[2], {
+            'employer': 'NOT IN THE DATA', 'count': 0, 'mean_pay': None, 'pay_percentiles': None,
+        })
+
+    def test_not_modified(self):
+        query = {'year': '2019', 'group_by': 'state'}
+        first = self.get(api.aggregates_view, query)
+        self.assertEqual(first.status_code, 200)
+        second = self.get(api.aggregates_view, query, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+    def test_bad_requests(self):
+        for query in (
+                {'year': 'next'}, {'year': '2018'}, {'group_by': 'city'}, {'group_by': ','},
+                {'limit': '0'}, {'limit': 'ten'}, {'jobs': ['ACTUARIES', 'STATISTICIANS']},
+        ):
+            response = self.get(api.aggregates_view, query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('error', json.loads(response.content))
+        for body in ('not json', [], {'cells': 'GOOGLE'}, {'year': 2018, 'cells': []},
+                     {'cells': [{'city': 'SEATTLE'}]}, {'cells': [{}]}, {'cells': [{'state': 6}]}):
+            self.assertEqual(self.post(body).status_code, 400, body)
+        self.assertEqual(api.batch_view(self.factory.get('/api/')).status_code, 405)
+        self.assertEqual(api.aggregates_view(self.factory.post('/api/')).status_code, 405)
+
+    def test_tables_follow_the_soc_groups(self):
+        self.assertEqual(self.partitions.aggregates(2020).soc_major_groups, ['15'])
+        # tables counting other groups are refused rather than written on a request
+        wider = partitions.PartitionCatalog(self.root, ['15', '17'])
+        with self.assertRaisesRegex(FileNotFoundError, 'build_h1b_store --soc-groups 15 17'):
+            wider.aggregates(2020)
+        directory = partitions.partition_dir(self.root, 2020)
+        self.assertTrue(partitions.ensure_summary(directory, ['15', '17']))
+        self.assertFalse(partitions.ensure_summary(directory, ['17', '15']))
+        self.assertEqual(wider.aggregates(2020).soc_major_groups, ['15', '17'])
+        self.assertEqual(wider.summary(2020).soc_major_groups, ['15', '17'])
+        _, results = wider.aggregates(2020).query((SOC, ), {}, 10)
+        self.assertEqual(sum(record['count'] for record in results), 500)
+        with self.assertRaises(FileNotFoundError):
+            self.catalog().aggregates(2020)
+        # the tables are replaced whole, leaving no temporary files behind
+        self.assertEqual(sorted(name for name in os.listdir(directory) if '.tmp-' in name), [])
+
+
+class Clock:
+    """perf_counter stand-in moved forward by hand"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        for name, value in (('registry', metrics.Registry()), ('time', mock.Mock(perf_counter=self.clock))):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def histogram(self, name, **labels):
+        return metrics.registry.histograms[name][tuple(sorted(labels.items()))]
+
+    def test_render(self):
+        registry = metrics.Registry()
+        for value in (0.5, 2, 3):
+            registry.observe('h1b_test_seconds', value, buckets=(1, 2), help='test timings',
+                             callback='say "hi"\\now\nplease')
+        registry.gauge('h1b_test_loaded', lambda: [({'year': 2019}, 3), ({'year': 2020}, 0.5)], help='loaded')
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP h1b_test_seconds test timings',
+            '# TYPE h1b_test_seconds histogram',
+            'h1b_test_seconds_bucket{callback="say \\"hi\\"\\\\now\\nplease",le="1"} 1',
+            'h1b_test_seconds_bucket{callback="say \\"hi\\"\\\\now\\nplease",le="2"} 2',
+            'h1b_test_seconds_bucket{callback="say \\"hi\\"\\\\now\\nplease",le="+Inf"} 3',
+            'h1b_test_seconds_sum{callback="say \\"hi\\"\\\\now\\nplease"} 5.5',
+            'h1b_test_seconds_count{callback="say \\"hi\\"\\\\now\\nplease"} 3',
+            '# HELP h1b_test_loaded loaded',
+            '# TYPE h1b_test_loaded gauge',
+            'h1b_test_loaded{year="2019"} 3',
+            'h1b_test_loaded{year="2020"} 0.5',
+        ]) + '\n')
+
+        registry.clear()
+        self.assertNotIn('h1b_test_seconds', registry.render())
+
+    def test_stage_self_time(self):
+        clock = self.clock
+
+        @metrics.instrument
+        def update_chart(companies, states, year=None):
+            clock.now += 1
+            with metrics.stage('filter'):
+                clock.now += 2
+                with metrics.stage('aggregate'):
+                    clock.now += 4
+            metrics.staged('aggregate')(lambda: setattr(clock, 'now', clock.now + 8))()
+            return 'figure'
+
+        self.assertEqual(update_chart(['GOOGLE', 'AMAZON'], [], year=2019), 'figure')
+        self.assertEqual(self.histogram('h1b_callback_seconds', callback='update_chart').sum, 15)
+        stages = {
+            name: self.histogram('h1b_callback_stage_seconds', callback='update_chart', stage=name).sum
+            for name in ('figure', 'filter', 'aggregate')
+        }
+        # nested stages only count for the innermost one
+        self.assertEqual(stages, {'figure': 1, 'filter': 2, 'aggregate': 12})
+        sizes = {
+            name: self.histogram('h1b_callback_selection_size', callback='update_chart', input=name)
+            for name in ('companies', 'states')
+        }
+        self.assertEqual((sizes['companies'].sum, sizes['states'].sum), (2, 0))
+
+        # outside an instrumented callback stages aren't recorded
+        with metrics.stage('filter'):
+            pass
+        self.assertEqual(self.histogram('h1b_callback_seconds', callback='update_chart').count, 1)
+
+    def test_update_view(self):
+        clock = self.clock
+
+        @metrics.instrument
+        def update_chart(companies):
+            clock.now += 1
+            return 'figure'
+
+        def view(request, callback=True):
+            if callback:
+                update_chart(['GOOGLE'])
+            clock.now += 0.5
+            return HttpResponse(b'x' * 300)
+
+        view = metrics.instrument_update_view(view)
+        view(None)
+        self.assertEqual(self.histogram('h1b_update_seconds', callback='update_chart').sum, 1.5)
+        serialize = self.histogram('h1b_callback_stage_seconds', callback='update_chart', stage='serialize')
+        self.assertEqual(serialize.sum, 0.5)
+        self.assertEqual(self.histogram('h1b_update_response_bytes', callback='update_chart').sum, 300)
+
+        # a request that didn't reach an instrumented callback
+        view(None, callback=False)
+        self.assertEqual(self.histogram('h1b_update_seconds', callback='unknown').count, 1)
+
+        response = metrics.metrics_view(None)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn(b'h1b_update_seconds_count{callback="unknown"} 1', response.content)
+
+    def test_slow_callback_profiler(self):
+        patcher = mock.patch.object(metrics, 'time', time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(metrics.configure)
+
+        @metrics.instrument
+        def slow_chart():
+            started = time.perf_counter()
+            while time.perf_counter() - started < 0.1:
+                pass
+
+        @metrics.instrument
+        def fast_chart():
+            pass
+
+        with mock.patch.object(metrics.logger, 'warning') as warning:
+            metrics.configure(profile_slow_seconds=0.05, profile_interval=0.001)
+            fast_chart()
+            self.assertFalse(warning.called)
+            slow_chart()
+        self.assertEqual(warning.call_count, 1)
+        report = warning.call_args[0][0]
+        self.assertRegex(report, r'^slow_chart took 0\.1\d+s - \d+ stack samples')
+        self.assertIn('in slow_chart', report)
+        self.assertEqual(metrics.profiler.samples, {})
+
+
+class WarmupTests(SimpleTestCase):
+    """warm-up of a stand-in app module, whose import waits until released"""
+
+    def setUp(self):
+        self.loading, self.release = threading.Event(), threading.Event()
+        self.addCleanup(self.release.set)
+        self.error = None
+        self.imports = 0
+        self.module = mock.Mock(app='the dash app', refresh_figures=lambda: 'layout v1')
+
+        def import_module(name):
+            self.assertEqual(name, warmup.APP_MODULE)
+            self.imports += 1
+            self.loading.set()
+            self.release.wait(10)
+            if self.error is not None:
+                raise self.error
+            return self.module
+
+        for name, value in (
+                ('importlib', mock.Mock(import_module=import_module)), ('_thread', None),
+                ('_done', threading.Event()), ('state', dict(warmup.state, status='idle')),
+        ):
+            patcher = mock.patch.object(warmup, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def readiness(self):
+        response = warmup.readiness_view(RequestFactory().get('/ready/'))
+        return response.status_code, json.loads(response.content)
+
+    def test_ready_once_loaded(self):
+        self.assertEqual(self.readiness()[0], 503)
+        self.assertTrue(self.loading.wait(10))
+        warmup.progress("loading FY2019")
+        status, report = self.readiness()
+        self.assertEqual(status, 503)
+        self.assertEqual((report['status'], report['step']), ('loading', "loading FY2019"))
+        self.assertFalse(warmup.is_ready())
+
+        # starting again doesn't import the app twice
+        warmup.start()
+        self.release.set()
+        self.assertIs(warmup.wait(), self.module)
+        status, report = self.readiness()
+        self.assertEqual(status, 200)
+        self.assertEqual((report['status'], report['step'], report['error']), ('ready', None, None))
+        self.assertGreaterEqual(report['seconds'], 0)
+        self.assertEqual(self.imports, 2)
+
+        self.assertEqual(warmup.load_stateless_app(warmup.APP_NAME), 'the dash app')
+        self.assertIsNone(warmup.load_stateless_app('another_app'))
+        self.assertEqual(warmup.layout_version(), 'layout v1')
+
+    def test_failed_import(self):
+        self.error = ImproperlyConfigured("no H1B dataset store")
+        self.release.set()
+        with mock.patch.object(warmup.logger, 'exception') as log:
+            warmup.start()
+            warmup._done.wait(10)
+        self.assertTrue(log.called)
+        status, report = self.readiness()
+        self.assertEqual(status, 503)
+        self.assertEqual((report['status'], report['error']), ('failed', "no H1B dataset store"))
+        with self.assertRaisesRegex(ImproperlyConfigured, 'failed to load: no H1B dataset store'):
+            warmup.wait()
+        with self.assertRaises(ImproperlyConfigured):
+            warmup.layout_version()
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2, sizeof=lambda value: 0)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.items(), [('a', 1), ('c', 3)])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_items_leave_out_expired_entries(self):
+        now = [0]
+        cache = LRUCache(ttl=10, sizeof=lambda value: 0, timer=lambda: now[0])
+        cache.put('a', 1)
+        now[0] = 5
+        cache.put('b', 2)
+        now[0] = 12
+        self.assertEqual(cache.items(), [('b', 2)])
+        self.assertIsNone(cache.get('a'))
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache.put('a', 'x' * 6)
+        cache.put('b', 'x' * 6)
+        self.assertEqual([key for key, _ in cache.items()], ['b'])
+        cache.put('c', 'x' * 11)
+        self.assertNotIn('c', cache)
+
+
+class SharedDatasetTests(DatasetTestCase):
+
+    def test_saved_copy_matches_the_store(self):
+        H1BDataset.save_shared(self.path('store'))
+        shared = H1BDataset.from_store(self.path('store'), shared=True)
+        self.assertEqual(shared.version, self.data.version)
+        self.assertEqual(shared.vocab, self.data.vocab)
+        for name, values in self.data.arrays().items():
+            np.testing.assert_array_equal(shared.arrays()[name], values, name)
+        self.assertFalse(shared.annual_pay.flags.writeable)
+        for selection in self.selections(count=10):
+            np.testing.assert_array_equal(shared.select(*selection), self.data.select(*selection))
+
+    def test_missing_or_stale_copy_is_not_built(self):
+        with self.assertRaises(FileNotFoundError):
+            H1BDataset.from_store(self.path('store'), shared=True)
+        self.assertFalse([name for name in os.listdir(self.path('store')) if name.startswith('dataset-')])
+
+        # a copy saved from an earlier version of the store
+        directory = H1BDataset.save_shared(self.path('store'))
+        path = os.path.join(directory, 'dataset.json')
+        with open(path) as f:
+            saved = json.load(f)
+        with open(path, 'w') as f:
+            json.dump(dict(saved, version='earlier'), f)
+        with self.assertRaises(FileNotFoundError):
+            H1BDataset.from_store(self.path('store'), shared=True)
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class Messages(list):
+    """the ASGI messages sent to one client"""
+
+    async def send(self, message):
+        self.append(message)
+
+
+class ASGITests(SimpleTestCase):
+
+    def test_callbacks_beyond_the_queue_are_rejected(self):
+        scope = {'type': 'http', 'path': '/app/h1b_salary/_dash-update-component'}
+        sent = [Messages() for _ in range(3)]
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def callback(scope, receive, send):
+                await release.wait()
+                await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+
+            middleware = CallbackLimitMiddleware(callback, callback_concurrency=1, max_queued=1)
+            requests = [asyncio.ensure_future(middleware(scope, None, messages.send)) for messages in sent]
+            await asyncio.sleep(0.05)
+            during = middleware.stats()
+            release.set()
+            await asyncio.gather(*requests)
+            return during, middleware.stats()
+
+        during, after = run_async(scenario())
+        self.assertEqual(during, {'running': 1, 'queued': 1, 'rejected': 1})
+        self.assertEqual(after, {'running': 0, 'queued': 0, 'rejected': 1})
+        self.assertEqual([messages[0]['status'] for messages in sent], [200, 200, 503])
+
+    def test_streaming_content_is_generated_off_the_event_loop(self):
+        threads = []
+
+        def content():
+            for part in ('a,b\n', '1,2\n'):
+                threads.append(threading.current_thread())
+                yield part
+
+        response = StreamingHttpResponse(content(), content_type='text/csv')
+        messages = Messages()
+        run_async(ThreadedStreamingHandler().send_response(response, messages.send))
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'text/csv'), messages[0]['headers'])
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages[1:]), b'a,b\n1,2\n')
+        self.assertFalse(messages[-1].get('more_body', False))
+
+
+class HttpCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.version = 'v1'
+        self.calls = 0
+        self.factory = RequestFactory()
+
+        def view(request, ident):
+            self.calls += 1
+            if ident == 'missing':
+                return HttpResponseNotFound('no such app')
+            return HttpResponse(('layout of %s at %s' % (ident, self.version)).encode('utf-8'),
+                                content_type='application/json')
+
+        self.view = cache_per_version(lambda: self.version, cache_control='no-cache')(view)
+
+    def get(self, ident='app', **headers):
+        return self.view(self.factory.get('/app/%s/_dash-layout' % ident, **headers), ident=ident)
+
+    def test_rendered_once_per_version(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, b'layout of app at v1')
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+        self.assertIn('Accept-Encoding', first['Vary'])
+        self.assertEqual(self.get().content, first.content)
+        self.assertEqual(self.calls, 1)
+
+        self.version = 'v2'
+        second = self.get()
+        self.assertEqual(second.content, b'layout of app at v2')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.calls, 2)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='W/' + etag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"something else"').status_code, 200)
+
+        # the old tag no longer matches once the data changes
+        self.version = 'v2'
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_compressed_copy(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'layout of app at v1')
+        self.assertNotEqual(response['ETag'], self.get()['ETag'])
+        self.assertEqual(
+            self.get(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304,
+        )
+        self.assertFalse(self.get(HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+
+    def test_errors_and_posts_are_not_cached(self):
+        self.assertEqual(self.get('missing').status_code, 404)
+        self.assertEqual(self.get('missing').status_code, 404)
+        self.assertEqual(self.calls, 2)
+        self.view(self.factory.post('/app/app/_dash-layout'), ident='app')
+        self.view(self.factory.post('/app/app/_dash-layout'), ident='app')
+        self.assertEqual(self.calls, 4)
+
+
+def callback_app():
+    """a DjangoDash app with a single-output callback and a multi-output one"""
+    app = DjangoDash('FastUpdateTest')
+    app.layout = html.Div([
+        dcc.Input(id='rows'), dcc.Input(id='title'), dcc.Graph(id='chart'),
+        html.Div(id='first'), html.Div(id='second'),
+    ])
+
+    @app.callback(Output('chart', 'figure'), [Input('rows', 'value')], [State('title', 'value')])
+    def chart(rows, title):
+        if rows is None:
+            raise PreventUpdate
+        pay = np.where(np.arange(rows) % 2, np.linspace(0.5, 1.5, rows), np.nan)
+        return {
+            'data': [figures.bar(x=np.arange(rows), y=pay)],
+            'layout': figures.layout(title=title, xaxis={'title': pd.Timestamp('2020-01-02')}),
+        }
+
+    @app.callback([Output('first', 'children'), Output('second', 'children')], [Input('rows', 'value')])
+    def both(rows):
+        return rows, rows
+
+    return app
+
+
+class FastUpdateTests(SimpleTestCase):
+
+    def setUp(self):
+        self.app = callback_app()
+        patcher = mock.patch.object(warmup, 'load_stateless_app', return_value=self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.view = mock.Mock(return_value=HttpResponse('from the wrapped view'))
+        self.factory = RequestFactory()
+
+    def body(self, output, rows=4):
+        return {
+            'output': output,
+            'inputs': [{'id': 'rows', 'property': 'value', 'value': rows}],
+            'state': [{'id': 'title', 'property': 'value', 'value': 'pay'}],
+        }
+
+    def update(self, body, stateless=True):
+        request = self.factory.post('/app/FastUpdateTest/_dash-update-component',
+                                    json.dumps(body), content_type='application/json')
+        return figures.fast_update(self.view)(request, 'FastUpdateTest', stateless=stateless)
+
+    def dispatch(self, body):
+        """the response Dash itself gives, as django_plotly_dash's update view has it dispatched"""
+        instance = self.app.form_dash_instance()
+        with instance.test_request_context(json=body):
+            return instance.dispatch()
+
+    def test_routes_single_output_callbacks(self):
+        self.assertEqual(sorted(figures.routes(self.app)), ['chart.figure'])
+        route = figures.routes(self.app)['chart.figure']
+        self.assertEqual(route.output, 'figure')
+        self.assertEqual(route.arguments, [('rows', 'value'), ('title', 'value')])
+
+    def test_response_matches_dash(self):
+        body = self.body('chart.figure')
+        response = self.update(body)
+        self.view.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), json.loads(self.dispatch(body)))
+
+    def test_prevent_update(self):
+        response = self.update(self.body('chart.figure', rows=None))
+        self.view.assert_not_called()
+        self.assertEqual(response.status_code, 204)
+
+    def test_other_requests_fall_through(self):
+        for body, stateless in (
+                (self.body('..first.children...second.children..'), True),
+                (self.body('missing.children'), True),
+                (dict(self.body('chart.figure'), state=[]), True),
+                (self.body('chart.figure'), False),
+        ):
+            self.view.reset_mock()
+            self.assertEqual(self.update(body, stateless=stateless).content, b'from the wrapped view')
+            self.view.assert_called_once()
+        with override_settings(H1B_FAST_FIGURES=False):
+            self.update(self.body('chart.figure'))
+        self.assertEqual(self.view.call_count, 2)
+
+    def test_dumps_matches_plotly(self):
+        for value in (
+                np.array([1.5, np.nan, 3.0]), np.arange(6).reshape(2, 3)[:, 1],
+                np.array(['a', None], dtype=object),
+                float('nan'), np.float64('nan'), np.int64(3),
+                pd.Timestamp('2020-01-02 03:04:05.5'), pd.Timestamp('2020-01-02', tz='US/Eastern'),
+                pd.Series([1.0, np.nan]), {'bar': figures.bar(y=np.array([np.nan, 2.0]))},
+        ):
+            self.assertEqual(
+                json.loads(figures.dumps(value)), json.loads(json.dumps(value, cls=PlotlyJSONEncoder)),
+                value,
+            )
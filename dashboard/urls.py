@@ -1,11 +1,47 @@
+from django.conf import settings
 from django.urls import path, include
+from django.views.decorators.csrf import csrf_exempt
+from django_plotly_dash.access import process_view_function
+from django_plotly_dash.views import dependencies, layout, update
+
 from . import views
-from dashboard.dash_apps.finished_apps import h1b_salary
+from dashboard import api, warmup
+from dashboard.export import export_view
+from dashboard.figures import fast_update
+from dashboard.http_cache import cache_per_version
+from dashboard.metrics import instrument_update_view, metrics_view
+
+# the layout and dependencies of the stateless app only change with the
+# data, so they are served from a cache ahead of django_plotly_dash's routes
+cache_dash_response = cache_per_version(
+    warmup.layout_version, cache_control=settings.H1B_LAYOUT_CACHE_CONTROL,
+)
 
 urlpatterns = [
     path('', views.h1b_salary_dashboard, name='h1b_salary_dashboard'),
     path('about/', views.about, name='dashboards_about'),
     path('salaries/', views.h1b_salary_dashboard, name='h1b_salary_dashboard'),
+    path('metrics/', metrics_view, name='dashboards_metrics'),
+    path('ready/', warmup.readiness_view, name='dashboards_ready'),
+    path('export/', export_view, name='dashboards_export'),
+    path('api/v1/years/', api.years_view, name='api_years'),
+    path('api/v1/aggregates/', api.aggregates_view, name='api_aggregates'),
+    path('api/v1/aggregates/batch/', api.batch_view, name='api_aggregates_batch'),
+    path('app/<slug:ident>/_dash-layout',
+         process_view_function(cache_dash_response(layout), route_name='app-layout',
+                               url_part='_dash-layout', name='layout'),
+         {'stateless': True}),
+    path('app/<slug:ident>/_dash-dependencies',
+         process_view_function(cache_dash_response(dependencies), route_name='app-dependencies',
+                               url_part='_dash-dependencies', name='dependencies'),
+         {'stateless': True}),
+    # callback requests are timed for the metrics view, and the dashboard's
+    # own callbacks take the fast path
+    path('app/<slug:ident>/_dash-update-component',
+         process_view_function(instrument_update_view(csrf_exempt(fast_update(update))),
+                               route_name='app-update-component',
+                               url_part='_dash-update-component', name='update-component'),
+         {'stateless': True}),
     path('', include('django_plotly_dash.urls')),
 
 ]
@@ -1,6 +1,8 @@
 from django.shortcuts import render
 from django.http import HttpResponse
 
+from dashboard import warmup
+
 def home(request):
     return render(request, 'dashboard/home.html')
 
@@ -8,4 +10,6 @@ def about(request):
     return render(request, 'dashboard/about.html')
 
 def h1b_salary_dashboard(request):
-    return render(request, 'dashboard/h1b_data.html')
+    # the page reloads itself until the data has finished loading
+    warmup.start()
+    return render(request, 'dashboard/h1b_data.html', {'loading': not warmup.is_ready()})
@@ -0,0 +1,106 @@
+"""
+Background loading of the dashboard's data.
+
+Importing the Dash app loads the dataset, so instead of importing it from the
+url conf the app is imported by a warm-up thread started when the server
+boots, and django_plotly_dash is pointed at load_stateless_app to find it.
+Pages that don't need the data are served straight away; the readiness view
+reports how far loading has got, and Dash requests arriving early wait for
+it to finish.
+
+Every server process warms up on its own once it has started, so servers
+mustn't import the app before forking workers (no gunicorn --preload). With
+H1B_SHARED_DATASET each worker only memory maps the copy of the data that
+build_h1b_store saved, so this is quick and the pages are shared anyway.
+"""
+import importlib
+import logging
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+APP_MODULE = 'dashboard.dash_apps.finished_apps.h1b_salary'
+APP_NAME = 'h1b_salary'
+
+_lock = threading.Lock()
+_done = threading.Event()
+_thread = None
+
+# what the readiness view reports
+state = {
+    'status': 'idle',
+    'step': None,
+    'started_at': None,
+    'finished_at': None,
+    'error': None,
+}
+
+
+def progress(step):
+    """record the loading step in progress, for the readiness view"""
+    state['step'] = step
+    logger.info("dashboard warm-up: %s", step)
+
+
+def _load():
+    state['status'] = 'loading'
+    state['started_at'] = time.time()
+    try:
+        importlib.import_module(APP_MODULE)
+    except Exception as error:
+        logger.exception("dashboard warm-up failed")
+        state['status'] = 'failed'
+        state['error'] = str(error)
+    else:
+        state['status'] = 'ready'
+        state['step'] = None
+    state['finished_at'] = time.time()
+    _done.set()
+
+
+def start():
+    """start loading the dashboard in a background thread, once per process"""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_load, name='h1b-warmup', daemon=True)
+            _thread.start()
+
+
+def is_ready():
+    return state['status'] == 'ready'
+
+
+def wait():
+    """block until loading has finished, starting it if needed, and return the app module"""
+    start()
+    _done.wait()
+    if state['status'] != 'ready':
+        raise ImproperlyConfigured("the H1B dashboard failed to load: %s" % state['error'])
+    return importlib.import_module(APP_MODULE)
+
+
+def load_stateless_app(name):
+    """django_plotly_dash stateless_loader - the Dash app once it has loaded"""
+    if name == APP_NAME:
+        return wait().app
+    return None
+
+
+def layout_version():
+    """version of the loaded app's layout, see h1b_salary.refresh_figures"""
+    return wait().refresh_figures()
+
+
+def readiness_view(request):
+    """load progress as json - 200 once the dashboard can serve data, 503 until then"""
+    start()
+    report = dict(state)
+    if state['started_at'] is not None:
+        report['seconds'] = (state['finished_at'] or time.time()) - state['started_at']
+    return JsonResponse(report, status=200 if is_ready() else 503)
+
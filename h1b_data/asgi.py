@@ -2,6 +2,7 @@
 ASGI config for h1b_data project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``daphne h1b_data.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +10,25 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'h1b_data.settings')
 
-application = get_asgi_application()
+# what django.core.asgi.get_asgi_application does, with a handler that
+# generates streaming responses off the event loop
+django.setup(set_prefix=False)
+
+from dashboard import metrics, warmup  # noqa: E402
+from dashboard.concurrency import CallbackLimitMiddleware, ThreadedStreamingHandler  # noqa: E402
+
+application = CallbackLimitMiddleware(ThreadedStreamingHandler(), **settings.H1B_ASGI)
+
+metrics.registry.gauge(
+    'h1b_asgi_callbacks',
+    lambda: [({'state': state}, value) for state, value in application.stats().items()],
+    help='Dash callbacks running and queued now, and rejected since the server started',
+)
+
+# load the dashboard's data in the background while requests are served
+warmup.start()
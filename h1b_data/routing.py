@@ -1,5 +1,8 @@
 from channels.routing import ProtocolTypeRouter
 
-application = ProtocolTypeRouter({
+from dashboard.concurrency import asgi2
+from h1b_data.asgi import application as http_application
 
+application = ProtocolTypeRouter({
+    'http': asgi2(http_application),
 })
@@ -100,6 +100,12 @@ CHANNEL_LAYERS = {
 
 X_FRAME_OPTIONS = 'ALLOW-FROM localhost:8000'
 
+# the Dash app is imported by a warm-up thread rather than the url conf, so
+# django_plotly_dash finds it through this hook
+PLOTLY_DASH = {
+    'stateless_loader': 'dashboard.warmup.load_stateless_app',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -162,3 +168,115 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
 
 
+# H1B dataset
+# the raw disclosure csv for each fiscal year and the local columnar store
+# built from them by `python manage.py build_h1b_store`. Every year gets its
+# own partition H1B_STORE_DIR/fy<year>. The csv files in data/ are git-lfs
+# pointers, so `build_h1b_store --download` fetches the real files from their
+# url first. The build streams the csv in chunks, so these can point at the
+# full h1b_disclosure_data.csv as well as the short extract. A year published
+# a quarter at a time can list every file ('csv' and 'url' as lists), and
+# `build_h1b_store --append` then only reads the files added or changed since
+# its partition was built.
+
+H1B_SOURCES = {
+    2019: {
+        'csv': os.path.join(BASE_DIR, 'data', 'h1b_disclosure_data_short.csv'),
+        'url': 'https://media.githubusercontent.com/media/Duwevans/h1b-app/master/data/h1b_disclosure_data_short.csv',
+    },
+}
+H1B_STORE_DIR = os.path.join(BASE_DIR, 'data', 'h1b_store')
+
+# year shown when the dashboard opens, and how many years a worker keeps
+# loaded at once - other years are loaded again when they are next selected
+H1B_DEFAULT_FISCAL_YEAR = 2019
+H1B_MAX_OPEN_PARTITIONS = 2
+
+# memory map the dashboard's arrays from a copy saved in each partition, so
+# every worker on the machine shares one copy of the data instead of building
+# its own. `build_h1b_store` saves the copy - the dashboard fails to load a
+# partition without an up to date one rather than building it
+H1B_SHARED_DATASET = True
+
+# SOC major groups kept in the store - "15" is Computer and Mathematical Occupations
+H1B_SOC_MAJOR_GROUPS = ['15']
+
+# table merging spelling variants of each employer name, built from every
+# csv in H1B_SOURCES by `python manage.py build_employer_names` (or the first
+# build_h1b_store). Names at least H1B_EMPLOYER_SIMILARITY alike (share of
+# character trigrams in common) are treated as the same employer. Set the
+# path to None to only strip punctuation and legal suffixes
+H1B_EMPLOYER_NAMES = os.path.join(BASE_DIR, 'data', 'employer_names.npz')
+H1B_EMPLOYER_SIMILARITY = 0.8
+
+# filtered row ids shared by the callbacks of one dropdown change
+H1B_SELECTION_CACHE = {
+    'max_entries': 256,
+    'max_bytes': 64 * 1024 * 1024,
+    'ttl': 600,
+}
+
+# ASGI mode (`daphne h1b_data.asgi:application`, what bin/web runs unless
+# the H1B_SERVER environment variable is "gunicorn"): views run on a pool of
+# `threads`, at most `callback_concurrency` Dash callbacks at once with up to
+# `max_queued` more waiting (for at most `queue_timeout` seconds). Callbacks
+# beyond that get a 503 with a Retry-After of `retry_after` seconds.
+H1B_ASGI = {
+    'threads': 8,
+    'callback_concurrency': 4,
+    'max_queued': 32,
+    'queue_timeout': 10,
+    'retry_after': 1,
+}
+
+# number of matching values offered by the company, job and state dropdowns
+# as the user types - the full lists are never sent to the browser
+H1B_SEARCH_RESULTS = 50
+
+# rows written per chunk by the streaming export at /export/
+H1B_EXPORT_CHUNK_ROWS = 10000
+
+# JSON aggregate api under /api/v1/ - rendered responses are kept per dataset
+# version in a cache of this size, and revalidated by clients with their ETag
+H1B_API_CACHE = {
+    'max_entries': 1024,
+    'max_bytes': 32 * 1024 * 1024,
+}
+H1B_API_CACHE_CONTROL = 'public, max-age=300'
+# most cells returned by one aggregates query, and asked for in one batch
+H1B_API_MAX_RESULTS = 1000
+H1B_API_MAX_BATCH = 1000
+
+# Cache-Control for the cached Dash layout and dependency responses - browsers
+# revalidate them with their ETag and get a 304 until the data is rebuilt
+H1B_LAYOUT_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+# answer the dashboard's callback requests directly, skipping the per-request
+# Dash instance and plotly's json encoder (see dashboard.figures)
+H1B_FAST_FIGURES = True
+
+# selections whose figures are computed at warm-up, besides the default one
+# (whose figures are also embedded in the layout) - each a dict of
+# 'companies', 'jobs' and 'states' lists, and optionally 'percentiles' and
+# 'year' (the default year if left out)
+H1B_MATERIALIZED_SELECTIONS = []
+
+# draw the four count charts in the browser from a table of counts per
+# (employer, SOC, state) combination, sent once per fiscal year, instead of
+# asking the server on every dropdown change (only ranking the companies by
+# median pay still asks the server, see dashboard.ranking). The table grows
+# with the number of combinations, so this suits the SOC-filtered store better
+# than one holding every occupation
+H1B_CLIENTSIDE_COUNTS = False
+
+# companies per page of the chart of every company, which ranks them by
+# filings or by median pay - the first size is the default
+H1B_TOP_EMPLOYERS_PAGE_SIZES = [25, 50, 100]
+
+# log where callbacks slower than `profile_slow_seconds` spend their time,
+# from stacks sampled every `profile_interval` seconds - None turns it off.
+# Latency histograms are always served at /metrics/ for Prometheus.
+H1B_PROFILING = {
+    'profile_slow_seconds': None,
+    'profile_interval': 0.005,
+}
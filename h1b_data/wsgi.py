@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'h1b_data.settings')
 
 application = get_wsgi_application()
+
+# load the dashboard's data in the background while requests are served
+from dashboard import warmup  # noqa: E402
+
+warmup.start()